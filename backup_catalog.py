@@ -0,0 +1,186 @@
+import json
+import os
+import threading
+import time
+from typing import List, Optional
+
+import taskpool
+from logger import logger
+
+BACKUP_DIR = "pcbackups"
+INDEX_FILE = "pcbackups.json"  # outside BACKUP_DIR, so writing it doesn't change the directory's mtime
+LOG_SUFFIX = "-log.pc"
+LATEST_SUFFIX = "-latest.pc"
+
+# retention policy, applied in the background whenever new backups show up
+KEEP_COUNT = 500  # inflations
+KEEP_DAYS = 90
+KEEP_BYTES = 512 * 1024 * 1024
+
+_lock = threading.Lock()
+_entries = None  # type: Optional[List[dict]]  # oldest first. each entry has datestr, mtime and size
+_dir_mtime = None  # mtime of BACKUP_DIR when the catalog last matched it
+_refresh_task = None  # type: Optional[taskpool.Task]
+
+
+def log_path(datestr: str):
+	return os.path.join(BACKUP_DIR, datestr + LOG_SUFFIX)
+
+
+def latest_path(datestr: str):
+	return os.path.join(BACKUP_DIR, datestr + LATEST_SUFFIX)
+
+
+def record(datestr: str):
+	"""
+	Adds a backup to the catalog. The backup writer should call this right after writing both files of a backup, so
+	the catalog never has to list the directory to find it.
+
+	:param datestr: date prefix shared by the -log.pc and -latest.pc files
+	"""
+	entry = _stat_entry(datestr)
+	with _lock:
+		entries = _load()
+		entries[:] = [e for e in entries if e["datestr"] != datestr]
+		entries.append(entry)
+		entries.sort(key=lambda e: e["datestr"])  # date strings are the same length so they sort as dates
+		_save(entries)
+	prune_async()
+
+
+def latest(n=1) -> List[str]:
+	"""
+	Gets the date strings of the most recent complete backups, newest first. Never lists the directory, so it is safe
+	on the Tk thread. Backups written without record() show up once refresh_if_changed() has caught up
+
+	:param n: max number of backups to return
+	"""
+	with _lock:
+		entries = _load()
+		return [e["datestr"] for e in reversed(entries)][:n]
+
+
+def refresh_if_changed() -> Optional[taskpool.Task]:
+	"""
+	If the directory changed since the catalog last matched it, list it in the background to pick up backups that
+	weren't recorded
+
+	:return: the refresh task, or None if the catalog is up to date
+	"""
+	global _refresh_task
+	with _lock:
+		_load()
+		if _dir_mtime is not None and _dir_mtime == _current_dir_mtime():
+			return None
+		if _refresh_task is None or _refresh_task.done():
+			_refresh_task = taskpool.submit("refresh_backups", _refresh)
+		return _refresh_task
+
+
+def prune():
+	"""
+	Deletes backups outside the retention policy. Deleting on a share can be slow, see prune_async()
+	"""
+	with _lock:
+		entries = _load()
+		victims = _prune(entries)
+		if victims:
+			_save(entries)
+	# the catalog no longer lists them, so readers don't wait on the deletes
+	for path in victims:
+		try:
+			os.remove(path)
+		except FileNotFoundError:
+			pass
+		except OSError as e:
+			logger.warning(f"could not remove old backup {path}", exc_info=e)
+
+
+def prune_async() -> taskpool.Task:
+	return taskpool.submit("prune_backups", prune)
+
+
+def _stat_entry(datestr):
+	size = 0
+	mtime = 0.0
+	for path in (log_path(datestr), latest_path(datestr)):
+		try:
+			st = os.stat(path)
+		except OSError:
+			continue
+		size += st.st_size
+		mtime = max(mtime, st.st_mtime)
+	return {"datestr": datestr, "mtime": mtime, "size": size}
+
+
+def _current_dir_mtime():
+	try:
+		return os.stat(BACKUP_DIR).st_mtime
+	except OSError:
+		return None
+
+
+def _load():
+	# the catalog as last saved. reading the index is cheap, finding unrecorded backups is left to _refresh()
+	global _entries, _dir_mtime
+	if _entries is None:
+		try:
+			with open(INDEX_FILE) as f:
+				index = json.load(f)
+			_entries, _dir_mtime = index["entries"], index["dir_mtime"]
+		except FileNotFoundError:
+			_entries = []
+		except (OSError, ValueError, KeyError) as e:
+			logger.warning(f"backup catalog unreadable, rebuilding: {e}")
+			_entries = []
+	return _entries
+
+
+def _refresh():
+	# list the directory without holding the lock, then merge: only new complete backups are statted
+	dir_mtime = _current_dir_mtime()
+	if dir_mtime is None:
+		os.makedirs(BACKUP_DIR, exist_ok=True)
+		dir_mtime = _current_dir_mtime()
+	names = set(os.listdir(BACKUP_DIR))
+	complete = {name[:-len(LOG_SUFFIX)] for name in names
+				if name.endswith(LOG_SUFFIX) and name[:-len(LOG_SUFFIX)] + LATEST_SUFFIX in names}
+	with _lock:
+		known = {e["datestr"] for e in _load()}
+	new = [_stat_entry(datestr) for datestr in complete - known]
+	with _lock:
+		entries = _load()
+		# only complete backups can be restored. anything recorded since the listing is kept
+		entries[:] = [e for e in entries if e["datestr"] in complete or e["datestr"] not in known] + new
+		entries.sort(key=lambda e: e["datestr"])
+		_save(entries, dir_mtime)
+	if new:
+		logger.info(f"added {len(new)} unrecorded backups to the catalog")
+		prune()
+
+
+def _prune(entries: List[dict]) -> List[str]:
+	# drop the oldest backups from entries until the catalog is within every limit, the newest backup is always kept.
+	# returns the files to delete
+	cutoff = time.time() - KEEP_DAYS * 86400
+	total = sum(e["size"] for e in entries)
+	victims = []
+	while len(entries) > 1 and (len(entries) > KEEP_COUNT or entries[0]["mtime"] < cutoff or total > KEEP_BYTES):
+		old = entries.pop(0)
+		total -= old["size"]
+		victims += [log_path(old["datestr"]), latest_path(old["datestr"])]
+	return victims
+
+
+def _save(entries: List[dict], dir_mtime=None):
+	global _dir_mtime
+	try:
+		if dir_mtime is None:
+			dir_mtime = _current_dir_mtime()
+		tmp = INDEX_FILE + ".tmp"
+		with open(tmp, "w") as f:
+			json.dump({"dir_mtime": dir_mtime, "entries": entries}, f)
+		os.replace(tmp, INDEX_FILE)
+		_dir_mtime = dir_mtime
+	except OSError as e:
+		logger.error("could not save backup catalog", exc_info=e)
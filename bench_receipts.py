@@ -0,0 +1,219 @@
+"""
+Receipt rendering benchmark. Builds synthetic services and tire data, swaps stand-ins in for the Data and Maint
+globals, then times every create_*_receipt path and the bulk receipt.
+
+Run from the program directory (the receipt logo is loaded from files/):
+	python bench_receipts.py [--sizes 1 50 500] [--bulk-repeats 10] [--json results.json] [--profile profile.json]
+"""
+import argparse
+import gc
+import json
+import statistics
+import time
+import tracemalloc
+from datetime import datetime
+from decimal import Decimal
+from types import SimpleNamespace
+
+import fts_structs
+import genanyreceipt
+import receiptprofile
+from fts_structs import Routine
+
+# (name, [(axle title, left tire labels, right tire labels)])
+VEHICLES = [
+	("bike", [("Front", ["F"], []), ("Rear", ["R"], [])]),
+	("car", [("Front", ["LF"], ["RF"]), ("Rear", ["LR"], ["RR"])]),
+	("truck6", [("Steer", ["LF"], ["RF"]), ("Drive", ["LDO", "LDI"], ["RDO", "RDI"])]),
+	("truck10", [("Steer", ["LF"], ["RF"]), ("Forward Drive", ["LFO", "LFI"], ["RFO", "RFI"]),
+				 ("Rear Drive", ["LRO", "LRI"], ["RRO", "RRI"])]),
+	("truck18", [("Steer", ["LF"], ["RF"]), ("Forward Drive", ["LFO", "LFI"], ["RFO", "RFI"]),
+				 ("Rear Drive", ["LRO", "LRI"], ["RRO", "RRI"]), ("Forward Trailer", ["LTFO", "LTFI"], ["RTFO", "RTFI"]),
+				 ("Rear Trailer", ["LTRO", "LTRI"], ["RTRO", "RTRI"])]),
+]
+# (name, routine, type_id)
+ROUTINES = [
+	("repair", Routine.REPAIR, "tips"),
+	("audit", Routine.AUDIT, "tips"),
+	("inflation", Routine.INFLATION, "tips"),
+	("purge_fill", Routine.PURGE_FILL, "tips"),
+	("verification", Routine.VERIFICATION, "tips"),
+	("tireassurance", Routine.INFLATION, "tireassurance"),
+]
+COMMENT = ("Checked all tires and valve stems. Right drive outer has uneven wear on the inside shoulder, "
+		   "recommend an alignment check.\nCustomer informed.")
+
+
+class FakeTire:
+	def __init__(self, label, sp, before):
+		self.label = label
+		self.setpressure = sp
+		self.before = before
+		self.corrected = sp + 0.1
+		self.nitrogen = 95.0
+		self.tread_depth = 9
+		self.dot = "DOT U2LL LMLR 5107"
+
+	def sidewall_str(self):
+		return "OK"
+
+	def tread_str(self):
+		return "Even"
+
+	def tread_depth_32(self):
+		return f"{self.tread_depth}/32"
+
+	def tread_depth_float(self):
+		return self.tread_depth / 32
+
+	def puncture_str(self):
+		return "None"
+
+	def temp_str(self):
+		return "71.2 F"
+
+	def accurate_uncorrected(self):
+		return self.before
+
+	def diff(self, strict=True):
+		return self.before - self.setpressure
+
+	def valid(self, strict=True):
+		return True
+
+	def sp(self):
+		return self.setpressure
+
+
+class FakeService:
+	def __init__(self, name, axles, routine, type_id):
+		self.routine = routine
+		self.type_id = type_id
+		self.type = "Truck" if name.startswith("truck") else name.title()
+		self.vehicle = self.type
+		self.image = None
+		self.image_scale = 1.0
+		self.default_price = Decimal("29.99")
+		self.numaxles = len(axles)
+		self.numtires = sum(len(left) + len(right) for _, left, right in axles)
+		# Axle makes its tires from the labels, the same way the receipt builds the one-sided bike axle
+		self.template = SimpleNamespace(
+			axles=[fts_structs.Template.Axle(title, left, right, 0, [""]) for title, left, right in axles],
+			inout_labels={0: [""], 1: [""], 2: ["Outer", "Inner"]})
+		self.labels = [x for _, left, right in axles for x in left + right]
+
+	def fullname(self):
+		return f"{self.type} Nitrogen Service"
+
+	def shortname(self):
+		return self.type
+
+
+def fake_globals():
+	payment = SimpleNamespace(
+		prepaid_code=None, prepaid_index=None, price_paid=Decimal("29.99"), check_number=None, status="APPROVAL",
+		alt_account=None, alt_billing=SimpleNamespace(value=None),
+		rdict={"transaction_type": "charge", "host_transaction_id": 123456789, "mid": 1234561098869, "tid": 7001,
+			   "tokenized_card_info": {"last_four": "4242"}, "auth_code": "A1B2C3"},
+		use_alt_billing=lambda: False, is_voided=lambda: False, is_ok=lambda: True)
+	config = SimpleNamespace(price=Decimal("29.99"), repair_quantity=1, labor_cost=40.0, tire_cost=250.0,
+							 tire_decimal=1.0, sales_tax_rate=0.06, recycling_fee=4.0)
+	vehicle = SimpleNamespace(Config=config, company="Acme Fleet", mileage=123456, address="45915 Maries Rd\nDulles, VA",
+							  plate_number="ABC1234", plate_state="VA", vehicle_number="1042", vin="1FTFW1ET5DFC10312")
+	data = SimpleNamespace(Times=SimpleNamespace(accept=datetime.now()), Payment=payment, Vehicle=vehicle,
+						   Contact=SimpleNamespace(email="fleet@example.com"), control_number=2134,
+						   control_number_as_int=lambda: 2134)
+	maint = SimpleNamespace(mioskid="042", vals={"nitrogen_percent": "95"}, coupon_img="", valid_coupon_codes={})
+	return data, maint
+
+
+def install_fakes():
+	# receipts only read these globals, so module-level stand-ins are enough. nothing is persisted
+	data, maint = fake_globals()
+	genanyreceipt.Data = data
+	genanyreceipt.Maint = maint
+	genanyreceipt.heartbeatbuffer = SimpleNamespace(increment=lambda key, value: None)
+	genanyreceipt.minion_settings = SimpleNamespace(Keys=SimpleNamespace(GAS_PRICE=None), get_float=lambda key: 3.00)
+
+
+def tire_data(service: FakeService):
+	return {label: FakeTire(label, 105 if service.numtires > 4 else 35, (95 if service.numtires > 4 else 31) + i * 0.25)
+			for i, label in enumerate(service.labels)}
+
+
+def bulk_charges(n):
+	return [{"service": "Car TIPS", "amount": Decimal("29.99"), "ctrlnum": 2000 + i, "vehicle": f"VA ABC{i % 37:04}",
+			 "uid": f"bench-{i}"} for i in range(n)]
+
+
+def measure(func, n):
+	"""
+	:return: latency of each of n calls in seconds, total seconds and peak traced memory of one call in bytes
+	"""
+	gc.collect()
+	latencies = []
+	start = time.perf_counter()
+	for _ in range(n):
+		t = time.perf_counter()
+		func()
+		latencies.append(time.perf_counter() - t)
+	total = time.perf_counter() - start
+
+	tracemalloc.start()  # separate run, tracing slows everything down
+	func()
+	_, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	return latencies, total, peak
+
+
+def summarize(name, n, latencies, total, peak):
+	if len(latencies) >= 2:
+		cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+		p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+	else:
+		p50 = p95 = p99 = latencies[0]
+	return {"name": name, "n": n, "per_sec": len(latencies) / total, "p50_ms": p50 * 1000, "p95_ms": p95 * 1000,
+			"p99_ms": p99 * 1000, "peak_kb": peak / 1024}
+
+
+def run(sizes, bulk_repeats):
+	install_fakes()
+	results = []
+	for n in sizes:
+		for routine_name, routine, type_id in ROUTINES:
+			for vehicle_name, axles in VEHICLES:
+				service = FakeService(vehicle_name, axles, routine, type_id)
+				data = tire_data(service)
+				func = lambda: genanyreceipt.create_receipt(service, data, COMMENT)
+				results.append(summarize(f"{routine_name}/{vehicle_name}", n, *measure(func, n)))
+				print_result(results[-1])
+		charges = bulk_charges(n)
+		results.append(summarize("bulk", n, *measure(lambda: genanyreceipt.create_bulk_receipt(charges), bulk_repeats)))
+		print_result(results[-1])
+		results.append(summarize("bulk_streamed", n,
+								 *measure(lambda: list(genanyreceipt.iter_bulk_receipt(charges)), bulk_repeats)))
+		print_result(results[-1])
+	return results
+
+
+def print_result(r):
+	print(f"{r['name']:<26} n={r['n']:<4} {r['per_sec']:8.1f}/s  p50 {r['p50_ms']:7.2f}ms  p95 {r['p95_ms']:7.2f}ms  "
+		  f"p99 {r['p99_ms']:7.2f}ms  peak {r['peak_kb']:8.1f}KB")
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Benchmark receipt generation")
+	parser.add_argument("--sizes", type=int, nargs="+", default=[1, 50, 500],
+						help="receipts per routine, and charges per bulk")
+	parser.add_argument("--bulk-repeats", type=int, default=10,
+						help="times each bulk receipt is built, for its percentiles")
+	parser.add_argument("--json", help="also write the results to this file")
+	parser.add_argument("--profile", help="record per-section timings and write them to this file")
+	args = parser.parse_args()
+	receiptprofile.enable(bool(args.profile))
+	all_results = run(args.sizes, args.bulk_repeats)
+	if args.json:
+		with open(args.json, "w") as f:
+			json.dump(all_results, f, indent=2)
+	if args.profile:
+		receiptprofile.dump_json(args.profile)
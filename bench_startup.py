@@ -0,0 +1,77 @@
+"""
+Startup import benchmark. Imports a module in a fresh interpreter with -X importtime and reports where the time went,
+as cumulative ms per imported module (the module and everything it imported first).
+
+Run from the program directory:
+	python bench_startup.py [--module maint_screen] [--repeat 5] [--top 25] [--json results.json]
+"""
+import argparse
+import json
+import re
+import statistics
+import subprocess
+import sys
+
+# import time:       self [us] |  cumulative | imported package
+LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)")
+
+
+def parse(stderr: str):
+	"""
+	:return: module -> (self ms, cumulative ms, depth), and total ms of the top level imports
+	"""
+	modules = {}
+	total = 0.0
+	for line in stderr.splitlines():
+		m = LINE.match(line)
+		if not m:
+			continue
+		self_us, cumulative_us, indent, name = m.groups()
+		depth = (len(indent) - 1) // 2  # top level imports are indented by one space, each level adds two
+		modules[name] = (int(self_us) / 1000, int(cumulative_us) / 1000, depth)
+		if depth == 0:
+			total += int(cumulative_us) / 1000
+	return modules, total
+
+
+def measure(module: str):
+	proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True,
+						  text=True)
+	if proc.returncode:
+		errors = [line for line in proc.stderr.splitlines() if not line.startswith("import time:")]
+		raise RuntimeError(f"importing {module} failed:\n" + "\n".join(errors[-10:]))
+	return parse(proc.stderr)
+
+
+def run(module: str, repeat: int):
+	# median of each module over the runs, the first run also pays for a cold disk cache
+	runs = [measure(module) for _ in range(repeat)]
+	names = set().union(*(r[0] for r in runs))
+	results = []
+	for name in names:
+		seen = [r[0][name] for r in runs if name in r[0]]
+		results.append({"module": name, "self_ms": statistics.median(s[0] for s in seen),
+						"cumulative_ms": statistics.median(s[1] for s in seen), "depth": seen[0][2]})
+	results.sort(key=lambda r: r["cumulative_ms"], reverse=True)
+	return {"module": module, "runs": repeat, "total_ms": statistics.median(r[1] for r in runs), "modules": results}
+
+
+def print_result(result, top: int):
+	print(f"import {result['module']}: {result['total_ms']:.1f}ms (median of {result['runs']})")
+	print(f"{'cumulative':>12} {'self':>9}  module")
+	for r in result["modules"][:top]:
+		print(f"{r['cumulative_ms']:10.1f}ms {r['self_ms']:7.1f}ms  {'  ' * r['depth']}{r['module']}")
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Benchmark startup imports")
+	parser.add_argument("--module", default="maint_screen", help="module to import")
+	parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters to take the median of")
+	parser.add_argument("--top", type=int, default=25, help="modules to list, by cumulative time")
+	parser.add_argument("--json", help="also write the results to this file")
+	args = parser.parse_args()
+	result = run(args.module, args.repeat)
+	print_result(result, args.top)
+	if args.json:
+		with open(args.json, "w") as f:
+			json.dump(result, f, indent=2)
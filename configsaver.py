@@ -0,0 +1,89 @@
+import atexit
+import os
+import weakref
+from typing import Callable, Optional
+
+from logger import logger
+
+SAVE_DELAY = 1.5  # seconds of quiet before saving, so a burst of edits is one write
+
+_savers = weakref.WeakSet()  # flushed at exit
+
+
+class DebouncedSaver:
+	"""
+	Saves a file some time after the last request, on the Tk thread, so the writer can read live Tk-side state. The
+	new contents are written to a temp file and renamed over the old one, so a crash mid-write can't corrupt it, and
+	nothing is replaced if nothing changed.
+	"""
+
+	def __init__(self, widget, path: str, write: Callable[[str], None], what: str, delay=SAVE_DELAY,
+				 on_error: Optional[Callable[[Exception], None]] = None):
+		"""
+		:param widget: any widget, its after() does the waiting
+		:param path: file to keep up to date
+		:param write: writes the whole file to the path it is given, like Maint.save_to_json
+		:param what: what is being saved, for the log
+		:param delay: seconds to wait after the last request before saving
+		:param on_error: called with the exception when a save fails, after it is logged
+		"""
+		self.widget = widget
+		self.path = path
+		self.write = write
+		self.what = what
+		self.delay = delay
+		self.on_error = on_error
+		self._after = None  # id of the pending save
+		try:
+			with open(path, "rb") as f:
+				self._last = f.read()  # contents on disk, to skip saves that change nothing
+		except OSError:
+			self._last = None
+		_savers.add(self)
+
+	def request(self):
+		"""
+		Save soon. Call from the Tk thread. Further requests push the save back
+		"""
+		if self._after:
+			self.widget.after_cancel(self._after)
+		self._after = self.widget.after(int(self.delay * 1000), self.flush)
+
+	def flush(self) -> bool:
+		"""
+		Save now if a save is pending
+
+		:return: False if the save failed
+		"""
+		if not self._after:
+			return True
+		try:
+			self.widget.after_cancel(self._after)
+		except Exception:  # already ran, or Tk is gone at exit
+			pass
+		self._after = None
+		tmp = self.path + ".tmp"
+		try:
+			self.write(tmp)
+			with open(tmp, "rb") as f:
+				data = f.read()
+			if data == self._last:
+				os.remove(tmp)
+				return True
+			os.replace(tmp, self.path)
+			self._last = data
+			return True
+		except Exception as e:
+			logger.error(f"could not save {self.what}", exc_info=e)
+			if self.on_error:
+				self.on_error(e)
+			return False
+
+
+@atexit.register
+def _flush_all():
+	for saver in list(_savers):
+		try:
+			saver.flush()
+		except Exception as e:  # on_error can fail once Tk is gone
+			logger.error(f"saving {saver.what} at exit failed", exc_info=e)
@@ -0,0 +1,347 @@
+import atexit
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter
+from io import BytesIO
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from globals import Maint
+from logger import logger
+
+CACHE_DIR = "rmgcache"
+INDEX_FILE = os.path.join(CACHE_DIR, "index.json")
+WEIGHTS_FILE = "weights.json"  # optional on the share, {code: weight}. coupons not listed get weight 1
+IMPRESSIONS_FILE = os.path.join(CACHE_DIR, "impressions.json")  # {code: times printed}, kept across restarts
+EMPTY_RETRY = 60.0  # seconds before looking for coupons again when there were none
+RECEIPT_WIDTH = 576  # pixels across the receipt printer head
+THUMB_SIZE = (300, 180)  # fits the change coupon window
+
+
+class CouponCache:
+	"""
+	Local copy of the receipt marketing graphics (RMGs) on the share.
+	For every graphic it keeps the dimensions, a copy scaled to the receipt width and a thumbnail,
+	so choosing a coupon and printing receipts never have to touch the network share.
+	"""
+	_lock = threading.Lock()
+	_entries = None  # type: Optional[Dict[str, dict]]  # code -> src, mtime, size, width, height, receipt, thumb
+	_sync_thread = None  # type: Optional[threading.Thread]
+	_weights = None  # type: Optional[Dict[str, float]]
+	version = 0  # bumped whenever the cached coupons or weights change
+
+	@staticmethod
+	def share_dir():
+		return "\\\\APOLLO\\N24TyresMinionData\\{0}Miosk{1}\\{0}Miosk{1}RecptAds".format(Maint.computername,
+																							 Maint.mioskid)
+
+	@classmethod
+	def codes(cls) -> Dict[str, str]:
+		"""
+		:return: each cached code mapped to its receipt-ready image. before anything has been cached, each code on the
+				share mapped to its file there
+		"""
+		with cls._lock:
+			entries = cls._load()
+			if entries:
+				return {code: entry["receipt"] for code, entry in entries.items()}
+		# first run, or the share has never been reachable. list it directly so the coupon window isn't empty
+		share = cls.share_dir()
+		try:
+			return {code: os.path.join(share, name) for code, name in cls._list_share(share).items()}
+		except OSError as e:
+			logger.warning(f"could not reach RMG share and nothing is cached: {e}")
+			return {}
+
+	@classmethod
+	def thumbnail(cls, path_or_code: str) -> str:
+		"""
+		:return: path to the thumbnail of a coupon, or the given path if it is not cached
+		"""
+		entry = cls.lookup(path_or_code)
+		return entry["thumb"] if entry else path_or_code
+
+	@classmethod
+	def receipt_image(cls, path_or_code: str) -> Tuple[str, int, int]:
+		"""
+		:return: path, width and height of the receipt-ready copy of a coupon.
+				falls back to opening the given path if it is not cached
+		"""
+		entry = cls.lookup(path_or_code)
+		if entry:
+			return entry["receipt"], entry["width"], entry["height"]
+		with Image.open(path_or_code) as img:
+			return path_or_code, img.width, img.height
+
+	@classmethod
+	def weights(cls, codes=None) -> Dict[str, float]:
+		"""
+		:param codes: codes to weigh, defaults to codes()
+		:return: rotation weight of each code
+		"""
+		codes = cls.codes() if codes is None else codes
+		with cls._lock:
+			weights = cls._load_weights()
+			return {code: float(weights.get(code, 1.0)) for code in codes}
+
+	@classmethod
+	def lookup(cls, path_or_code: str) -> Optional[dict]:
+		code = os.path.splitext(os.path.basename(path_or_code))[0]  # share paths, cached paths and codes all work
+		with cls._lock:
+			return cls._load().get(code)
+
+	@classmethod
+	def sync_async(cls):
+		"""
+		Start updating the cache from the share in the background, unless that is already happening
+		"""
+		with cls._lock:
+			if cls._sync_thread and cls._sync_thread.is_alive():
+				return
+			cls._sync_thread = threading.Thread(target=cls.sync, daemon=True, name="couponsync")
+			cls._sync_thread.start()
+
+	@classmethod
+	def sync(cls):
+		share = cls.share_dir()
+		try:
+			names = cls._list_share(share)
+		except OSError as e:
+			logger.warning(f"could not reach RMG share, using cached coupons: {e}")
+			return
+		with cls._lock:
+			entries = dict(cls._load())
+		changed = False
+		seen = set()
+		for code, name in names.items():
+			src = os.path.join(share, name)
+			seen.add(code)
+			try:
+				st = os.stat(src)
+				entry = entries.get(code)
+				if entry and entry["src"] == src and entry["mtime"] == st.st_mtime and entry["size"] == st.st_size:
+					continue  # up to date
+				entries[code] = cls._cache_image(code, src, st)
+				changed = True
+			except OSError as e:
+				logger.warning(f"could not cache RMG {src}", exc_info=e)
+		for code in set(entries) - seen:  # removed from the share
+			entry = entries.pop(code)
+			for path in (entry["receipt"], entry["thumb"]):
+				try:
+					os.remove(path)
+				except OSError:
+					pass
+			changed = True
+		weights = {}
+		try:
+			with open(os.path.join(share, WEIGHTS_FILE)) as f:
+				weights = {str(code): float(weight) for code, weight in json.load(f).items()}
+		except FileNotFoundError:
+			pass
+		except (OSError, ValueError, AttributeError) as e:
+			logger.warning(f"could not read RMG weights, using equal weights: {e}")
+		with cls._lock:
+			if weights != cls._load_weights():
+				cls._weights = weights
+				cls._save_json(os.path.join(CACHE_DIR, WEIGHTS_FILE), weights)
+				cls.version += 1
+			if changed:
+				cls._entries = entries
+				cls._save_json(INDEX_FILE, entries)
+				cls.version += 1
+		if changed:
+			logger.info(f"RMG cache synced, {len(entries)} coupons")
+		CouponRotation.save_impressions()
+
+	@staticmethod
+	def _list_share(share) -> Dict[str, str]:
+		"""
+		:return: code -> file name of each graphic on the share
+		"""
+		names = {}
+		for name in sorted(os.listdir(share)):
+			if not (name.endswith(".png") or name.endswith(".jpg")):
+				continue
+			code = os.path.splitext(name)[0]
+			if code in names:
+				# X.png and X.jpg are both coupon X. keep the newer, it is most likely the replacement
+				try:
+					keep = max((names[code], name), key=lambda n: os.stat(os.path.join(share, n)).st_mtime)
+				except OSError:
+					keep = names[code]
+				logger.warning(f"RMG share has both {names[code]} and {name} for coupon {code}, using {keep}")
+				names[code] = keep
+			else:
+				names[code] = name
+		return names
+
+	@classmethod
+	def _cache_image(cls, code, src, st):
+		os.makedirs(CACHE_DIR, exist_ok=True)
+		receipt_path = os.path.join(CACHE_DIR, code + ".png")
+		thumb_path = os.path.join(CACHE_DIR, code + "-thumb.png")
+		with Image.open(src) as img:
+			img.load()
+			if img.width > RECEIPT_WIDTH:  # never upscale, the pdf will scale to fit anyway
+				receipt = img.resize((RECEIPT_WIDTH, round(img.height * RECEIPT_WIDTH / img.width)), Image.LANCZOS)
+			else:
+				receipt = img.copy()
+			thumb = img.copy()
+			thumb.thumbnail(THUMB_SIZE)
+		# replaced whole, a receipt on another thread may be reading the old copy right now
+		for image, path in ((receipt, receipt_path), (thumb, thumb_path)):
+			image.save(path + ".tmp", "PNG")
+			os.replace(path + ".tmp", path)
+		return {"src": src, "mtime": st.st_mtime, "size": st.st_size, "width": receipt.width, "height": receipt.height,
+				"receipt": receipt_path, "thumb": thumb_path}
+
+	@classmethod
+	def _load(cls):
+		# caller holds the lock
+		if cls._entries is None:
+			try:
+				with open(INDEX_FILE) as f:
+					cls._entries = json.load(f)
+			except FileNotFoundError:
+				cls._entries = {}
+			except (OSError, ValueError) as e:
+				logger.warning(f"RMG cache index unreadable, starting over: {e}")
+				cls._entries = {}
+		return cls._entries
+
+	@classmethod
+	def _load_weights(cls):
+		# caller holds the lock
+		if cls._weights is None:
+			try:
+				with open(os.path.join(CACHE_DIR, WEIGHTS_FILE)) as f:
+					cls._weights = json.load(f)
+			except (OSError, ValueError):
+				cls._weights = {}
+		return cls._weights
+
+	@staticmethod
+	def _save_json(path, obj):
+		# caller holds the lock
+		os.makedirs(CACHE_DIR, exist_ok=True)
+		tmp = path + ".tmp"
+		try:
+			with open(tmp, "w") as f:
+				json.dump(obj, f)
+			os.replace(tmp, path)
+		except OSError as e:
+			logger.error(f"could not save {path}", exc_info=e)
+
+
+class CouponRotation:
+	"""
+	Picks the coupon for "RANDOM" receipts, weighted by the marketing weights on the share.
+	The alias table and the receipt-ready images are built once per cache version, so each pick is O(1)
+	and never touches the disk. Until the first sync has cached anything the table is built from the share.
+	Impressions per coupon are kept in IMPRESSIONS_FILE, saved on every sync and at exit.
+	"""
+	_lock = threading.Lock()
+	_version = None  # CouponCache.version the table was built from
+	_codes = []  # type: List[str]
+	_prob = []  # type: List[float]
+	_alias = []  # type: List[int]
+	_images = {}  # type: Dict[str, Tuple[bytes, int, int]]  # code -> image file bytes, width, height
+	_built_at = 0.0
+	_impressions = None  # type: Optional[Counter]  # code -> times printed
+
+	@classmethod
+	def choose(cls) -> Optional[Tuple[BytesIO, int, int]]:
+		"""
+		Pick a coupon and count the impression
+
+		:return: receipt-ready image, width and height. None if there are no coupons
+		"""
+		with cls._lock:
+			if cls._version != CouponCache.version or (not cls._codes and time.monotonic() - cls._built_at > EMPTY_RETRY):
+				cls._build()
+			if not cls._codes:
+				return None
+			i = random.randrange(len(cls._codes))
+			if random.random() >= cls._prob[i]:
+				i = cls._alias[i]
+			code = cls._codes[i]
+			data, width, height = cls._images[code]
+			cls._load_impressions()[code] += 1
+		return BytesIO(data), width, height
+
+	@classmethod
+	def impressions(cls) -> Dict[str, int]:
+		"""
+		:return: times each coupon has been printed
+		"""
+		with cls._lock:
+			return dict(cls._load_impressions())
+
+	@classmethod
+	def save_impressions(cls):
+		with cls._lock:
+			if cls._impressions is not None:
+				CouponCache._save_json(IMPRESSIONS_FILE, cls._impressions)
+
+	@classmethod
+	def _load_impressions(cls) -> Counter:
+		# caller holds the lock
+		if cls._impressions is None:
+			try:
+				with open(IMPRESSIONS_FILE) as f:
+					cls._impressions = Counter(json.load(f))
+			except (OSError, ValueError, TypeError):
+				cls._impressions = Counter()
+		return cls._impressions
+
+	@classmethod
+	def _build(cls):
+		# caller holds the lock
+		cls._version = CouponCache.version
+		cls._built_at = time.monotonic()
+		codes = CouponCache.codes()  # cached copies, or the share before the first sync
+		images = {}
+		weights = []
+		for code, weight in CouponCache.weights(codes).items():
+			if weight <= 0:
+				continue  # campaign turned off
+			try:
+				path, width, height = CouponCache.receipt_image(codes[code])
+				with open(path, "rb") as f:
+					images[code] = (f.read(), width, height)
+			except OSError as e:
+				logger.warning(f"could not preload RMG {code}", exc_info=e)
+				continue
+			weights.append(weight)
+		cls._codes = list(images)
+		cls._images = images
+		cls._prob, cls._alias = _alias_table(weights)
+
+
+atexit.register(CouponRotation.save_impressions)
+
+
+def _alias_table(weights: List[float]):
+	# Vose's alias method. each slot i keeps itself with probability prob[i], otherwise it becomes alias[i]
+	n = len(weights)
+	if n == 0:
+		return [], []
+	total = sum(weights)
+	scaled = [w * n / total for w in weights]
+	prob = [1.0] * n
+	alias = list(range(n))
+	small = [i for i, p in enumerate(scaled) if p < 1.0]
+	large = [i for i, p in enumerate(scaled) if p >= 1.0]
+	while small and large:
+		s = small.pop()
+		g = large.pop()
+		prob[s] = scaled[s]
+		alias[s] = g
+		scaled[g] -= 1.0 - scaled[s]
+		(small if scaled[g] < 1.0 else large).append(g)
+	return prob, alias  # anything left over is 1.0 within rounding
@@ -1,17 +1,18 @@
 import itertools
-import random
 import re
 from datetime import datetime
 from io import BytesIO
 from typing import Dict, Iterable, Union, List, Callable
 
-from PIL import Image
-
+import barcodes
 import bulk_charge
 import fts_structs
-import heartbeatstore
+import heartbeatbuffer
 import minion_settings
+import receiptprofile
+import wordwrap
 from checktire import check_dot, check_sidewall, check_tread_depth, check_tread, check_punc
+from couponcache import CouponCache, CouponRotation
 from fts_structs import Service, TireData, Routine
 from globals import Maint, Data
 from otistructs import AuthorizationDetails
@@ -21,6 +22,8 @@ avg_gas_price = 3.00  # $
 _abbr = {"forward": "Fwd", "drive": "Dr"}
 _pattern_combine_spaces = re.compile(r" {2,}")  # replace 2 or more spaces with a single space
 _pattern_simplify_abbr = re.compile(r"(?<=\b.) (?=.\b)")  # delete space between single letters
+BULK_CHUNK_CHARGES = 25  # charges per chunk when streaming a bulk receipt
+BULK_STREAM_MIN_CHARGES = 50  # bulks with more charges than this are printed in chunks
 
 
 def create_receipt(service: Service, data: Dict[str, TireData], comment: str):
@@ -134,12 +137,8 @@ def create_bulk_receipt(charges: List[bulk_charge.ChargeType]):
 	builder.add_contact_info(("Mobile Nitrogen Tire", "Inspection & Inflation"))
 	builder.add_authorization_details()
 	builder.add_service_details("Tire Inspection & Pressure Service", "TIPS")
-
-	pdf.options(10)
-	for charge in charges:
-		pdf.addtableadv(f"{charge['service']}", f"${charge['amount']:.2f}", True, True)
-		pdf.addline(f"  {charge['ctrlnum']:010} - {charge['vehicle']}")
-
+	builder.add_bulk_charges(charges)
+	builder.add_bulk_subtotals(charges)
 	builder.add_closing()
 
 	pdf.finish()
@@ -147,13 +146,54 @@ def create_bulk_receipt(charges: List[bulk_charge.ChargeType]):
 	return byte_buffer
 
 
+def iter_bulk_receipt(charges: List[bulk_charge.ChargeType], chunk_size=BULK_CHUNK_CHARGES):
+	"""
+	Same receipt as create_bulk_receipt, but generated as a series of short PDFs. Each chunk is rasterized as soon as
+	it is laid out and the images are joined into one strip, so neither the layout nor the rasterizing of a large bulk
+	ever holds the whole receipt as one PDF.
+
+	:param charges: bulk charges to print
+	:param chunk_size: number of charges in each chunk
+	"""
+	byte_buffer = BytesIO()  # used as a write-capable file in memory
+	pdf = PDFGen(byte_buffer, 2.75, 0)  # 2.75 inches wide with 0 inch margins
+	builder = PDFBuilder(pdf)
+
+	builder.add_contact_info(("Mobile Nitrogen Tire", "Inspection & Inflation"))
+	builder.add_authorization_details()
+	builder.add_service_details("Tire Inspection & Pressure Service", "TIPS")
+	builder.add_bulk_charges(charges[:chunk_size])  # header shares a chunk with the first charges
+	pdf.finish()
+	byte_buffer.seek(0)
+	yield byte_buffer
+
+	for start in range(chunk_size, len(charges), chunk_size):
+		byte_buffer = BytesIO()
+		pdf = PDFGen(byte_buffer, 2.75, 0)
+		PDFBuilder(pdf).add_bulk_charges(charges[start:start + chunk_size])
+		pdf.finish()
+		byte_buffer.seek(0)
+		yield byte_buffer
+
+	byte_buffer = BytesIO()
+	pdf = PDFGen(byte_buffer, 2.75, 0)
+	builder = PDFBuilder(pdf)
+	builder.add_bulk_subtotals(charges)
+	builder.add_closing()
+	pdf.finish()
+	byte_buffer.seek(0)
+	yield byte_buffer
+
+
 class PDFBuilder:
 	def __init__(self, pdf: PDFGen, service: Service=None, data: Dict[str, TireData]=None):
+		receiptprofile.instrument(pdf)
 		self.pdf = pdf
 		self.service = service
 		self.data = data
 		self.now = datetime.now()
 
+	@receiptprofile.section
 	def add_contact_info(self, service_description: Iterable[str]):
 		self.pdf.addtable(Data.Times.accept.strftime("%m/%d/%Y"),
 						  Data.Times.accept.strftime("%H:%M:%S"))
@@ -172,6 +212,7 @@ class PDFBuilder:
 		self.pdf.options(11, align='center')
 		self.pdf.addline("www.fuelandtiresaver.com")
 
+	@receiptprofile.section
 	def add_authorization_details(self):
 		self.pdf.skip(5)
 		trans = Data.Payment
@@ -241,6 +282,7 @@ class PDFBuilder:
 			except KeyError:
 				self.pdf.addtable("AP CODE", "None")  # Credit card failed
 
+	@receiptprofile.section
 	def add_service_details(self, description: str, service_details: str):
 		self.pdf.skip(2)
 		self.pdf.options(9)
@@ -278,6 +320,37 @@ class PDFBuilder:
 			self.pdf.addline(Data.Vehicle.vin)
 		self.pdf.skip(10)
 
+	@receiptprofile.section
+	def add_bulk_charges(self, charges: List[bulk_charge.ChargeType]):
+		self.pdf.options(10)
+		for charge in charges:
+			self.pdf.addtableadv(f"{charge['service']}", f"${charge['amount']:.2f}", True, True)
+			self.pdf.addline(f"  {charge['ctrlnum']:010} - {charge['vehicle']}")
+
+	@receiptprofile.section
+	def add_bulk_subtotals(self, charges: List[bulk_charge.ChargeType]):
+		"""
+		Adds a subtotal for each vehicle in the bulk, in the order each vehicle was first charged, then the total
+
+		:param charges: all charges in the bulk
+		"""
+		subtotals = {}  # vehicle -> [count, amount]. dicts keep insertion order
+		for charge in charges:
+			subtotal = subtotals.setdefault(charge['vehicle'], [0, 0])
+			subtotal[0] += 1
+			subtotal[1] += charge['amount']
+		self.pdf.skip(5)
+		self.pdf.options(10, True, align='center')
+		self.pdf.addline("Vehicle Subtotals")
+		self.pdf.options(9)
+		for vehicle, (count, amount) in subtotals.items():
+			self.pdf.addtable(f"{vehicle} (x{count})", f"${amount:.2f}")
+		self.pdf.skip(3)
+		self.pdf.drawline(0, 1)
+		self.pdf.options(10)
+		self.pdf.addtableadv(f"Total - {len(charges)} charge(s)", f"${sum(x['amount'] for x in charges):.2f}", True, True)
+
+	@receiptprofile.section
 	def add_tire_data_auto(self, image: Union[BytesIO, str] = None, imgscale=1.0, insp_rule=2, inflation=True, use_mrsp=False):
 		"""
 		Automatically adds tire data and image.
@@ -409,6 +482,7 @@ class PDFBuilder:
 			# give half the amount of space to negative padding which moves the image up to align with the info
 			self.pdf.insertimage(image, imgscale, y_align='center', y_pad=-tire_info_pixs // 2)
 
+	@receiptprofile.section
 	def add_tire_data(self, left_title, right_title, l: TireData = None, r: TireData = None,
 					  left_insp=True, right_insp=True, inflation=True, use_mrsp=False):
 		"""
@@ -465,33 +539,32 @@ class PDFBuilder:
 		add_data("N2", lambda x: f"{x.nitrogen:.1f}%" if x.nitrogen else None, True)
 		add_data("MRSP" if use_mrsp else "SP", lambda x: f"{x.sp():.0f} PSI" if use_mrsp else f"{x.sp():.2f} PSI", True)
 
+	@receiptprofile.section
 	def add_comment(self, comment: str):
 		if comment:  # add comment if it's not null or empty
 			self.pdf.skip(5)
 			self.pdf.options(13, align='center')
 			self.pdf.addlineadv("Service Note:")
 			self.pdf.options(11)
-
-			def textwidth(s):
-				return self.pdf.textwidth(s, 11, italic=True)
-
-			# basic word wrapping algorithm
-			# this means we assume there are super long words (which would not fit on a single line)
-			spaces = re.compile(" +")
-			line_length = self.pdf.width * 0.95
-			partial = ""
-			comment = comment.replace('\r', '').replace('\n', ' \n ')  # if a \r\n was placed, normalize all to \n
-			for word in spaces.split(comment):
-				if textwidth(partial) + textwidth(word) > line_length or word == '\n':  # adding this word would be too long, or forced newline
-					self.pdf.addlineadv(partial, italic=True)
-					partial = ""
-				if word != '\n':
-					partial += word + " "
-			if len(partial.strip()) > 0:  # if theres still a bit more after the sentence ends, add it
-				self.pdf.addlineadv(partial, italic=True)
+			self.add_wrapped(comment, 11, italic=True)
 			self.pdf.options(12, align='center')
 			self.pdf.skip(5)
 
+	def add_wrapped(self, text: str, size: int, italic=False):
+		"""
+		Adds text word wrapped to the receipt width. Set the font options first, size and italic must match them.
+
+		:param text: text to add. newlines always start a new line
+		:param size: font size, used for measuring
+		:param italic: print and measure in italics
+		"""
+		def textwidth(s):
+			return self.pdf.textwidth(s, size, italic=italic)
+
+		for line in wordwrap.wrap(text, self.pdf.width * 0.95, textwidth, (size, italic)):
+			self.pdf.addlineadv(line, italic=italic)
+
+	@receiptprofile.section
 	def add_savings_report(self, comment: str=None, no_savings=False, no_nitrogen=False):
 		"""
 		Add the entire savings report, computing all savings from the data previously provided
@@ -597,8 +670,8 @@ class PDFBuilder:
 				self.pdf.options(9, align='center')
 				self.pdf.addline("from excessive tire wear.")
 			avg_dollars = (savings_min + savings_max + tire_savings_min + tire_savings_max) / 2.0  # either savings or tire_savings will be 0. so just divide by 2
-			heartbeatstore.increment("recent_saved_dollars", avg_dollars)
-			heartbeatstore.increment("total_saved_dollars", avg_dollars)
+			heartbeatbuffer.increment("recent_saved_dollars", avg_dollars)
+			heartbeatbuffer.increment("total_saved_dollars", avg_dollars)
 
 		if not no_nitrogen:
 			self.pdf.skip(5)
@@ -607,13 +680,30 @@ class PDFBuilder:
 			self.pdf.options(11, italic=True, bold=True, align='center')
 			self.pdf.addline((chr(197) + "ASTRAEA Nitrogen")) #(chr(197) is Å
 
+	def add_barcode(self, value: str, x_offset: int):
+		# drawn as vector bars from the cached encoding, centered. values that can't be encoded here, or a PDFGen
+		# without rectangles, get the pdf library's own barcode, which x_offset roughly centers
+		drawrect = getattr(self.pdf, "drawrect", None)
+		try:
+			bars, height = barcodes.layout(value, self.pdf.width)
+		except ValueError:
+			drawrect = None
+		if drawrect is None:
+			self.pdf.insertbarcode(value, x_offset=x_offset)
+			return
+		for x, width in bars:
+			drawrect(x, width, height)
+		self.pdf.skip(height)
+		self.pdf.skip(3)
+
+	@receiptprofile.section
 	def add_closing(self, add_tire_costs=False):
 		self.pdf.skip(10)
 		self.pdf.options(10, align='center')
 		if Data.control_number is not None:
-			self.pdf.insertbarcode("{:010}".format(Data.control_number), x_offset=64)  # offset to try to center control number bar code
+			self.add_barcode("{:010}".format(Data.control_number), 64)
 		if Data.Vehicle.vin:  # don't print a barcode of nothing
-			self.pdf.insertbarcode(Data.Vehicle.vin, x_offset=14)  # offset to try to center vin bar code
+			self.add_barcode(Data.Vehicle.vin, 14)
 		if not Data.Payment.prepaid_code and not Data.Payment.use_alt_billing():
 			if add_tire_costs:
 				cfg = Data.Vehicle.Config
@@ -629,12 +719,12 @@ class PDFBuilder:
 				total_payment = cfg.labor_cost + tirecost + salestax + rfee
 				self.pdf.addtable("Total Monthly Payment:", "${:.2f}".format(total_payment))
 				self.pdf.skip(3)
-				heartbeatstore.increment("recent_material_costs", tirecost)
-				heartbeatstore.increment("total_material_costs", tirecost)
-				heartbeatstore.increment("recent_salestax_collected", salestax)
-				heartbeatstore.increment("total_salestax_collected", salestax)
-				heartbeatstore.increment("recent_tire_recycling_fees", rfee)
-				heartbeatstore.increment("total_tire_recycling_fees", rfee)
+				heartbeatbuffer.increment("recent_material_costs", tirecost)
+				heartbeatbuffer.increment("total_material_costs", tirecost)
+				heartbeatbuffer.increment("recent_salestax_collected", salestax)
+				heartbeatbuffer.increment("total_salestax_collected", salestax)
+				heartbeatbuffer.increment("recent_tire_recycling_fees", rfee)
+				heartbeatbuffer.increment("total_tire_recycling_fees", rfee)
 			self.pdf.addtable("Charged Amount:", "${:.2f}".format(Data.Payment.price_paid))
 			self.pdf.addtable("Response:", str(Data.Payment.status))
 		if Data.Payment.is_ok():  # dont print for declined receipt
@@ -660,11 +750,12 @@ class PDFBuilder:
 		self.pdf.addline("All Rights Reserved.")
 		if Maint.coupon_img:
 			if Maint.coupon_img == "RANDOM":
-				verified_code = random.choice(list(Maint.valid_coupon_codes.values()))  # choose random from all filenames in RMG
+				chosen = CouponRotation.choose()  # weighted pick from all RMGs, already loaded in memory
 			else:
-				verified_code = Maint.coupon_img
-			self.pdf.skip(5)
-			self.pdf.insertimage(verified_code, scale='fit')
-			img = Image.open(verified_code)  # open it just so we can get the height and skip
-			self.pdf.skip(self.pdf.width / img.width * img.height)
+				chosen = CouponCache.receipt_image(Maint.coupon_img)  # local copy, no trip to the share
+			if chosen:
+				coupon, width, height = chosen
+				self.pdf.skip(5)
+				self.pdf.insertimage(coupon, scale='fit')
+				self.pdf.skip(self.pdf.width / width * height)
 		self.pdf.skip(2)
@@ -0,0 +1,288 @@
+"""
+Columnar store for inflation graph data.
+
+Each store directory holds one segment file per day, and next to each segment an index of what's in it: one JSON line
+per tire saying where that tire's data is. A tire's data is written column after column as little endian float64, so
+a whole graph, or any one column of it, is a zero-copy view into a memory mapped segment. Storing a graph appends to
+its day's segment and index, nothing already on the share is rewritten, and a reader only reads the index lines added
+since it last looked. Pulling up every tire of a vehicle is one directory listing and one mapping of one file, instead
+of a directory listing and a CSV parse per tire.
+
+pigraph calls record_graph() with each CSV it writes, so new graphs are stored as they are made. Existing per-tire
+CSVs (graphdata/0000002134/0000002134-LFO-110.csv) can be migrated with
+	python graphstore.py import graphdata graphstore
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+import taskpool
+from logger import logger
+
+STORE_DIR = "graphstore"  # next to graphdata, locally and on the share
+INDEX_SUFFIX = ".idx"  # one per segment, 20240518.f64 is indexed by 20240518.idx
+LEGACY_INDEX = "index.json"  # single whole-store index written by earlier versions, still read if present
+SEGMENT_SUFFIX = ".f64"
+
+
+class GraphData:
+	"""
+	One tire's graph. data has one row per column name, each row is a contiguous view into the segment
+	"""
+
+	def __init__(self, columns: List[str], data: np.ndarray, setpressure: Optional[int]):
+		self.columns = columns
+		self.data = data
+		self.setpressure = setpressure
+
+	def column(self, name: str) -> np.ndarray:
+		return self.data[self.columns.index(name)]
+
+	def __len__(self):
+		return self.data.shape[1]
+
+
+class GraphStore:
+	"""
+	Use open() to get one, so the index and mappings of each directory are shared
+	"""
+	_stores = {}  # type: Dict[str, GraphStore]
+	_stores_lock = threading.Lock()
+
+	@classmethod
+	def open(cls, root: str) -> 'GraphStore':
+		with cls._stores_lock:
+			store = cls._stores.get(root)
+			if store is None:
+				store = cls._stores[root] = cls(root)
+			return store
+
+	def __init__(self, root: str):
+		self.root = root
+		self._lock = threading.Lock()
+		self._index = {}  # type: Dict[str, Dict[str, dict]]
+		self._index_read = {}  # type: Dict[str, int]  # index file name -> bytes of it already read
+		self._legacy_read = False
+		self._maps = {}  # type: Dict[str, np.memmap]  # segment name -> whole file mapping
+
+	def exists(self):
+		try:
+			return any(name.endswith(INDEX_SUFFIX) or name == LEGACY_INDEX for name in os.listdir(self.root))
+		except OSError:
+			return False
+
+	def lookup(self, ctrlnum: int) -> Dict[str, dict]:
+		"""
+		:return: tire label -> index entry for every tire stored under the control number, empty if none
+		"""
+		with self._lock:
+			return dict(self._load_index().get(f"{ctrlnum:010}", {}))
+
+	def load(self, ctrlnum: int, tire: str) -> Optional[GraphData]:
+		"""
+		:return: the tire's graph, or None if it isn't in the store
+		"""
+		with self._lock:
+			entry = self._load_index().get(f"{ctrlnum:010}", {}).get(tire)
+			if entry is None:
+				return None
+			start = entry["offset"] // 8
+			count = len(entry["columns"]) * entry["rows"]
+			mapping = self._map(entry["file"], start + count)
+			data = mapping[start:start + count].reshape(len(entry["columns"]), entry["rows"])
+			return GraphData(entry["columns"], data, entry["setpressure"])
+
+	def add(self, ctrlnum: int, tire: str, columns: List[str], data: np.ndarray, setpressure: Optional[int] = None,
+			day: Optional[datetime] = None):
+		"""
+		Append a tire's graph to the segment for its day and index it. Replaces anything already stored for that tire
+
+		:param data: one row per column name
+		:param day: day the graph was recorded, defaults to today
+		"""
+		data = np.ascontiguousarray(data, dtype="<f8")
+		if data.ndim != 2 or data.shape[0] != len(columns):
+			raise ValueError(f"expected {len(columns)} rows of data, got shape {data.shape}")
+		name = f"{day or datetime.now():%Y%m%d}{SEGMENT_SUFFIX}"
+		with self._lock:
+			os.makedirs(self.root, exist_ok=True)
+			with open(os.path.join(self.root, name), "ab") as f:
+				offset = f.tell()
+				f.write(data.tobytes())
+				f.flush()
+				os.fsync(f.fileno())  # data has to be on disk before the index points at it
+			entry = {"ctrlnum": f"{ctrlnum:010}", "tire": tire, "file": name, "offset": offset, "rows": data.shape[1],
+					 "columns": list(columns), "setpressure": setpressure, "time": time.time()}
+			self._append_index(name[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX, entry)
+
+	def add_csv(self, path: str, day: Optional[datetime] = None) -> bool:
+		"""
+		Store a graph CSV named like pigraph names them, 0000002134-LFO-110.csv or 0000002134-LFO.csv
+
+		:return: False if the name or contents couldn't be parsed
+		"""
+		details = os.path.basename(path)[:-4].split("-")
+		if not 2 <= len(details) <= 3:
+			return False
+		try:
+			ctrlnum = int(details[0])
+			setpressure = int(details[2]) if len(details) == 3 else None
+			columns, data = read_csv(path)
+		except (OSError, ValueError) as e:
+			logger.error(f"could not read graph {path}", exc_info=e)
+			return False
+		self.add(ctrlnum, details[1], columns, data, setpressure, day)
+		return True
+
+	def import_csv_dir(self, graphdata: str) -> int:
+		"""
+		Migrate every graph in a graphdata folder that isn't already stored. Graphs are filed under the day their
+		control number folder was last modified.
+
+		:return: number of graphs imported
+		"""
+		imported = 0
+		for folder in sorted(os.listdir(graphdata)):
+			path = os.path.join(graphdata, folder)
+			if not os.path.isdir(path):
+				continue
+			try:
+				stored = self.lookup(int(folder))
+			except ValueError:
+				continue
+			day = datetime.fromtimestamp(os.stat(path).st_mtime)
+			for file in sorted(os.listdir(path)):
+				tire = file[:-4].split("-")[1:2]
+				if file.endswith(".csv") and tire and tire[0] not in stored:
+					imported += self.add_csv(os.path.join(path, file), day)
+		return imported
+
+	def _map(self, name, min_items):
+		# one mapping per segment, remapped when the segment has grown past what's mapped
+		mapping = self._maps.get(name)
+		if mapping is None or len(mapping) < min_items:
+			mapping = self._maps[name] = np.memmap(os.path.join(self.root, name), dtype="<f8", mode="r")
+		return mapping
+
+	def _load_index(self):
+		# reads only what was appended to each day's index since the last call
+		try:
+			names = os.listdir(self.root)
+		except OSError:
+			return self._index
+		if not self._legacy_read and LEGACY_INDEX in names:
+			self._read_legacy()
+		for name in sorted(n for n in names if n.endswith(INDEX_SUFFIX)):
+			self._read_index(name)
+		return self._index
+
+	def _read_index(self, name):
+		path = os.path.join(self.root, name)
+		done = self._index_read.get(name, 0)
+		try:
+			if os.stat(path).st_size <= done:
+				return
+			with open(path, "rb") as f:
+				f.seek(done)
+				new = f.read()
+		except OSError as e:
+			logger.warning(f"graph index {path} unreadable: {e}")
+			return
+		complete = new[:new.rfind(b"\n") + 1]  # a line still being written is read next time
+		self._index_read[name] = done + len(complete)
+		for line in complete.splitlines():
+			try:
+				entry = json.loads(line)
+			except ValueError:
+				logger.warning(f"skipping a damaged line in graph index {path}")
+				continue
+			self._merge(entry.pop("ctrlnum"), entry.pop("tire"), entry)
+
+	def _read_legacy(self):
+		self._legacy_read = True
+		path = os.path.join(self.root, LEGACY_INDEX)
+		try:
+			with open(path) as f:
+				entries = json.load(f)["entries"]
+		except (OSError, ValueError, KeyError) as e:
+			logger.warning(f"graph index {path} unreadable: {e}")
+			return
+		for ctrlnum, tires in entries.items():
+			for tire, entry in tires.items():
+				self._merge(ctrlnum, tire, dict(entry, time=0))
+
+	def _merge(self, ctrlnum, tire, entry):
+		# a tire stored again replaces what was stored before, whichever day's index it is in
+		tires = self._index.setdefault(ctrlnum, {})
+		if tire not in tires or entry.get("time", 0) >= tires[tire].get("time", 0):
+			tires[tire] = entry
+
+	def _append_index(self, name, entry):
+		path = os.path.join(self.root, name)
+		line = json.dumps(entry).encode() + b"\n"
+		with open(path, "a+b") as f:
+			f.seek(0, os.SEEK_END)
+			if f.tell():
+				f.seek(-1, os.SEEK_END)
+				if f.read(1) != b"\n":  # a line torn by a crash, start a fresh one after it
+					line = b"\n" + line
+			f.write(line)
+			f.flush()
+			os.fsync(f.fileno())
+
+
+def record_graph(path: str) -> taskpool.Task:
+	"""
+	Store a graph CSV that was just written, in the store next to its graphdata folder, in the background.
+	pigraph calls this after writing graphdata/0000002134/0000002134-LFO-110.csv, which goes in graphstore/
+
+	:return: the task, its result is add_csv's
+	"""
+	graphdata = os.path.dirname(os.path.dirname(os.path.abspath(path)))
+	store = GraphStore.open(os.path.join(os.path.dirname(graphdata), STORE_DIR))
+	return taskpool.submit("graphstore", store.add_csv, path, pool=taskpool.IO)
+
+
+def read_csv(path: str):
+	"""
+	:return: column names and the data as one row per column. files without a header get col0, col1, ...
+	"""
+	with open(path) as f:
+		first = f.readline()
+	try:
+		[float(x) for x in first.split(",")]
+		names, skip = None, 0
+	except ValueError:
+		names, skip = [x.strip() for x in first.split(",")], 1
+	data = np.loadtxt(path, delimiter=",", skiprows=skip, ndmin=2).T
+	return names or [f"col{i}" for i in range(data.shape[0])], data
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Manage inflation graph stores")
+	sub = parser.add_subparsers(dest="command", required=True)
+	imp = sub.add_parser("import", help="migrate a graphdata folder of CSVs into a store")
+	imp.add_argument("graphdata")
+	imp.add_argument("store", nargs="?", default=STORE_DIR)
+	show = sub.add_parser("show", help="list the tires stored for a control number")
+	show.add_argument("store")
+	show.add_argument("ctrlnum", type=int)
+	args = parser.parse_args()
+
+	if args.command == "import":
+		print(f"imported {GraphStore.open(args.store).import_csv_dir(args.graphdata)} graph(s)")
+	else:
+		store = GraphStore.open(args.store)
+		for tire, entry in store.lookup(args.ctrlnum).items():
+			print(f"{tire:<6} {entry['rows']:6} rows  {', '.join(entry['columns'])}  setpressure {entry['setpressure']}"
+				  f"  ({entry['file']})")
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,126 @@
+import atexit
+import json
+import os
+import threading
+from typing import Optional, TextIO
+
+import heartbeatstore
+from logger import logger
+
+FLUSH_INTERVAL = 30.0  # seconds between writes to the heartbeat store
+WAL_FILE = "heartbeat.wal"  # increments not yet flushed, one [key, value] per line
+JOURNAL_FILE = "heartbeat.journal"  # the log being applied, plus a [key] line for each key already applied
+
+_wal = None  # type: Optional[TextIO]  # WAL_FILE opened for appending, None until the next increment
+_wal_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_flush_thread = None  # type: Optional[threading.Thread]
+_stop = threading.Event()
+
+
+def increment(key: str, value):
+	"""
+	Same as heartbeatstore.increment, but only appends the increment to a log file.
+	The log is added up and written to the heartbeat store in one batch every FLUSH_INTERVAL seconds and at exit.
+	Each increment is handed to the OS before this returns, so the program crashing loses nothing. The log is synced
+	to disk at every flush, so a power cut can lose at most the last FLUSH_INTERVAL of counts.
+	"""
+	global _wal
+	if _flush_thread is None:
+		_start()
+	line = json.dumps([key, value], default=float) + "\n"  # Decimal amounts
+	with _wal_lock:
+		if _wal is None:
+			_wal = open(WAL_FILE, "a")
+		_wal.write(line)
+		_wal.flush()
+
+
+def flush():
+	"""
+	Write everything counted so far to the heartbeat store. The log is renamed to the journal, and each key is marked
+	in the journal once it is applied, so a crash or a failed write part way through carries on from the first key
+	that wasn't applied. Call this before reading values that should be up to date.
+	"""
+	global _wal
+	with _flush_lock:
+		_finish_journal()  # left by a failed flush or a crash. never overwritten
+		with _wal_lock:
+			if _wal is not None:
+				os.fsync(_wal.fileno())
+				_wal.close()
+				_wal = None
+			try:
+				os.replace(WAL_FILE, JOURNAL_FILE)
+			except FileNotFoundError:  # nothing counted since the last flush
+				return
+		_finish_journal()
+
+
+def _start():
+	# finish whatever the last run left before anything new is counted, then start flushing
+	global _flush_thread
+	with _flush_lock:
+		if _flush_thread is not None:
+			return
+		try:
+			applied = _finish_journal()
+			if applied:
+				logger.warning(f"applied {applied} heartbeat counter(s) left by an interrupted flush")
+		except Exception as e:
+			logger.error("could not apply the heartbeat journal, will retry at the next flush", exc_info=e)
+		_flush_thread = threading.Thread(target=_flush_loop, daemon=True, name="heartbeatflush")
+		_flush_thread.start()
+		atexit.register(_shutdown)
+
+
+def _flush_loop():
+	while not _stop.wait(FLUSH_INTERVAL):
+		try:
+			flush()
+		except Exception as e:
+			logger.error("heartbeat flush failed, will retry", exc_info=e)
+
+
+def _shutdown():
+	_stop.set()
+	try:
+		flush()
+	except Exception as e:
+		logger.error("heartbeat flush at exit failed, the journal is applied on the next start", exc_info=e)
+
+
+def _finish_journal() -> int:
+	# caller holds _flush_lock. applies every key in the journal that isn't marked yet, then removes it.
+	# a crash between applying a key and marking it counts that one key twice
+	try:
+		with open(JOURNAL_FILE) as f:
+			lines = f.readlines()
+	except FileNotFoundError:
+		return 0
+	batch = {}
+	applied = set()
+	for line in lines:
+		try:
+			entry = json.loads(line)
+		except ValueError:
+			logger.warning(f"skipping torn heartbeat journal line {line!r}")
+			continue
+		if len(entry) == 1:
+			applied.add(entry[0])
+		else:
+			key, value = entry
+			batch[key] = batch.get(key, 0) + value
+	count = 0
+	with open(JOURNAL_FILE, "a") as f:
+		if lines and not lines[-1].endswith("\n"):
+			f.write("\n")  # keep the marks off a torn last line
+		for key, value in batch.items():
+			if key in applied or not value:
+				continue
+			heartbeatstore.increment(key, value)
+			f.write(json.dumps([key]) + "\n")
+			f.flush()
+			count += 1
+	os.remove(JOURNAL_FILE)
+	return count
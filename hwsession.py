@@ -0,0 +1,211 @@
+"""
+Who gets to use the hardware.
+
+Routines lease the valves and sensors before touching them. A shared lease can be held by any number of routines at
+once, an exclusive one only by itself, and requests that can't be granted yet wait their turn in the order they were
+made. Read-only displays don't need to poll the Pi themselves: SensorStream polls once for everyone subscribed.
+
+	lease = hwsession.arbiter.request("Leak Test", on_grant=start, valves=hwsession.EXCLUSIVE)
+	...
+	lease.release()  # the next waiting request gets its on_grant
+"""
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import taskpool
+from logger import logger
+
+EXCLUSIVE, SHARED = "exclusive", "shared"
+VALVES, SENSORS = "valves", "sensors"
+RESOURCES = (VALVES, SENSORS)
+
+
+class Lease:
+	def __init__(self, arbiter: 'HardwareArbiter', owner: str, modes: Dict[str, str],
+				 on_grant: Optional[Callable[['Lease'], None]]):
+		self.arbiter = arbiter
+		self.owner = owner
+		self.modes = modes
+		self.on_grant = on_grant
+		self.requested = time.monotonic()
+		self.granted_at = None  # type: Optional[float]
+		self.granted = threading.Event()
+		self.released = False
+
+	def wait(self, timeout=None) -> bool:
+		return self.granted.wait(timeout)
+
+	def release(self):
+		"""
+		Give the lease back, or stop waiting for it. Safe to call more than once
+		"""
+		self.arbiter.release(self)
+
+	def describe(self):
+		return f"{self.owner} ({', '.join(f'{r} {m}' for r, m in self.modes.items())})"
+
+
+class HardwareArbiter:
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._held = []  # type: List[Lease]
+		self._waiting = []  # type: List[Lease]  # oldest first
+
+	def request(self, owner: str, on_grant: Optional[Callable[[Lease], None]] = None, **modes) -> Lease:
+		"""
+		Ask for the hardware. on_grant is called with the lease as soon as it is granted, right away if nothing is in
+		the way, otherwise from whichever thread releases the lease that was blocking it
+
+		:param owner: shown to anyone waiting behind this lease
+		:param modes: valves= and/or sensors=, each EXCLUSIVE or SHARED
+		"""
+		for resource, mode in modes.items():
+			if resource not in RESOURCES or mode not in (EXCLUSIVE, SHARED):
+				raise ValueError(f"bad lease {resource}={mode}")
+		lease = Lease(self, owner, modes, on_grant)
+		with self._lock:
+			self._waiting.append(lease)
+			granted = self._grant()
+		self._notify(granted)
+		return lease
+
+	def release(self, lease: Lease):
+		with self._lock:
+			if lease.released:
+				return
+			lease.released = True
+			if lease in self._held:
+				self._held.remove(lease)
+				logger.debug(f"hardware released by {lease.owner} after {time.monotonic() - lease.granted_at:.1f}s")
+			elif lease in self._waiting:
+				self._waiting.remove(lease)
+			granted = self._grant()
+		self._notify(granted)
+
+	def holders(self) -> List[Lease]:
+		with self._lock:
+			return list(self._held)
+
+	def waiting(self) -> List[Lease]:
+		with self._lock:
+			return list(self._waiting)
+
+	def blocking(self, lease: Lease) -> List[Lease]:
+		"""
+		:return: the held leases a waiting lease is waiting on
+		"""
+		with self._lock:
+			return [h for h in self._held if _conflict(h.modes, lease.modes)]
+
+	def _grant(self):
+		# first come first served. a request also waits for older requests it conflicts with, so a stream of shared
+		# leases can't keep an exclusive one waiting forever
+		granted = []
+		ahead = []
+		for lease in list(self._waiting):
+			if not any(_conflict(other.modes, lease.modes) for other in self._held + ahead):
+				self._waiting.remove(lease)
+				self._held.append(lease)
+				lease.granted_at = time.monotonic()
+				granted.append(lease)
+			else:
+				ahead.append(lease)
+		return granted
+
+	@staticmethod
+	def _notify(granted: List[Lease]):
+		for lease in granted:
+			logger.debug(f"hardware granted to {lease.describe()} after {lease.granted_at - lease.requested:.1f}s")
+			lease.granted.set()
+			if lease.on_grant:
+				try:
+					lease.on_grant(lease)
+				except Exception as e:
+					logger.error(f"starting {lease.owner} failed", exc_info=e)
+					lease.release()
+
+
+def _conflict(a: Dict[str, str], b: Dict[str, str]):
+	return any(r in a and r in b and EXCLUSIVE in (a[r], b[r]) for r in RESOURCES)
+
+
+arbiter = HardwareArbiter()
+
+
+class Sample:
+	__slots__ = ("time", "pressures", "temps", "readings")
+
+	def __init__(self, t, pressures, temps, readings=None):
+		self.time = t
+		self.pressures = pressures  # type: List[float]
+		self.temps = temps  # type: List[float]
+		self.readings = readings or {}  # type: Dict[str, float]  # Pi.main method name -> value, see subscribe()
+
+
+class SensorStream:
+	"""
+	One polling loop for every sensor display. It runs while anything is subscribed, and reads the raw pressures and
+	temperatures plus whichever named readings the current subscribers asked for
+	"""
+
+	def __init__(self, pi, interval=0.1):
+		self.pi = pi
+		self.interval = interval
+		self.latest = None  # type: Optional[Sample]
+		self._subscribers = []  # type: List[Callable[[Sample], None]]
+		self._channels = {}  # type: Dict[Callable[[Sample], None], tuple]  # callback -> ((method name, smoothing), ...)
+		self._lock = threading.Lock()
+		self._task = None  # type: Optional[taskpool.Task]
+
+	def subscribe(self, callback: Callable[[Sample], None], channels=(),
+				  smoothing: Optional[float] = None) -> Callable[[], None]:
+		"""
+		:param callback: called from the polling thread with every new Sample
+		:param channels: Pi.main reading methods to add to each sample's readings, like "get_pressure_barrelhose"
+		:param smoothing: seconds the channels are smoothed over, defaults to the polling interval
+		:return: call it to unsubscribe
+		"""
+		smoothing = self.interval if smoothing is None else smoothing
+		with self._lock:
+			self._subscribers.append(callback)
+			self._channels[callback] = tuple((name, smoothing) for name in channels)
+			if self._task is None or self._task.done():
+				self._task = taskpool.submit("sensorstream", self._loop, pool=taskpool.HARDWARE)
+
+		def unsubscribe():
+			with self._lock:
+				if callback in self._subscribers:
+					self._subscribers.remove(callback)
+					del self._channels[callback]
+				if not self._subscribers and self._task:
+					self._task.cancel()
+					self._task = None
+
+		return unsubscribe
+
+	def _loop(self):
+		token = taskpool.current_token()
+		while not token.cancelled:
+			start = time.monotonic()
+			with self._lock:
+				subscribers = [(callback, self._channels[callback]) for callback in self._subscribers]
+			try:
+				pressures = [r.value for r in self.pi.main.get_raw_pressures(smoothing=0)]
+				temps = [r.value for r in self.pi.main.get_temps(smoothing=0)]
+				# each channel is read once per smoothing asked for
+				values = {(name, smoothing): getattr(self.pi.main, name)(smoothing=smoothing).value
+						  for name, smoothing in sorted(set().union(*(channels for _, channels in subscribers)))}
+			except Exception as e:
+				logger.warning(f"sensor stream read failed: {e}")
+				token.wait(1)
+				continue
+			now = time.time()
+			self.latest = Sample(now, pressures, temps, {name: value for (name, _), value in values.items()})
+			for callback, channels in subscribers:
+				sample = Sample(now, pressures, temps, {name: values[name, smoothing] for name, smoothing in channels})
+				try:
+					callback(sample)
+				except Exception as e:
+					logger.error("sensor stream subscriber failed", exc_info=e)
+			token.wait(self.interval - (time.monotonic() - start))
@@ -0,0 +1,63 @@
+"""
+Modules imported the first time they are used instead of at startup.
+
+	np = lazyimport.module("numpy")
+	np.mean(x)  # numpy is imported here
+
+For modules only the maintenance popups need, so the kiosk gets on screen without paying for them. The first popup to
+use one pays instead, unless preload() got to it first in the background.
+"""
+import importlib
+import threading
+import time
+import types
+
+from logger import logger
+
+
+class LazyModule(types.ModuleType):
+	def __init__(self, name):
+		super().__init__(name)
+		self.__dict__["_lazy_module"] = None
+		self.__dict__["_lazy_lock"] = threading.Lock()
+
+	def _load(self) -> types.ModuleType:
+		with self._lazy_lock:
+			if self._lazy_module is None:
+				start = time.perf_counter()
+				self.__dict__["_lazy_module"] = importlib.import_module(self.__name__)
+				logger.debug(f"imported {self.__name__} on first use in {(time.perf_counter() - start) * 1000:.0f}ms")
+		return self._lazy_module
+
+	def __getattr__(self, name):
+		return getattr(self._load(), name)
+
+	def __dir__(self):
+		return dir(self._load())
+
+	def __repr__(self):
+		state = "loaded" if self._lazy_module is not None else "not loaded"
+		return f"<lazy module {self.__name__!r} ({state})>"
+
+	@property
+	def loaded(self):
+		return self._lazy_module is not None
+
+
+def module(name: str) -> LazyModule:
+	"""
+	:param name: full dotted name, like "PIL.ImageTk"
+	"""
+	return LazyModule(name)
+
+
+def preload(*modules: LazyModule):
+	"""
+	Import modules now, for running on a background thread once startup is done. Failures are logged, the module will
+	raise again where it is actually used
+	"""
+	for m in modules:
+		try:
+			m._load()
+		except Exception as e:
+			logger.warning(f"preloading {m.__name__} failed: {e}")
@@ -0,0 +1,284 @@
+import argparse
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Optional
+
+from logger import logger
+
+LETTER_GRADES = ['A', 'B', 'C', 'D', 'F']
+F_GRADE = 0.05  # percent change needed for worst grade
+SIM_REGULATOR_TOLERANCE = 0.05  # fraction of the simulated regulator setting the regulator test has to reach
+
+
+def grade_leak(before: float, after: float, test_time: float) -> dict:
+	"""
+	:return: dpm (Delta PSI/min), lrb (Leak Rate as a fraction of the start pressure per minute), grade and gradenum.
+			a start pressure of 0 gets the worst grade and gradenum None
+	"""
+	dpm = (before - after) * 60 / test_time
+	result = {"before": before, "after": after, "dpm": dpm, "lrb": 0, "grade": LETTER_GRADES[-1], "gradenum": None}
+	if before != 0:
+		lrb = dpm / before
+		gradenum = min(max(int((len(LETTER_GRADES) - 1) / F_GRADE * lrb), 0), len(LETTER_GRADES) - 1)
+		result.update(lrb=lrb, grade=LETTER_GRADES[gradenum], gradenum=gradenum)
+	return result
+
+
+class LeakTestEngine:
+	"""
+	Regulator and leak test, independent of any UI.
+
+	Each call to proceed() runs the next step on a worker thread, the same as pressing the button in the popup:
+	regulator test, barrel leak test, barrel + hose leak test, then finish. Progress is reported through on_event,
+	called from worker threads with one of:
+
+	- ("pressure", psi): current barrel pressure, every poll_interval seconds
+	- ("status", text): what the test is doing
+	- ("countdown", end_time): time.time() when the current timed test ends
+	- ("sound", wav): a sound to play
+	- ("ready", label): the next step can start, label is what the button should say
+	- ("n2", None): tests are done, the N2 quality can be entered before finishing
+	- ("failed", exception): a step or the pressure readings raised. everything is already stopped and closed off,
+	  a new engine is needed to try again
+	"""
+
+	def __init__(self, pi, test_time=60, on_event: Callable[[str, object], None] = None, hose_fill_time=4.0,
+				 poll_interval=0.5):
+		"""
+		:param pi: Pi or anything with the same main and safety interface
+		:param test_time: seconds each leak test lasts. can be changed until that test starts
+		:param on_event: receives progress events
+		:param hose_fill_time: seconds to let the hose fill before the barrel + hose test can start
+		:param poll_interval: seconds between pressure events
+		"""
+		self.pi = pi
+		self.speed = getattr(pi, "speed", 1.0)  # simulated Pis can run faster than real time
+		self.test_time = test_time
+		self.on_event = on_event or (lambda kind, value: None)
+		self.hose_fill_time = hose_fill_time
+		self.poll_interval = poll_interval
+		self.phase = 0
+		self.start_time = datetime.now()
+		self.max_pressure = 0
+		self.b_before = self.b_after = self.bh_before = self.bh_after = 0  # b = barrel, h = hose
+		self.b_time = self.bh_time = test_time
+		self.error = None  # type: Optional[Exception]  # what made the test fail, if anything did
+		self._stop = threading.Event()
+		self._step = None  # type: Optional[threading.Thread]
+
+	def start(self):
+		"""
+		Close off the system and start reporting pressure. Call proceed() to start the first test
+		"""
+		self.pi.main.state_no_flow()
+		self.pi.safety.open()
+		threading.Thread(target=self._pressure_loop, daemon=True, name="leaktest-pressure").start()
+
+	def proceed(self):
+		"""
+		Run the next step in the background. Ignored while a step is still running
+		"""
+		if self._step and self._step.is_alive():
+			return
+		steps = {0: self._regulator_test, 1: self._barrel_test, 2: self._barrel_hose_test, 3: self._finish}
+		step = steps.get(self.phase)
+		if step is None:
+			return
+		self._step = threading.Thread(target=self._run_step, args=(step,), daemon=True, name="leaktest")
+		self._step.start()
+
+	def stop(self):
+		"""
+		Abort whatever is running and close everything off. Safe to call more than once
+		"""
+		self._stop.set()
+		self.pi.main.stop()
+		self.pi.main.state_no_flow()
+		self.pi.safety.close()
+
+	def wait(self, timeout=None):
+		"""
+		Wait for the current step to finish
+		"""
+		if self._step:
+			self._step.join(timeout)
+
+	def results(self) -> dict:
+		return {"start_time": self.start_time, "max_pressure": self.max_pressure,
+				"barrel": grade_leak(self.b_before, self.b_after, self.b_time),
+				"barrel_hose": grade_leak(self.bh_before, self.bh_after, self.bh_time)}
+
+	def run_all(self, regulator_time=10.0) -> dict:
+		"""
+		Run every step back to back in this thread, for unattended tests. The N2 quality is left alone
+		"""
+		self.start()
+		try:
+			for step, delay in ((self._regulator_test, regulator_time), (self._barrel_test, 0),
+								(self._barrel_hose_test, 0), (self._finish, 0)):
+				step()
+				if self._stopped(delay):
+					break
+			if self.error:
+				raise self.error
+			return self.results()
+		finally:
+			self.stop()
+
+	def _emit(self, kind, value=None):
+		self.on_event(kind, value)
+
+	def _stopped(self, delay=0.0):
+		# delay is in the Pi's time
+		return self._stop.wait(delay / self.speed) if delay > 0 else self._stop.is_set()
+
+	def _run_step(self, step):
+		try:
+			step()
+		except Exception as e:
+			self._fail("leak test step failed", e)
+
+	def _fail(self, what, e):
+		# a test that lost its readings or a step can't be graded. put the valves in a safe state and tell the UI
+		if self.error is not None:
+			return  # the other thread already failed it, this is fallout from stopping
+		logger.error(what, exc_info=e)
+		self.error = e
+		try:
+			self.stop()
+		except Exception as stop_error:
+			logger.error("could not close off the system after the leak test failed", exc_info=stop_error)
+		self._emit("failed", e)
+
+	def _pressure_loop(self):
+		try:
+			while not self._stop.is_set():
+				self._emit("pressure", self.pi.main.get_pressure_barrel().value)
+				self._stop.wait(self.poll_interval / self.speed)
+		except Exception as e:
+			self._fail("leak test lost the barrel pressure reading", e)
+
+	def _timed_test(self, end_step):
+		self._emit("sound", "files/1.5-system-starting.wav")
+		end_time = time.time() + self.test_time / self.speed
+		self._emit("countdown", end_time)
+		if self._stopped(self.test_time):
+			return False
+		end_step()
+		self._emit("sound", "files/ding.wav")
+		return True
+
+	def _regulator_test(self):
+		self._emit("status", "Regulator Test")
+		self.start_time = datetime.now()
+		self.pi.main.state_barrel_inflate()
+		self.phase = 1
+		if not self._stopped(1.0):  # brief wait to avoid double-pressing
+			self._emit("ready", "Continue")
+
+	def _barrel_test(self):  # tests just the barrel
+		self.max_pressure = self.pi.main.get_pressure_barrelhose().value  # for regulator test
+		self.pi.main.state_no_flow()  # close hose off
+		self._emit("status", "Barrel Leak Test")
+		if self._stopped(1.0):
+			return
+		# record initial barrel pressure
+		self.b_before = self.pi.main.wait_for_steady_pressure(self.pi.main.get_pressure_barrel, max_wait=10,
+															  max_deviation=0.15, smoothing=1.0).value
+		if self._stopped():
+			return
+		self.b_time = self.test_time
+
+		def end():
+			self.b_after = self.pi.main.get_pressure_barrel().value
+
+		if not self._timed_test(end):
+			return
+		self._emit("status", "Let hose fill, then continue")
+		self.pi.main.state_barrel_hose_inflate(block=False)
+		self.phase = 2
+		# wait a few seconds before letting them press to let barrel and hose inflate at least a little
+		if not self._stopped(self.hose_fill_time):
+			self._emit("ready", "Continue")
+
+	def _barrel_hose_test(self):  # tests the barrel and hose
+		self._emit("status", "Barrel + Hose Leak Test")
+		self.pi.main.state_barrel_hose_flow()  # hose will be open
+		if self._stopped(1.0):
+			return
+		# record initial barrel+hose pressure
+		self.bh_before = self.pi.main.wait_for_steady_pressure(self.pi.main.get_pressure_barrelhose, max_wait=15,
+															   max_deviation=0.15, smoothing=1.0).value
+		if self._stopped():
+			return
+		self.bh_time = self.test_time
+
+		def end():
+			self.bh_after = self.pi.main.get_pressure_barrelhose().value
+
+		if not self._timed_test(end):
+			return
+		self.phase = 3
+		self._emit("status", "Enter Nitrogen Quality")
+		self._emit("n2")
+		self._emit("ready", "Submit")
+
+	def _finish(self):
+		self._emit("status", "Finished All Tests")
+		self.pi.main.state_barrel_hose_deflate()  # release air
+		self.phase = 4
+		self._emit("ready", "Print")
+
+
+def format_results(results: dict) -> str:
+	lines = [f"System Leak Test {results['start_time']:%m/%d/%Y %H:%M:%S}",
+			 f"Max Pressure Ach. {results['max_pressure']:.2f} PSI"]
+	for title, key in (("Barrel Leak Test", "barrel"), ("Barrel + Hose Leak Test", "barrel_hose")):
+		r = results[key]
+		lines.append(f"{title}: {r['before']:.2f} -> {r['after']:.2f} PSI, {max(r['dpm'], 0):.2f} PSI/min, "
+					 f"{max(r['lrb'] * 100, 0):.2f}%/min, grade {r['grade']}")
+	return "\n".join(lines)
+
+
+def check_simulated_regulator(results: dict, regulator: float) -> Optional[str]:
+	"""
+	Sanity check for runs against the simulator, which knows what the regulator is set to
+
+	:return: what is wrong with the regulator test, or None if it reached the regulator
+	"""
+	if results["max_pressure"] < regulator * (1 - SIM_REGULATOR_TOLERANCE):
+		return f"regulator test reached {results['max_pressure']:.2f} PSI, the simulated regulator is at {regulator:.1f}"
+	return None
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Run the regulator and leak test without the GUI")
+	parser.add_argument("--time", type=int, default=60, help="seconds for each leak test")
+	parser.add_argument("--regulator-time", type=float, default=10.0, help="seconds to fill for the regulator test")
+	parser.add_argument("--fail-grade", default="F", choices=LETTER_GRADES,
+						help="exit with an error if either test grades this or worse")
+	parser.add_argument("--simulate", action="store_true", help="run against a simulated Pi instead of the hardware")
+	parser.add_argument("--speed", type=float, default=1.0, help="how many times faster than real time to simulate")
+	args = parser.parse_args()
+
+	if args.simulate:
+		from pisim import SimPi
+		pi = SimPi(args.speed)
+	else:
+		from pimagic import Pi as pi  # only needed here, the engine itself works with any Pi-like object
+	engine = LeakTestEngine(pi, test_time=args.time,
+							on_event=lambda kind, value: print(value) if kind == "status" else None)
+	results = engine.run_all(args.regulator_time)
+	print(format_results(results))
+	if args.simulate:
+		problem = check_simulated_regulator(results, pi.params.regulator)
+		if problem:
+			print(problem)
+			return 1
+	worst = max(LETTER_GRADES.index(results[key]["grade"]) for key in ("barrel", "barrel_hose"))
+	return 1 if worst >= LETTER_GRADES.index(args.fail_grade) else 0
+
+
+if __name__ == '__main__':
+	raise SystemExit(main())
@@ -1,3 +1,5 @@
+import atexit
+import json
 import os
 import re
 import shutil
@@ -13,38 +15,170 @@ from shutil import copyfile, SameFileError
 from tkinter import ttk, messagebox, filedialog
 from typing import Optional
 
-import matplotlib.pyplot as plt
-import numpy as np
-import paramiko
-import requests
-from PIL import ImageTk, Image
+from PIL import Image
 from uptime import uptime
 
-import aprivatoken
 import audiohandler
+import backup_catalog
 import backup_files
 import bulk_charge
 import constants
 import email_reciept
 import employee_log
-import fts_util
 import fts_widgets
 import genanyreceipt
+import hwsession
+import lazyimport
+import leaktest
 import main_window
-import otireader
-import pigraph
-from calibration import CalibrationWindow
+import pimacro
+import pirpc
+import sqlmanager
+import synclog
+import taskpool
+from configsaver import DebouncedSaver
+from couponcache import CouponCache
 from fts_util import guarantee_message_send, run_main_thread
 from globals import Maint, Data
 from logger import logger
 from pdfgen import PDFGen
 from photocache import PhotoCache
-from pimagic import Pi, pyro_run
+from pimagic import Pi as PiProxies, pyro_run
 from popups import COFPopup
 from printpdf import convertandprint, convertpdf, printimage
-from sqlmanager import Database
+from tkwatchdog import TkWatchdog
+from uidispatch import UIDispatcher
 from otistructs import Status
 
+# only the popups use these, so they are imported when one first needs them rather than at startup
+np = lazyimport.module("numpy")
+paramiko = lazyimport.module("paramiko")
+requests = lazyimport.module("requests")
+ImageTk = lazyimport.module("PIL.ImageTk")
+aprivatoken = lazyimport.module("aprivatoken")
+calibration = lazyimport.module("calibration")
+graphstore = lazyimport.module("graphstore")
+otireader = lazyimport.module("otireader")
+pigraph = lazyimport.module("pigraph")
+plotwidget = lazyimport.module("plotwidget")  # matplotlib
+sensorlog = lazyimport.module("sensorlog")
+PRELOAD_DELAY = 15000  # ms after the screen is built to start importing the heavy ones in the background
+
+RESTORE_LIST_SIZE = 20  # number of past inflations offered in the restore menu
+MINIONS_CACHE = "minions_cache.json"  # last minion names read from the database, shown until a fresh read finishes
+IMAGE_BATCH = 4  # button images loaded per idle pass while the screen is coming up
+
+Pi = pirpc.DeadlinePi(PiProxies)  # every call to the Pi from here has a deadline, see pirpc.summary() for latencies
+sensor_stream = hwsession.SensorStream(Pi)  # raw readings shared by every display that wants them
+# what each maintenance routine needs. anything that moves valves has them to itself, readings can always be shared
+DRIVES_VALVES = dict(valves=hwsession.EXCLUSIVE, sensors=hwsession.SHARED)
+READS_SENSORS = dict(sensors=hwsession.SHARED)
+
+
+def stack_images(images):
+    """
+    Joins receipt chunks top to bottom into one strip. Chunks are freed from the list as they are copied in
+
+    :param images: PIL images of the same width, in order
+    """
+    strip = Image.new(images[0].mode, (images[0].width, sum(i.height for i in images)), "white")
+    y = 0
+    while images:
+        image = images.pop(0)
+        strip.paste(image, (0, y))
+        y += image.height
+    return strip
+
+
+def try_closing(what, func, *args):
+    """
+    For close handlers. A Pi that is slow or unreachable is logged, but doesn't keep the window from closing
+    """
+    try:
+        func(*args)
+    except Exception as e:  # RPCTimeout, or Pyro's communication errors
+        logger.error(f"{what} failed while closing", exc_info=e)
+
+
+def start_hardware_loop(what, func, *args) -> taskpool.Task:
+    """
+    For start buttons. Runs func on the hardware pool, and if every hardware worker is busy says so, since the loop
+    won't start until another one ends
+    """
+    if taskpool.full(taskpool.HARDWARE):
+        messagebox.showwarning(what, f"Too many hardware windows are running. {what} will start when one of them is "
+                                     f"closed.")
+    return taskpool.submit(what, func, *args, pool=taskpool.HARDWARE)
+
+
+def _minions_text(rows):
+    return ", ".join(f"{id_} {name}" for id_, name in rows) or "none"
+
+
+def _cached_minions():
+    try:
+        with open(MINIONS_CACHE) as f:
+            return _minions_text(json.load(f))
+    except (OSError, ValueError, TypeError):
+        return "..."
+
+
+Database = synclog.TrackedDatabase(sqlmanager.Database)  # writes are logged so a sync only sends what changed
+
+SYNC_EXIT_TIMEOUT = 30.0  # seconds to let a running database sync finish when the program exits
+_sync_task = None  # type: Optional[taskpool.Task]
+_sync_again = False  # changes came in while a sync was running, it runs once more when it's done
+_sync_lock = threading.Lock()
+
+
+def sync_database() -> taskpool.Task:
+    """
+    Send what changed to the server on the IO pool, one sync at a time. Asking while a sync is queued doesn't queue another, asking while
+    one is running has it go around once more afterwards so it picks up what changed meanwhile
+    """
+    global _sync_task, _sync_again
+    with _sync_lock:
+        if _sync_task is None or _sync_task.done():  # done covers a sync cancelled before it started
+            _sync_again = False
+            _sync_task = taskpool.submit("sync_all", _sync_loop)
+        elif _sync_task.started is not None:  # a queued sync will see the changes anyway
+            _sync_again = True
+        return _sync_task
+
+
+def _sync_loop():
+    global _sync_task, _sync_again
+    while True:
+        try:
+            _sync_once()
+        except Exception as e:
+            logger.error("Database sync failed", exc_info=e)
+        with _sync_lock:
+            if not _sync_again:
+                _sync_task = None
+                return
+            _sync_again = False
+
+
+def _sync_once():
+    # only the rows logged since the last sync, when sqlmanager can take them. otherwise a full sync, which covers
+    # everything logged before it started
+    send = getattr(sqlmanager.Database, "sync_changes", None)
+    if send is not None:
+        synclog.push(send)
+        return
+    seq = synclog.last_seq()
+    sqlmanager.Database.sync_all()
+    synclog.acknowledge(seq)
+
+
+@atexit.register
+def _finish_sync():
+    # exiting kills the worker mid sync otherwise. whatever it didn't get to is left for the next sync
+    task = _sync_task
+    if task and not task.wait(SYNC_EXIT_TIMEOUT):
+        logger.warning(f"Database sync still running {SYNC_EXIT_TIMEOUT:.0f}s into exit, leaving the rest for next time")
+
 
 class MaintenanceScreen(tk.Frame):
     instance: 'MaintenanceScreen' = None  # holds the main reference to the maintenance screen for others to use
@@ -69,74 +203,53 @@ class MaintenanceScreen(tk.Frame):
         # 0.5975  |  .                .                X================X================X================
         #         |  X================X================X
 
-        maintenance_screen_logo = PhotoCache.get("AASTRAEA logo.png")
-        tk.Label(self, bd=0, image=maintenance_screen_logo).place(x=0.2245, y=0.1800, relheight=0.0610, relwidth=0.0182)
-        txtbar = tk.Text(self, text=Database.select('minions', ('id', 'name')))
-        txtbar = {"Minion": ['id'] + ['name'] in txtbar}
-        txtbar.configure(highlightthickness=0, bd=0)
-        txtbar.place(relx=0.5900, rely=0)
-        obcbtn = tk.Button(self, image=PhotoCache.get("maint_obc_btn.png"), command=self.gen_obc)  # done
-        obcbtn.configure(highlightthickness=0, bd=0, relief='flat')
-        obcbtn.place(relx=0.04175, rely=0.2610)
-        sysleak = tk.Button(self, image=PhotoCache.get("systemleaktest.png"), command=self.leak_test_pop)  # done
-        sysleak.configure(highlightthickness=0, bd=0, relief='flat')
-        sysleak.place(relx=0.04175, rely=0.3465)
-        syscaltf = tk.Button(self, image=PhotoCache.get("15ptsystemcalibration.png"), command=self.calib_pop)  # done
-        syscaltf.configure(highlightthickness=0, bd=0, relief='flat')
-        syscaltf.place(relx=0.04175, rely=0.4320)
-        hpcalibbtn = tk.Button(self, image=PhotoCache.get("hpcalib.png"), command=self.hpcalib_pop)  # done
-        hpcalibbtn.configure(highlightthickness=0, bd=0, relief='flat')
-        hpcalibbtn.place(relx=0.04175, rely=0.5155)
-        self.mines = tk.Button(self, image=PhotoCache.get("minionemailstatusandtest.png"))
-        self.mines.configure(highlightthickness=0, bd=0, relief='flat')
-        self.mines.place(relx=0.2245, rely=0.4310)
-        graphbtn = tk.Button(self, image=PhotoCache.get("maint_graphing_button.png"), command=self.graphing_pop)
-        graphbtn.configure(highlightthickness=0, bd=0, relief='flat')
-        graphbtn.place(relx=0.2245, rely=0.5155)
-        graphbtn = tk.Button(self, image=PhotoCache.get("tireresponse_button.png"), command=self.tire_response_pop)
-        graphbtn.configure(highlightthickness=0, bd=0, relief='flat')
-        graphbtn.place(relx=0.4072, rely=0.5155)
-        valvact = tk.Button(self, image=PhotoCache.get("valveactuation.png"), command=self.valve_control)
-        valvact.configure(highlightthickness=0, bd=0, relief='flat')
-        valvact.place(relx=0.40725, rely=0.1800)
-        frt = tk.Button(self, image=PhotoCache.get("flowratetest.png"), command=self.flowrate_test)
-        frt.configure(highlightthickness=0, bd=0, relief='flat')
-        frt.place(relx=0.4072, rely=0.4320)
-        driveop = tk.Button(self, image=PhotoCache.get("driveoptimization.png"),
-                            command=self.driveOp_pop)  # calls defrag
-        driveop.configure(highlightthickness=0, bd=0, relief='flat')
-        driveop.place(relx=0.5900, rely=0.2610)
-        employee_clock_button = tk.Button(self, image=PhotoCache.get("employee_clock_button.png"),
-                                          command=self.employee_clock_popup)
-        employee_clock_button.configure(highlightthickness=0, bd=0, relief='flat')
-        employee_clock_button.place(relx=0.7727, rely=0.4320)
-        kinfo = tk.Button(self, image=PhotoCache.get("kioskinformation.png"), command=self.kiosk_info)
-        kinfo.configure(highlightthickness=0, bd=0, relief='flat')
-        kinfo.place(relx=0.5900, rely=0.4320)
-        filltime = tk.Button(self, image=PhotoCache.get("fillvalvetime.png"), command=self.fill_valve_timing)
-        filltime.configure(highlightthickness=0, bd=0, relief='flat')
-        filltime.place(relx=0.5900, rely=0.5155)
-        # opschedule_btn = tk.Button(self, image=PhotoCache.get("opschedule_img.png"), command=self.operation_schedule_ticket_gui)
-        # opschedule_btn.configure(highlightthickness=0, bd=0, relief='flat')
-        # opschedule_btn.place(relx=0.04175, rely=0.5975)
-        rmg_btn = tk.Button(self, image=PhotoCache.get("maint_coupon_button.png"), command=self.change_coupon)
-        rmg_btn.configure(highlightthickness=0, bd=0, relief='flat')
-        rmg_btn.place(relx=0.7727, rely=0.2610)
-        promo_btn = tk.Button(self, image=PhotoCache.get("maint_promo_button.png"), command=self.change_promo)
-        promo_btn.configure(highlightthickness=0, bd=0, relief='flat')
-        promo_btn.place(relx=0.7727, rely=0.3465)
-        gengraph_button = tk.Button(self, image=PhotoCache.get("maint_gen_graph_button.png"),
-                                    command=self.gen_graph_popup)
-        gengraph_button.configure(highlightthickness=0, bd=0, relief='flat')
-        gengraph_button.place(relx=0.7727, rely=0.5150)
-        bulkcharge_button = tk.Button(self, image=PhotoCache.get("maint_bulk_charge_button.png"),
-                                      command=self.bulk_charge_popup)
-        bulkcharge_button.configure(highlightthickness=0, bd=0, relief='flat')
-        bulkcharge_button.place(relx=0.7727, rely=0.1800)
-        restore_inf_button = tk.Button(self, image=PhotoCache.get("restore_inf_button.png"),
-                                       command=self.restore_inflation_popup)
-        restore_inf_button.configure(highlightthickness=0, bd=0, relief='flat')
-        restore_inf_button.place(relx=0.5900, rely=0.3465)
+        self.minion_bar = tk.Label(self, text="Minion: " + _cached_minions(), anchor=tk.W)
+        self.minion_bar.configure(highlightthickness=0, bd=0)
+        self.minion_bar.place(relx=0.5900, rely=0)
+        taskpool.submit("minions", self._fetch_minions)
+
+        # image, position, placeholder text, command. the buttons go up with their text straight away and the images
+        # replace it a few at a time once the screen is showing, see _load_images
+        buttons = [
+            ("maint_obc_btn.png", 0.04175, 0.2610, "OBC", self.gen_obc),
+            ("systemleaktest.png", 0.04175, 0.3465, "Leak Test",
+             partial(self.hardware_popup, "Leak Test", self.leak_test_pop, **DRIVES_VALVES)),
+            ("15ptsystemcalibration.png", 0.04175, 0.4320, "Calibration", self.calib_pop),
+            ("hpcalib.png", 0.04175, 0.5155, "HP Calibration", self.hpcalib_pop),
+            ("minionemailstatusandtest.png", 0.2245, 0.4310, "Minion Status", None),  # set_heartbeat_callback
+            ("maint_graphing_button.png", 0.2245, 0.5155, "Graphing",
+             partial(self.hardware_popup, "Graphing", self.graphing_pop, **READS_SENSORS)),
+            ("tireresponse_button.png", 0.4072, 0.5155, "Tire Response",
+             partial(self.hardware_popup, "Tire Response Test", self.tire_response_pop, **DRIVES_VALVES)),
+            ("valveactuation.png", 0.40725, 0.1800, "Valve Control",
+             partial(self.hardware_popup, "Valve Control", self.valve_control, **DRIVES_VALVES)),
+            ("flowratetest.png", 0.4072, 0.4320, "Flow Rate Test",
+             partial(self.hardware_popup, "Flow Rate Test", self.flowrate_test, **DRIVES_VALVES)),
+            ("driveoptimization.png", 0.5900, 0.2610, "Drive Optimization", self.driveOp_pop),  # calls defrag
+            ("employee_clock_button.png", 0.7727, 0.4320, "Employee Clock", self.employee_clock_popup),
+            ("kioskinformation.png", 0.5900, 0.4320, "Kiosk Info", self.kiosk_info),
+            ("fillvalvetime.png", 0.5900, 0.5155, "Valve Cycle Test",
+             partial(self.hardware_popup, "Valve Cycle Test", self.fill_valve_timing, **DRIVES_VALVES)),
+            # ("opschedule_img.png", 0.04175, 0.5975, "Op Schedule", self.operation_schedule_ticket_gui),
+            ("maint_coupon_button.png", 0.7727, 0.2610, "Coupon", self.change_coupon),
+            ("maint_promo_button.png", 0.7727, 0.3465, "Promo", self.change_promo),
+            ("maint_gen_graph_button.png", 0.7727, 0.5150, "Graph", self.gen_graph_popup),
+            ("maint_bulk_charge_button.png", 0.7727, 0.1800, "Bulk Charge", self.bulk_charge_popup),
+            ("restore_inf_button.png", 0.5900, 0.3465, "Restore Inflation", self.restore_inflation_popup),
+            ("exitmaintenance.png", 0.7720, 0.9150, "Exit Maintenance", None),  # set_exit_callback
+        ]
+        logo = tk.Label(self, bd=0)
+        logo.place(x=0.2245, y=0.1800, relheight=0.0610, relwidth=0.0182)
+        images = [(logo, "AASTRAEA logo.png")]
+        self.menu_buttons = {}  # image -> button
+        for image, relx, rely, text, command in buttons:
+            btn = tk.Button(self, text=text, command=command, highlightthickness=0, bd=0, relief='flat')
+            btn.place(relx=relx, rely=rely)
+            self.menu_buttons[image] = btn
+            images.append((btn, image))
+        self.mines = self.menu_buttons["minionemailstatusandtest.png"]
+        self.exmain = self.menu_buttons["exitmaintenance.png"]
+        self.after_idle(self._load_images, images)
 
         # buttons that we don't use anymore, but could
 
@@ -189,10 +302,6 @@ class MaintenanceScreen(tk.Frame):
         disable_btn = tk.Button(self, text="Save Values", font=edit_font, command=self.disab_maint, bg="#5555dd")
         disable_btn.place(relx=0.16, rely=0.92)
 
-        self.exmain = tk.Button(self, image=PhotoCache.get("exitmaintenance.png"))
-        self.exmain.configure(highlightthickness=0, bd=0, relief='flat')
-        self.exmain.place(relx=0.7720, rely=0.9150)
-
         # Label(maintenance_screen, text = "System Error %:", font=mainnew_small_font).place(relx = 0.848 , rely = 0.62, anchor = E)
         self.create_registered_field("set_presserr", relx=0.1350, rely=0.7175, width=15)
         # Label(maintenance_screen, text = "Hose Press SP %:", font=mainnew_small_font).place(relx = 0.848 , rely = 0.67, anchor = E)
@@ -213,10 +322,44 @@ class MaintenanceScreen(tk.Frame):
         self.create_registered_field("max_wait_time", relx=0.3425, rely=0.955, width=8)
         self.create_registered_field("tank_liters", relx=0.4925, rely=0.955, width=9)
 
+        self.config_saver = DebouncedSaver(self, Maint.config_file, Maint.save_to_json, "maintenance values",
+                                           on_error=self._config_save_failed)
+        CouponCache.sync_async()  # so receipts and the coupon window start with an up to date local copy
+        TkWatchdog.start(master)  # logs anything that blocks the event loop, see tkstalls.log
+        self.ui = UIDispatcher.start(master)  # sensor displays update through this, once per frame
+        # so the first popup to plot doesn't stall the screen importing matplotlib
+        self.after(PRELOAD_DELAY, taskpool.submit, "preload", lazyimport.preload, np, plotwidget, sensorlog)
+        self.after(PRELOAD_DELAY, backup_catalog.refresh_if_changed)  # so the restore list is current when needed
+
         self.disab_maint()
 
         MaintenanceScreen.instance = self
 
+    def _load_images(self, pending):
+        # a batch per idle pass, so the screen keeps handling input while the rest decode
+        for widget, image in pending[:IMAGE_BATCH]:
+            try:
+                widget.configure(image=PhotoCache.get(image))
+            except tk.TclError:  # the screen was torn down before it finished loading
+                return
+        if len(pending) > IMAGE_BATCH:
+            self.after_idle(self._load_images, pending[IMAGE_BATCH:])
+
+    def _fetch_minions(self):
+        # the database can be slow or unreachable, so this runs in the background and the bar shows the last names seen
+        try:
+            rows = [[id_, name] for id_, name in Database.select('minions', ('id', 'name'))]
+        except Exception as e:  # select returns None when it can't connect, which fails here too
+            logger.error("Could not read minion names", exc_info=e)
+            run_main_thread(self.minion_bar.config, {"text": "Minion: " + _cached_minions() + " (offline, not updated)"})
+            return
+        try:
+            with open(MINIONS_CACHE, "w") as f:
+                json.dump(rows, f)
+        except OSError as e:
+            logger.warning(f"Could not cache minion names: {e}")
+        run_main_thread(self.minion_bar.config, {"text": "Minion: " + _minions_text(rows)})
+
     def create_registered_field(self, key, relx, rely, text="", bind=True, **kw):
         entry = tk.Entry(self, font=('Helvetica-Bold', 14), bd=10, relief=tk.FLAT, **kw)
         if bind:
@@ -251,15 +394,15 @@ class MaintenanceScreen(tk.Frame):
         self.save_maint()
         self._config_maint(tk.DISABLED)
 
-    def save_maint(self):
+    def save_maint(self, _event=None):
         """
-		Save entry values to file
+		Save entry values to file. The file is written once edits stop for a moment
 		"""
         Maint.vals.refresh()
-        try:
-            Maint.save_to_json(Maint.config_file)
-        except OSError as e:
-            logger.error("could not save maintenance values...", exc_info=e)
+        self.config_saver.request()
+
+    def _config_save_failed(self, e):
+        messagebox.showerror("Maintenance", f"Maintenance values could not be saved:\n{e}")
 
     def drive_op(self):
         subprocess.call('RUNAS /user:admin "defrag C:"')
@@ -336,7 +479,7 @@ class MaintenanceScreen(tk.Frame):
             employee_box.config(state='readonly')
 
         def on_select(_event=None):
-            threading.Thread(target=do_select, daemon=True, name="employeeselect").start()
+            taskpool.submit("employeeselect", do_select)
 
         employee_name_map = employee_log.load_active_employees()
         employee_names = list(sorted(employee_name_map.keys()))
@@ -536,7 +679,7 @@ class MaintenanceScreen(tk.Frame):
                 etime_var.set('Server error.')  # didn't switch
 
         def clock_in():
-            threading.Thread(target=t_clock_in, daemon=True, name="clockin").start()
+            taskpool.submit("clockin", t_clock_in)
 
         def t_clock_out():
             nonlocal locked
@@ -573,7 +716,7 @@ class MaintenanceScreen(tk.Frame):
                 etime_var.set('Server error.')  # didn't switch
 
         def clock_out():
-            threading.Thread(target=t_clock_out, daemon=True, name="clockout").start()
+            taskpool.submit("clockout", t_clock_out)
 
         clock_in_img = PhotoCache.get("clock_in.png")
         clock_out_img = PhotoCache.get("clock_out.png")
@@ -598,16 +741,59 @@ class MaintenanceScreen(tk.Frame):
 
         update_time()
 
+    def hardware_popup(self, owner: str, popup: callable, **modes):
+        """
+        Open a popup that uses the hardware once nothing it conflicts with is using it. Until then a small window
+        says what it is waiting for and lets them give up. The lease goes back when the popup's window is destroyed
+
+        :param owner: name shown to anything waiting behind this popup
+        :param popup: builds the popup and returns its window
+        :param modes: valves= and sensors= for hwsession.arbiter.request
+        """
+        waiting = None  # type: Optional[tk.Toplevel]
+
+        def show(lease: hwsession.Lease):
+            if waiting is not None and waiting.winfo_exists():
+                waiting.destroy()
+            if lease.released:  # they gave up just as it was granted
+                return
+            try:
+                win = popup()
+            except Exception:
+                lease.release()
+                raise
+            win.bind("<Destroy>", lambda e: lease.release() if e.widget is win else None, add="+")
+
+        lease = hwsession.arbiter.request(owner, on_grant=lambda l: run_main_thread(show, l), **modes)
+        if lease.granted.is_set():
+            return
+
+        waiting = tk.Toplevel(self.root)
+        waiting.attributes('-topmost', True)
+        waiting.title(owner)
+        message = tk.StringVar()
+        tk.Label(waiting, textvariable=message, font=("Helvetica", 14), padx=10, pady=10).pack()
+
+        def update_message():
+            if waiting.winfo_exists() and not lease.granted.is_set():
+                holders = ", ".join(h.owner for h in hwsession.arbiter.blocking(lease))
+                message.set(f"{owner} will start when {holders or 'the hardware'} is done")
+                waiting.after(500, update_message)
+
+        def give_up():
+            lease.release()
+            waiting.destroy()
+
+        tk.Button(waiting, text="Cancel", font=("Helvetica", 14), command=give_up).pack(pady=5)
+        waiting.protocol("WM_DELETE_WINDOW", give_up)
+        update_message()
+
     def leak_test_pop(self):
         leak_win = tk.Toplevel(self.root)
         leak_win.attributes('-topmost', 'true')
         leak_win.title("Regulator and Leak Test")
         leak_win.geometry('400x300')
 
-        leak_test_start_time = datetime.now()
-        win_run = True
-        phase = 0
-
         regular_font = ('Helvetica', 18)
         test_name = tk.StringVar()
         tk.Label(leak_win, textvariable=test_name, font=regular_font).place(relx=0.1, rely=0.05)
@@ -642,21 +828,48 @@ class MaintenanceScreen(tk.Frame):
             except ValueError:
                 return 60
 
+        win_run = True
         time_done = 0  # used for printing time left on the screen
-        b_before = b_after = bh_before = bh_after = 0  # b = barrel, h = hose
-        max_pressure = 0
 
-        Pi.main.state_no_flow()
-        Pi.safety.open()
-
-        def update_pressure_loop():  # updates the main pressure display
-            if win_run:
-                current_pressure.set("{:.2f}".format(Pi.main.get_pressure_barrel().value))
-                leak_win.update_idletasks()
-                leak_win.update()
-                leak_win.after(500, update_pressure_loop)
+        # the engine runs the test on its own threads, this window only shows its events and forwards button presses
+        def on_event(kind, value):
+            if not win_run:
+                return
+            if kind in ("pressure", "countdown"):  # only the latest reading matters
+                self.ui.post((str(leak_win), kind), show_event, kind, value)
+            else:
+                run_main_thread(show_event, kind, value)
 
-        update_pressure_loop()
+        def show_event(kind, value):
+            nonlocal time_done
+            if not win_run:
+                return
+            if kind == "pressure":
+                current_pressure.set("{:.2f}".format(value))
+            elif kind == "status":
+                test_name.set(value)
+            elif kind == "countdown":
+                time_done = value
+            elif kind == "sound":
+                audiohandler.play_wav(value)
+            elif kind == "ready":
+                main_button.config(text=value, state=tk.NORMAL)
+            elif kind == "n2":
+                box_label.config(text="N2 Quality %:")
+                n2_quality_box.place(relx=0.5, rely=0.8, anchor=tk.CENTER)
+                test_time_box.place_forget()
+            elif kind == "failed":  # the engine has logged it and closed everything off
+                test_name.set("Test failed")
+                time_done = 0
+                main_button.config(text="Retry", state=tk.NORMAL)
+
+        def new_engine():
+            nonlocal engine
+            engine = leaktest.LeakTestEngine(Pi, test_time=get_test_time(), on_event=on_event)
+            engine.start()
+
+        engine = None
+        new_engine()
 
         def update_time_loop():  # updates the time left display
             if win_run:
@@ -671,62 +884,8 @@ class MaintenanceScreen(tk.Frame):
 
         # TODO: need to check HP safety that there is no leak
         #		probably as long as v1 is closed, check no decrease over long periods of time
-        def start_leak_test_1():  # tests just the barrel
-            nonlocal max_pressure, time_done, b_before
-            max_pressure = Pi.main.get_pressure_barrelhose().value  # for regulator test
-            Pi.main.state_no_flow()  # close hose off
-            test_name.set("Barrel Leak Test")
-            time.sleep(1.0)
-            # record initial barrel pressure
-            b_before = Pi.main.wait_for_steady_pressure(Pi.main.get_pressure_barrel, max_wait=10, max_deviation=0.15,
-                                                        smoothing=1.0).value
-            if not win_run:
-                return
-            audiohandler.play_wav("files/1.5-system-starting.wav")
-            time_done = time.time() + get_test_time()  # set the timer
-            leak_win.after(get_test_time() * 1000, end_leak_test_1)
-
-        def end_leak_test_1():
-            nonlocal b_after, phase
-            b_after = Pi.main.get_pressure_barrel().value
-            test_name.set("Let hose fill, then continue")
-            audiohandler.play_wav("files/ding.wav")
-            Pi.main.state_barrel_hose_inflate(block=False)
-            phase = 2
-            leak_win.after(4000,
-                           setup_button_leak_test)  # wait a few seconds before letting them press to let barrel and hose inflate at least a little
-
-        def start_leak_test_2():  # tests the barrel and hose
-            nonlocal time_done, bh_before
-            test_name.set("Barrel + Hose Leak Test")
-            # hose will be open
-            Pi.main.state_barrel_hose_flow()
-            time.sleep(1)
-            # record initial barrel+hose pressure
-            bh_before = Pi.main.wait_for_steady_pressure(Pi.main.get_pressure_barrelhose, max_wait=15,
-                                                         max_deviation=0.15, smoothing=1.0).value
-            if not win_run:
-                return
-            audiohandler.play_wav("files/1.5-system-starting.wav")
-            time_done = time.time() + get_test_time()  # set the timer
-            leak_win.after(get_test_time() * 1000, end_leak_test_2)
-
-        def end_leak_test_2():
-            nonlocal bh_after, phase
-            bh_after = Pi.main.get_pressure_barrelhose().value
-            audiohandler.play_wav("files/ding.wav")
-            phase = 3
-            start_n2_test()  # kind of auto hit continue
-
-        def start_n2_test():
-            test_name.set("Enter Nitrogen Quality")
-            box_label.config(text="N2 Quality %:")
-            n2_quality_box.place(relx=0.5, rely=0.8, anchor=tk.CENTER)
-            test_time_box.place_forget()
-            main_button.config(text="Submit", state=tk.NORMAL)
-
-        def end_n2_test():
-            nonlocal phase
+
+        def submit_n2():
             n2_str = n2_quality_box.get()
             if n2_str != "":  # if empty, skip
                 Maint.vals["nitrogen_percent"] = n2_str
@@ -736,24 +895,11 @@ class MaintenanceScreen(tk.Frame):
                 guarantee_message_send(msg)
             n2_quality_box.place_forget()
             box_label.place_forget()
-            test_name.set("Finished All Tests")
-            Pi.main.state_barrel_hose_deflate()  # release air
-            phase = 4
-            main_button.config(text="Print", state=tk.NORMAL)
-
-        def setup_button_leak_test():
-            main_button.config(text="Continue", state=tk.NORMAL)
-
-        def start_regulator_test():
-            nonlocal phase, leak_test_start_time
-            test_name.set("Regulator Test")
-            leak_test_start_time = datetime.now()
-            Pi.main.state_barrel_inflate()
-            phase = 1
-            leak_win.after(1000, setup_button_leak_test)  # brief wait to avoid double-pressing
 
         def print_results():
             test_name.set("Printing...")
+            results = engine.results()
+            leak_test_start_time = results["start_time"]
 
             byte_buffer = BytesIO()  # used as a write-capable file in memory
             pdf = PDFGen(byte_buffer, 2.75, 0.25)
@@ -763,40 +909,25 @@ class MaintenanceScreen(tk.Frame):
             pdf.addline("System Leak Test")
             pdf.skip(2)
             pdf.options(12)
-            pdf.addtable("Max Pressure Ach.", "{:.2f} PSI".format(max_pressure))
+            pdf.addtable("Max Pressure Ach.", "{:.2f} PSI".format(results["max_pressure"]))
             pdf.skip(5)
 
-            letter_grades = ['A', 'B', 'C', 'D', 'F']
-            f_grade = 0.05  # percent change needed for worst grade
-
-            # keys are dpm, lrb, grade - Delta PSI/min, Leak Rate, Grade
-            B_RESULTS = {}
-            BH_RESULTS = {}
-
-            def print_leak_result(title, before, after, store):
+            def print_leak_result(title, result):
                 pdf.options(14, True)
                 pdf.addline(title)
                 pdf.options(12)
-                pdf.addtable("Start Pressure", "{:.2f} PSI".format(before))
-                pdf.addtable("End Pressure", "{:.2f} PSI".format(after))
-                dpm = (before - after) * 60 / get_test_time()
-                # store the calculated data in the cache so it is not recomputed
-                store['dpm'] = dpm
-                store['lrb'] = 0
-                store['grade'] = letter_grades[-1]  # worst
-                pdf.addtable("Leak Rate", "{:.2f} PSI/min".format(max(dpm, 0)))
-                if before != 0:
-                    lrb = dpm / before
-                    store['lrb'] = lrb
-                    pdf.addtable("Leak Rate %", "{:.2f}%/min".format(max(lrb * 100, 0)))
-                    gradenum = min(max(int((len(letter_grades) - 1) / f_grade * lrb), 0), len(letter_grades) - 1)
-                    pdf.addtableadv("Grade", "{} ({})".format(letter_grades[gradenum], gradenum + 1), True, True)
-                    store['grade'] = letter_grades[gradenum]
-
-            # pass cache into calculators to store computed data
-            print_leak_result("Barrel Leak Test", b_before, b_after, B_RESULTS)
+                pdf.addtable("Start Pressure", "{:.2f} PSI".format(result["before"]))
+                pdf.addtable("End Pressure", "{:.2f} PSI".format(result["after"]))
+                pdf.addtable("Leak Rate", "{:.2f} PSI/min".format(max(result["dpm"], 0)))
+                if result["gradenum"] is not None:
+                    pdf.addtable("Leak Rate %", "{:.2f}%/min".format(max(result["lrb"] * 100, 0)))
+                    pdf.addtableadv("Grade", "{} ({})".format(result["grade"], result["gradenum"] + 1), True, True)
+
+            B_RESULTS = results["barrel"]
+            BH_RESULTS = results["barrel_hose"]
+            print_leak_result("Barrel Leak Test", B_RESULTS)
             pdf.skip(5)
-            print_leak_result("Barrel + Hose Leak Test", bh_before, bh_after, BH_RESULTS)
+            print_leak_result("Barrel + Hose Leak Test", BH_RESULTS)
 
             # additional control message showing leak rates + grade (Represented in Green on Ctrl panel)
             msg = f"Results of Barrel Leak Test: {max(B_RESULTS['lrb'] * 100, 0):.2f} %/min leak rate (grade {B_RESULTS['grade']}). " \
@@ -814,27 +945,34 @@ class MaintenanceScreen(tk.Frame):
             test_name.set("")
             main_button.config(text="Print", state=tk.NORMAL)
 
+        def retry():  # start over with a new engine, the failed one can't continue
+            n2_quality_box.place_forget()
+            box_label.config(text="Time:")
+            box_label.place(relx=0.5, rely=0.7, anchor=tk.CENTER)
+            test_time_box.config(state=tk.NORMAL)
+            test_time_box.place(relx=0.5, rely=0.8, anchor=tk.CENTER)
+            test_name.set("")
+            new_engine()
+            main_button.config(text="Start", state=tk.NORMAL)
+
         def main_button_pressed():
-            nonlocal phase
+            if engine.error is not None:
+                retry()
+                return
             main_button.config(state=tk.DISABLED)
             test_time_box.config(state=tk.DISABLED)
-            if phase == 0:  # should say "start" then start the regulator test
-                start_regulator_test()
-            elif phase == 1:  # should say "continue" then continue to first leak test
-                start_leak_test_1()
-            elif phase == 2:  # should say "continue" then continue to next leak test
-                start_leak_test_2()
-            elif phase == 3:  # should say "Submit" then finish the n2 test
-                end_n2_test()
-            elif phase == 4:  # should say "print" then print
+            engine.test_time = get_test_time()
+            if engine.phase == 3:  # should say "Submit" then finish the n2 test
+                submit_n2()
+            if engine.phase == 4:  # should say "print" then print
                 print_results()
+            else:  # start, continue, continue, submit
+                engine.proceed()
 
         def close():
             nonlocal win_run
             win_run = False
-            Pi.main.stop()
-            Pi.main.state_no_flow()
-            Pi.safety.close()
+            try_closing("stopping the leak test", engine.stop)
             leak_win.destroy()
 
         main_button = tk.Button(leak_win, text="Start", font=regular_font, command=main_button_pressed)
@@ -843,9 +981,10 @@ class MaintenanceScreen(tk.Frame):
         # when they hit "End" or X out, run the close routine to shutdown valves and such
         tk.Button(leak_win, text="End", font=regular_font, command=close).place(relx=0.95, rely=0.9, anchor=tk.E)
         leak_win.protocol("WM_DELETE_WINDOW", close)
+        return leak_win
 
     def calib_pop(self):
-        CalibrationWindow(self.root)
+        calibration.CalibrationWindow(self.root)
 
     def hpcalib_pop(self):
         pop = tk.Toplevel(self.root)
@@ -897,18 +1036,20 @@ class MaintenanceScreen(tk.Frame):
         max_pressure_box = tk.Spinbox(pop, from_=10, to=150, increment=1, textvariable=max_pressure_var)
         max_pressure_box.grid(row=1, column=1)
 
+        plot = plotwidget.PlotWidget(pop, xlabel="Barrel PSI added", ylabel="Tire PSI", figsize=(5, 3.5))
+        plot.add_line("Pressure (PSI)", 'r-')
+        plot.legend()
+        plot.grid(row=3, column=0, columnspan=2)
+
         running = False
         barrel_data = []
         tire_data = []
-        thread = None  # type: Optional[threading.Thread]
+        thread = None  # type: Optional[taskpool.Task]
+        recording = None  # type: Optional[sensorlog.StreamRecorder]
+        stop_stream = None
 
         Pi.main.state_barrel_hose_flow()
 
-        def update_count():
-            nonlocal count
-            count += 1
-            count_var.set(str(count))
-
         def inf_thread(max_pressure: int):
             nonlocal count
             count = 0
@@ -916,16 +1057,20 @@ class MaintenanceScreen(tk.Frame):
             tire_data.clear()
             barrel_data.clear()
             barrel_data.append(0)
+            plot.set_data("Pressure (PSI)", [], [])
             Pi.main.state_no_flow()
             Pi.safety.open()
+            start_recording(max_pressure)
 
-            while running:
+            while running and not taskpool.cancelled():
                 # equalize
                 Pi.main.state_barrel_hose_flow()
                 tire_pressure = Pi.main.wait_for_steady_pressure(Pi.main.get_pressure_barrelhose, max_deviation=0.20)
                 tire_data.append(tire_pressure.value)
+                plot.append("Pressure (PSI)", sum(barrel_data), tire_pressure.value)
 
-                run_main_thread(update_count)
+                count += 1
+                self.ui.set(count_var, str(count))
 
                 if not running:
                     break
@@ -933,19 +1078,38 @@ class MaintenanceScreen(tk.Frame):
                     run_main_thread(end)  # auto end
                     break
 
-                # fill barrel with known amount of gas
-                Pi.main.state_barrel_inflate(4)
-                barrel_pressure = Pi.main.wait_for_steady_pressure(Pi.main.get_pressure_barrel, max_wait=5,
-                                                                   max_deviation=0.35)
-                barrel_data.append(
-                    barrel_pressure.value - tire_pressure.value)  # amount it is filled with is proportial to
+                # fill barrel with known amount of gas, timed on the Pi
+                fill = pimacro.run(Pi.main, pimacro.pulse("barrel_inflate", 4) +
+                                   [pimacro.steady("barrel", max_wait=5, max_deviation=0.35)])
+                logger.debug(f"barrel fill took {fill['durations'][0]:.3f}s")
+                barrel_data.append(fill["reads"][0] - tire_pressure.value)  # amount it is filled with is proportial to
 
             Pi.main.state_no_flow()
             Pi.safety.close()
+            stop_recording()
+
+        def start_recording(max_pressure):
+            nonlocal recording, stop_stream
+            path = sensorlog.new_path("tireresponse")
+            logger.info(f"Recording tire response session to {path}")
+            # recorded from the shared sensor stream, not another loop polling the Pi
+            recording = sensorlog.StreamRecorder(path, {sensorlog.BARREL: "get_pressure_barrel",
+                                                        sensorlog.BARRELHOSE: "get_pressure_barrelhose"},
+                                                 interval=sensor_stream.interval, max_pressure=max_pressure)
+            stop_stream = sensor_stream.subscribe(recording.on_sample, recording.channels.values())
+
+        def stop_recording():
+            nonlocal recording, stop_stream
+            if stop_stream:
+                stop_stream()
+                stop_stream = None
+            if recording:
+                recording.close()
+                recording = None
 
         def begin():
             nonlocal running, thread
-            if thread and thread.is_alive():
+            if thread and not thread.done():
                 return
             running = True
             logger.info("Starting controlled inflate thread")
@@ -954,16 +1118,16 @@ class MaintenanceScreen(tk.Frame):
             except ValueError:
                 return
             max_pressure_box.config(state=tk.DISABLED)
-            thread = threading.Thread(target=inf_thread, name="inf-thread", args=[max_pressure])
-            thread.start()
+            thread = start_hardware_loop("Controlled inflate", inf_thread, max_pressure)
 
         def end():
             nonlocal thread, running
             running = False
-            if thread and thread.is_alive():
+            if thread and not thread.done():
                 logger.info("Ending controlled inflate thread")
-                thread.join(15)
-                thread = None
+                thread.cancel()
+                thread.wait(15)
+            thread = None
             max_pressure_box.config(state=tk.NORMAL)
             show_graph()
 
@@ -982,21 +1146,22 @@ class MaintenanceScreen(tk.Frame):
             for x, y in zip(barrel_sum, tire_data):
                 print(f"{x:.2f},{y:.2f}")
 
-            fig, ax = plt.subplots()
-            ax.plot(barrel_sum, tire_data, 'r-', label="Pressure (PSI)")  # red line
-            ax.legend()
-            plt.show()
+            plot.set_data("Pressure (PSI)", barrel_sum, tire_data)
 
         def close():
             nonlocal running
             running = False
-            Pi.main.state_no_flow()
-            Pi.safety.close()
+            if thread:
+                thread.cancel()
+            stop_recording()
+            try_closing("closing the valves", Pi.main.state_no_flow)
+            try_closing("closing the safety valve", Pi.safety.close)
             pop.destroy()
 
         tk.Button(pop, text="Begin", command=begin, padx=5, pady=5).grid(row=2, column=0)
         tk.Button(pop, text="End", command=end, padx=5, pady=5).grid(row=2, column=1)
         pop.protocol("WM_DELETE_WINDOW", close)
+        return pop
 
     def graphing_pop(self):
         pop = tk.Toplevel(self.root)
@@ -1013,9 +1178,17 @@ class MaintenanceScreen(tk.Frame):
         tk.Label(pop, text="Pres: N/A", textvariable=pres_disp, padx=5, pady=5).pack()
         tk.Label(pop, text="Temp: N/A", textvariable=temp_disp, padx=5, pady=5).pack()
 
-        running = False
-        thread_inst = None  # type: Optional[threading.Thread]
-        interval = 5
+        plot = plotwidget.PlotWidget(pop, xlabel="Time (s)")
+        plot.add_line("Pressure (PSI)", 'r-')  # red line
+        plot.add_line("Temp (F)", 'b-')  # blue line
+        plot.add_line("Moles x 10^-1", 'g-')  # green line
+        plot.legend()
+
+        interval = 5  # samples per second kept, the shared sensor stream polls faster
+        unsubscribe = None
+        recorder = None  # type: Optional[sensorlog.SensorRecorder]
+        record_lock = threading.Lock()  # samples arrive on the stream's thread, end() closes the recording on this one
+        channels = ("get_pressure_barrelhose", "get_temp_barrelhose")
 
         time_data = []
         pres_data = []
@@ -1027,60 +1200,70 @@ class MaintenanceScreen(tk.Frame):
             pres_disp.set(f"Pres: {pres_pt:6.2f}")
             temp_disp.set(f"Temp: {temp_pt:6.2f}")
 
-        def graph_thread():
-            while running:
-                # not exactly time-accurate running at 1/interval rate, but it really doesn't matter
-                t1 = time.time() - start_time
-                pres_data.append(Pi.main.get_pressure_barrelhose(smoothing=1 / interval).value)
-                temp_data.append(Pi.main.get_temp_barrelhose(smoothing=1 / interval).value)
-                t2 = time.time() - start_time
-                time_data.append((t1 + t2) / 2)
-
-                fts_util.run_main_thread(show_data, time_data[-1], pres_data[-1], temp_data[-1])
-
-                time.sleep(1 / interval)
+        def on_sample(sample: hwsession.Sample):
+            with record_lock:
+                if recorder is None:  # ended
+                    return
+                t = sample.time - start_time
+                if time_data and t - time_data[-1] < 0.9 / interval:
+                    return
+                pres = sample.readings[channels[0]]
+                temp = sample.readings[channels[1]]
+                time_data.append(t)
+                pres_data.append(pres)
+                temp_data.append(temp)
+                recorder.record(pres, temp, t=sample.time)
+            # locals, begin() can clear the lists on the Tk thread as soon as the lock is released
+            plot.append("Pressure (PSI)", t, pres)
+            plot.append("Temp (F)", t, temp)
+            plot.append("Moles x 10^-1", t, moles(pres, temp))
+
+            self.ui.post(str(time_disp), show_data, t, pres, temp)
 
         def begin():
-            nonlocal running, thread_inst, start_time
-            if thread_inst and thread_inst.is_alive():
+            nonlocal unsubscribe, recorder, start_time
+            if unsubscribe:
                 return
             start_time = time.time()
-            running = True
-            thread_inst = threading.Thread(target=graph_thread, name="Graph-thread")
-            logger.info("Starting graph thread")
-            thread_inst.start()
+            for data in (time_data, pres_data, temp_data):
+                data.clear()
+            for name in plot.series:
+                plot.set_data(name, [], [])
+            path = sensorlog.new_path("graph")
+            logger.info(f"Recording graphing session to {path}")
+            recorder = sensorlog.SensorRecorder(path, (sensorlog.BARRELHOSE, sensorlog.TEMP_BARRELHOSE),
+                                                start=start_time, interval=1 / interval)
+            unsubscribe = sensor_stream.subscribe(on_sample, channels, smoothing=1 / interval)  # a graph point's worth
+
+        def stop_session():
+            nonlocal unsubscribe, recorder
+            if unsubscribe:
+                logger.info("Ending graph session")
+                unsubscribe()
+                unsubscribe = None
+            with record_lock:
+                if recorder:
+                    recorder.close()
+                    recorder = None
 
         def end():
-            nonlocal running, thread_inst
-            if thread_inst and thread_inst.is_alive():
-                logger.info("Ending graph thread")
-                running = False
-                thread_inst.join()
-                thread_inst = None
-            show_graph()
-
-        def show_graph():
+            stop_session()
             if not time_data:
                 logger.warning("No data to show")
-                return
+            plot.follow()  # show the whole session
 
-            mols_data = []
-            for i in range(len(time_data)):
-                pascals = pres_data[i] * 6894.76
-                liters = 1  # arbitrary, but fixed
-                kelvin = (temp_data[i] - 32) * 5 / 9 + 273.15
-                moles = (pascals * liters) / (8.31446 * kelvin)  # gas constant included
-                mols_data.append(moles * 0.1)  # scale
-
-            fig, ax = plt.subplots()
-            ax.plot(time_data, pres_data, 'r-', label="Pressure (PSI)")  # red line
-            ax.plot(time_data, temp_data, 'b-', label="Temp (F)")  # blue line
-            ax.plot(time_data, mols_data, 'g-', label="Moles x 10^-1")  # green line
-            ax.legend()
-            plt.show()
+        def moles(pres, temp):
+            pascals = pres * 6894.76
+            liters = 1  # arbitrary, but fixed
+            kelvin = (temp - 32) * 5 / 9 + 273.15
+            return (pascals * liters) / (8.31446 * kelvin) * 0.1  # gas constant included, scaled
 
         tk.Button(pop, text="Begin", command=begin, padx=5, pady=5).pack()
         tk.Button(pop, text="End", command=end, padx=5, pady=5).pack()
+        plot.pack(fill=tk.BOTH, expand=True)
+        # however the window goes away, stop listening to the readings for it
+        pop.bind("<Destroy>", lambda e: stop_session() if e.widget is pop else None, add="+")
+        return pop
 
     def tire_bp_cmd(self):
         tire_bp_cmd_window = tk.Toplevel(self.root)
@@ -1166,27 +1349,30 @@ class MaintenanceScreen(tk.Frame):
 
         runs_label = tk.Label(fill_valve_timing_window, font=("Helvetica", 20), textvariable=Countvar)
         runs_label.place(relx=0.5, rely=0.7)
-        valve_thread = None  # type: Optional[threading.Thread]
+        valve_thread = None  # type: Optional[taskpool.Task]
 
         def valve_cycle():
             nonlocal valve_cycle_count
             valve_cycle_count = 0
-            while valve_run:
-                # takes 1.0 seconds to cycle through opening and closing all 5 valves
-                for v in range(1, 6):
-                    Pi.main.open(v)
-                    time.sleep(0.1)
-                    Pi.main.close(v)
-                    time.sleep(0.1)
+            token = taskpool.current_token()
+            # takes 1.0 seconds to cycle through opening and closing all 5 valves, sent as one macro per cycle
+            cycle = []
+            for v in range(1, 6):
+                cycle += [pimacro.valve(v, True), pimacro.hold(0.1), pimacro.valve(v, False), pimacro.hold(0.1)]
+            while valve_run and not token.cancelled:
+                result = pimacro.run(Pi.main, cycle, stop=token)
+                if result["stopped"]:
+                    break
+                open_times = result["durations"][::2]
+                logger.debug("valve open times: " + ", ".join(f"{t * 1000:.1f}ms" for t in open_times))
                 valve_cycle_count += 1
-                run_main_thread(Countvar.set, str(valve_cycle_count))
+                self.ui.set(Countvar, str(valve_cycle_count))
 
         def set_on():
             nonlocal valve_run, valve_thread
-            if valve_thread is None or not valve_thread.is_alive():  # only start the thread if it is dead
+            if valve_thread is None or valve_thread.done():  # only start the thread if it is dead
                 valve_run = True
-                valve_thread = threading.Thread(target=valve_cycle, daemon=True, name="valvecycle")
-                valve_thread.start()
+                valve_thread = start_hardware_loop("Valve cycle", valve_cycle)
 
         def set_off():
             nonlocal valve_run
@@ -1208,6 +1394,7 @@ class MaintenanceScreen(tk.Frame):
         V_kill.place(relx=0.5, rely=0.8)
 
         fill_valve_timing_window.protocol("WM_DELETE_WINDOW", kill_window)
+        return fill_valve_timing_window
 
     def valve_control(self):
         V_cont_window = tk.Toplevel(self.root)
@@ -1232,24 +1419,20 @@ class MaintenanceScreen(tk.Frame):
         def stop_test():
             nonlocal test_running
             test_running = False
-            Pi.main.state_no_flow()
+            try_closing("closing the valves", Pi.main.state_no_flow)
             V_cont_window.destroy()
 
-        def read_ADCs():
-            while test_running:
-                # read pressures
-                pressures = Pi.main.get_raw_pressures(smoothing=0)
-                for ix in range(len(pressures)):
-                    run_main_thread(ADC_pressures[ix].set, f"{pressures[ix].value:6.2f}")
-
-                # read temps
-                temps = Pi.main.get_temps(smoothing=0)
-                for ix in range(min(len(temps), 8)):
-                    run_main_thread(ADC_temps[ix].set, f"{temps[ix].value:6.1f}")
-
-                time.sleep(0.1)
+        def read_ADCs(sample: hwsession.Sample):
+            if not test_running:
+                return
+            for ix, pressure in enumerate(sample.pressures[:6]):
+                self.ui.set(ADC_pressures[ix], f"{pressure:6.2f}")
+            for ix, temp in enumerate(sample.temps[:8]):
+                self.ui.set(ADC_temps[ix], f"{temp:6.1f}")
 
-        threading.Thread(target=read_ADCs, daemon=True, name="readADCs").start()
+        unsubscribe_ADCs = sensor_stream.subscribe(read_ADCs)
+        # however the window goes away, stop listening to the readings for it
+        V_cont_window.bind("<Destroy>", lambda e: unsubscribe_ADCs() if e.widget is V_cont_window else None, add="+")
 
         def pi_shutdown():  # Sends shutdown command to both raspberry pi's
             if pyro_run:
@@ -1302,12 +1485,8 @@ class MaintenanceScreen(tk.Frame):
         # then close it immediately before it even gets opened
         def safe_thread_run(label, targetfunc, open_valve):
             nonlocal valve_threads
-            if label not in valve_threads or not valve_threads[
-                label].is_alive():  # if the thread has never been started or it isnt alive
-                vthread = threading.Thread(target=targetfunc, daemon=True, args=(open_valve,),
-                                           name="controlvalve")  # start the thread
-                vthread.start()
-                valve_threads[label] = vthread  # and set its value in the function scope
+            if label not in valve_threads or valve_threads[label].done():  # if it has never run or has finished
+                valve_threads[label] = taskpool.submit("controlvalve", targetfunc, open_valve, pool=taskpool.VALVES)
 
         def control_valve(v, open_):
             if not Pi.main:
@@ -1403,6 +1582,7 @@ class MaintenanceScreen(tk.Frame):
         start_control.pack(side='left', expand=1)
 
         V_cont_window.protocol("WM_DELETE_WINDOW", stop_test)
+        return V_cont_window
 
     def flowrate_test(self):
         pop = tk.Toplevel()
@@ -1429,7 +1609,7 @@ class MaintenanceScreen(tk.Frame):
         tk.Label(pop, font=font, text="1 second of valve opening results in score % barrel pressure change")
 
         running = False
-        my_thread: Optional[threading.Thread] = None
+        my_thread: Optional[taskpool.Task] = None
         data = []
         Pi.safety.open()
         updt = downdt = 0
@@ -1443,11 +1623,13 @@ class MaintenanceScreen(tk.Frame):
             updt = 1.0 * res / defaultresdec
             downdt = 0.5 * res / defaultresdec
             last_pressure = None
-            while running and main_window.run:
+            last_dt = None  # measured length of the last pulse
+            token = taskpool.current_token()
+            while running and main_window.run and not token.cancelled:
                 pressure = Pi.main.wait_for_steady_pressure(Pi.main.get_pressure_barrelhose,
                                                             max_wait=Maint.get_max_wait_time(), max_deviation=0.2).value
 
-                if not (running and main_window.run):
+                if not (running and main_window.run) or token.cancelled:
                     break
 
                 if last_pressure is not None:
@@ -1477,7 +1659,7 @@ class MaintenanceScreen(tk.Frame):
 
                     # log the data if the dt is locked
                     if goingup and upreslocked or not goingup and downreslocked:
-                        data.append((last_pressure, pressure))
+                        data.append((last_pressure, pressure, last_dt))
                 last_pressure = pressure
 
                 if pressure > 130:
@@ -1485,32 +1667,37 @@ class MaintenanceScreen(tk.Frame):
                 elif pressure < 10:
                     goingup = True
 
+                # pulses are timed on the Pi, and scored by how long they lasted when the Pi can measure it (run_macro)
                 if goingup:
-                    Pi.main.state_barrel_hose_inflate(updt)
+                    pulse = pimacro.run(Pi.main, pimacro.pulse("barrel_hose_inflate", updt), stop=token)
                 else:
-                    Pi.main.state_barrel_hose_deflate(downdt)
+                    pulse = pimacro.run(Pi.main, pimacro.pulse("barrel_hose_deflate", downdt), stop=token)
+                last_dt = pulse["durations"][0]
+                if pulse["stopped"]:
+                    break
             Pi.main.state_no_flow()
 
         def start():
             nonlocal running, my_thread
             running = True
-            my_thread = threading.Thread(target=loop, name="flowrate test loop")
-            my_thread.start()
+            my_thread = start_hardware_loop("Flow rate test", loop)
             res_in.entry.config(state=tk.DISABLED)
 
         def stop():
             nonlocal running
             running = False
-            Pi.main.stop()
+            try_closing("stopping the flow rate test", Pi.main.stop)
             if not my_thread:
                 return
-            my_thread.join()
+            my_thread.cancel()
+            my_thread.wait()
             if not data:
                 return
             npdata = np.array(data)
             logger.debug(f"Inflate and delate data: {data}")
             befores = npdata[:, 0]
             afters = npdata[:, 1]
+            dts = npdata[:, 2]
             diffs = afters - befores
             avgs = (befores + afters) / 2
             upi = diffs > 0
@@ -1520,24 +1707,30 @@ class MaintenanceScreen(tk.Frame):
             logger.info(f"Found up equation to be \n{upeq}")
             actual_reg = np.roots(upeq)[0]
             logger.info(f"Found effective regulator pressure to be {actual_reg:.1f}")
+            plot = plotwidget.plot_window(pop, "Flow Rate Benchmark", xlabel="Before (PSI)", ylabel="After (PSI)")
             ups = diffs[upi] / (actual_reg - avgs[upi])
             downs = diffs[downi] / avgs[downi]
             if len(ups) > 0:
                 upmean = np.mean(ups)
-                avgup = upmean / updt
-                sigup = np.std(ups) / updt
-                logger.info(f"Avg up was {upmean:.1%} / {updt:.2}s")
+                avgup = np.mean(ups / dts[upi])
+                sigup = np.std(ups / dts[upi])
+                logger.info(f"Avg up was {upmean:.1%} / {np.mean(dts[upi]):.3}s (asked for {updt:.3}s, "
+                            f"spread {np.std(dts[upi]) * 1000:.1f}ms)")
                 upresults.set(f"Inflate score: {avgup:.1%} [{sigup:.1%}]")
-                plt.scatter(befores[upi], afters[upi], c='red')
+                plot.add_scatter("Inflate", color='red')
+                plot.set_data("Inflate", befores[upi], afters[upi])
             if len(downs) > 0:
                 downmean = np.mean(downs)
-                avgdown = downmean / downdt
-                sigdown = np.std(downs) / downdt
-                logger.info(f"Avg down was {downmean:.1%} / {downdt:.2}s")
+                avgdown = np.mean(downs / dts[downi])
+                sigdown = np.std(downs / dts[downi])
+                logger.info(f"Avg down was {downmean:.1%} / {np.mean(dts[downi]):.3}s (asked for {downdt:.3}s, "
+                            f"spread {np.std(dts[downi]) * 1000:.1f}ms)")
                 downresults.set(f"Deflate score: {-avgdown:.1%} [{sigdown:.1%}]")
-                plt.scatter(befores[downi], afters[downi], c='blue')
-            plt.plot([0, actual_reg], [0, actual_reg], c='black')
-            plt.show(block=False)
+                plot.add_scatter("Deflate", color='blue')
+                plot.set_data("Deflate", befores[downi], afters[downi])
+            plot.add_line("No change", color='black')
+            plot.set_data("No change", [0, actual_reg], [0, actual_reg])
+            plot.legend()
 
         startstop = fts_widgets.StateButton(pop, [("Start", start), ("Stop", stop)], font=font)
         startstop.pack()
@@ -1545,10 +1738,11 @@ class MaintenanceScreen(tk.Frame):
         def close():
             if running:
                 stop()
-            Pi.safety.close()
+            try_closing("closing the safety valve", Pi.safety.close)
             pop.destroy()
 
         pop.protocol("WM_DELETE_WINDOW", close)
+        return pop
 
     def change_coupon(self):
         coup_pop = tk.Toplevel()
@@ -1557,18 +1751,15 @@ class MaintenanceScreen(tk.Frame):
         coup_pop.geometry('300x220+1220+280')  # 300x220 screen at pos (1220, 280)
         coupsamp = tk.Label(coup_pop, anchor=tk.S)
 
-        Maint.valid_coupon_codes = {}
+        Maint.valid_coupon_codes = CouponCache.codes()  # local copies, the share is synced in the background
+        CouponCache.sync_async()
         current_code = tk.StringVar()
         current_code.set("None")
-        rmg_parent = "\\\\APOLLO\\N24TyresMinionData\\{0}Miosk{1}\\{0}Miosk{1}RecptAds".format(Maint.computername,
-                                                                                               Maint.mioskid)
-        for rmgfile in os.listdir(rmg_parent):
-            if rmgfile.endswith(".png") or rmgfile.endswith(".jpg"):
-                Maint.valid_coupon_codes[os.path.splitext(rmgfile)[0]] = os.path.join(rmg_parent, rmgfile)
+        rmg_parent = CouponCache.share_dir()
 
         def setphoto(x):
-            pilp = Image.open(x)
-            pilp.thumbnail((300, 180))  # scale to 0.4
+            pilp = Image.open(CouponCache.thumbnail(x))
+            pilp.thumbnail((300, 180))  # scale to 0.4. already done for cached thumbnails
             p = ImageTk.PhotoImage(image=pilp)  # must use PIL to open jpg
             coupsamp.config(image=p)
             coupsamp.image = p
@@ -1591,6 +1782,7 @@ class MaintenanceScreen(tk.Frame):
 
         def go():
             testcode = current_code.get()
+            Maint.valid_coupon_codes = CouponCache.codes()  # pick up anything the background sync found
             if testcode in Maint.valid_coupon_codes.keys():
                 Maint.coupon_img = Maint.valid_coupon_codes[testcode]
                 setphoto(Maint.coupon_img)
@@ -1721,6 +1913,20 @@ class MaintenanceScreen(tk.Frame):
             logger.info("Getting PI graph for {:010}, {}".format(ctrlnum, tire))
             pigraph.generate_pi_graph(filepath, tsetpressure)
 
+        def get_stored_graph(store, ctrlnum, tire):
+            logger.info("Getting stored graph for {:010}, {}".format(ctrlnum, tire))
+            graph = store.load(ctrlnum, tire)
+            if graph is None:
+                logger.warning(f"{ctrlnum} {tire} is no longer in {store.root}")
+                return
+            plot = plotwidget.plot_window(graph_pop, f"{ctrlnum:010} {tire}", xlabel=graph.columns[0])
+            for name, y in zip(graph.columns[1:], graph.data[1:]):
+                plot.add_line(name)
+                plot.set_data(name, graph.data[0], y)
+            if graph.setpressure is not None:
+                plot.ax.axhline(graph.setpressure, color="k", linestyle="--", label="Set Pressure")
+            plot.legend()
+
         def chk_graphs():
             try:
                 to_check = int(ctrlnumenter.get())
@@ -1730,13 +1936,19 @@ class MaintenanceScreen(tk.Frame):
                 return
             searchfor = "{:010}".format(to_check)
             filefound = None
-            # check all minions available
-            for checkdir in os.listdir(
-                    r"\\APOLLO\N24TyresData\N24TyresMinionData"):  # contains each minion folder in format ?minionMiosk###
+            # graphs made here are in this miosk's store, which answers in one read. only open that one, every store
+            # opened stays cached with its index
+            own = "{}Miosk{}".format(Maint.computername, Maint.mioskid)
+            store = graphstore.GraphStore.open(os.path.join(r"\\APOLLO\N24TyresData\N24TyresMinionData", own,
+                                                            own + "RAWData", graphstore.STORE_DIR))
+            stored_tires = store.lookup(to_check)
+            # otherwise check the CSV folders of all minions available
+            checkdirs = [] if stored_tires else os.listdir(
+                r"\\APOLLO\N24TyresData\N24TyresMinionData")  # contains each minion folder in format ?minionMiosk###
+            for checkdir in checkdirs:
                 if re.match(".*Miosk[0-9]{3}", checkdir):  # we can go inside and check
-                    pathpath_search = os.path.join(r"\\APOLLO\N24TyresData\N24TyresMinionData", checkdir,
-                                                   checkdir + "RAWData",
-                                                   "graphdata")  # "graphdata" must match what is in pigraph.py
+                    rawdata = os.path.join(r"\\APOLLO\N24TyresData\N24TyresMinionData", checkdir, checkdir + "RAWData")
+                    pathpath_search = os.path.join(rawdata, "graphdata")  # "graphdata" must match what is in pigraph.py
                     if os.path.exists(pathpath_search):  # some paths aren't complete yet
                         processtext.config(text="Searching " + checkdir)
                         graph_pop.update()
@@ -1752,7 +1964,13 @@ class MaintenanceScreen(tk.Frame):
             for b in tire_buttons:
                 b.pack_forget()
             tire_buttons.clear()  # tire buttons is list of buttons that map to displaying that graph
-            if filefound:
+            if stored_tires:
+                processtext.config(text="Found")
+                for tirename in stored_tires:
+                    tire_names.append(tirename)
+                    tire_buttons.append(tk.Button(graph_pop, text=tirename, font=('Helvetica', 15),
+                                                  command=partial(get_stored_graph, store, to_check, tirename)))
+            elif filefound:
                 processtext.config(text="Found")
                 graph_pop.update()
                 for tirefile in os.listdir(filefound):
@@ -1911,7 +2129,7 @@ class MaintenanceScreen(tk.Frame):
         t = tk.Toplevel()
         t.update_idletasks()  # Don't know why I should have to call this, but it's critical for the next line to work		t.overrideredirect(1)
         w = 250
-        h = 100
+        h = 130
         x = (self.SX / 2) - (w / 2)
         y = (self.SY / 2) - (h / 2)
         t.geometry('%dx%d+%d+%d' % (w, h, x, y))
@@ -1926,11 +2144,62 @@ class MaintenanceScreen(tk.Frame):
         # err2.pack()
         err3.pack()
         b.pack(side=tk.BOTTOM)
+        tk.Button(t, text='Running Tasks', command=self.running_tasks_popup).pack(side=tk.BOTTOM)
 
         # tests
         e88 = tk.Entry(t)
         e88.pack()
 
+    def running_tasks_popup(self):
+        pop = tk.Toplevel(self.root)
+        pop.attributes('-topmost', True)
+        pop.title("Running Tasks")
+        pop.geometry('800x480')
+
+        columns = ("name", "pool", "status", "queued", "ran", "thread")
+        tree = ttk.Treeview(pop, columns=columns, show="headings", height=12)
+        for col, width in zip(columns, (180, 70, 70, 70, 70, 100)):
+            tree.heading(col, text=col.title())
+            tree.column(col, width=width, anchor=tk.W)
+        tree.pack(fill=tk.BOTH, expand=True)
+        stats_var = tk.StringVar()
+        tk.Label(pop, textvariable=stats_var, font=("Consolas", 10), justify=tk.LEFT).pack(anchor=tk.W)
+        hw_var = tk.StringVar()
+        tk.Label(pop, textvariable=hw_var, font=("Consolas", 10), justify=tk.LEFT).pack(anchor=tk.W)
+        rpc_var = tk.StringVar()
+        tk.Label(pop, textvariable=rpc_var, font=("Consolas", 9), justify=tk.LEFT).pack(anchor=tk.W)
+        shown = {}  # tree item -> task
+
+        def refresh():
+            if not pop.winfo_exists():
+                return
+            selected = {shown[i] for i in tree.selection() if i in shown}
+            tree.delete(*tree.get_children())
+            shown.clear()
+            for task in reversed(taskpool.tasks()):  # newest first
+                item = tree.insert("", tk.END, values=(task.name, task.pool, task.status, f"{task.queued_time:.1f}s",
+                                                       f"{task.run_time:.1f}s", task.thread or ""))
+                shown[item] = task
+                if task in selected:
+                    tree.selection_add(item)
+            slowest = sorted(taskpool.stats().items(), key=lambda kv: kv[1]["total"], reverse=True)[:3]
+            stats_var.set("\n".join(f"{name}: {s['runs']} runs, {s['failures']} failed, {s['total']:.1f}s total, "
+                                    f"{s['max']:.1f}s max" for name, s in slowest))
+            hw_var.set("Hardware: " + (", ".join(h.describe() for h in hwsession.arbiter.holders()) or "free")
+                       + "".join(f"\n  waiting: {w.describe()}" for w in hwsession.arbiter.waiting())
+                       + "\n" + self.ui.summary())
+            rpc_var.set("\n".join(pirpc.summary().splitlines()[:6]))  # header and the 5 costliest Pi calls
+            pop.after(500, refresh)
+
+        def cancel_selected():
+            for item in tree.selection():
+                if item in shown:
+                    shown[item].cancel()
+
+        tk.Button(pop, text="Cancel Selected", command=cancel_selected).pack(side=tk.LEFT, padx=5, pady=5)
+        tk.Button(pop, text="Close", command=pop.destroy).pack(side=tk.RIGHT, padx=5, pady=5)
+        refresh()
+
     def bulk_charge_popup(self, root=None):
         pop = tk.Toplevel(root or self)
         pop.attributes('-topmost', 'true')
@@ -1975,13 +2244,23 @@ class MaintenanceScreen(tk.Frame):
                         Database.insert_into("__bulk__", {"uid": charge["uid"], "transactionID": trans.transaction_id,
                                                           "pan": trans.pan})
                     Maint.allow_revenue_upload = True  # explicitly allow for bulk charges
-                    Database.sync_all()  # now that the transactions have been fixed, sync the database to upload the bulk revenue data
-                    receipt_bytes_pdf = genanyreceipt.create_bulk_receipt(charges)
-                    threading.Thread(target=backup_files.save_bulk_receipt, name="save_bulk_receipt",
-                                     args=(receipt_bytes_pdf.getvalue(), email, trans.price_paid)).start()
-                    generated = convertpdf(receipt_bytes_pdf)
+                    # now that the transactions have been fixed, sync the database to upload the bulk revenue data.
+                    # in the background, the receipt doesn't need to wait for the upload
+                    sync_database()
+                    if len(charges) > genanyreceipt.BULK_STREAM_MIN_CHARGES:
+                        # large bulks are laid out and rasterized a chunk at a time and joined into one strip, the
+                        # whole receipt is never one PDF. the saved copy is made from the same strip
+                        generated = stack_images([convertpdf(chunk).convert("L")
+                                                  for chunk in genanyreceipt.iter_bulk_receipt(charges)])
+                        receipt_bytes_pdf = BytesIO()
+                        generated.save(receipt_bytes_pdf, "PDF", resolution=generated.width / 2.75)  # 2.75" paper
+                    else:
+                        receipt_bytes_pdf = genanyreceipt.create_bulk_receipt(charges)
+                        generated = convertpdf(receipt_bytes_pdf)
+                    taskpool.submit("save_bulk_receipt", backup_files.save_bulk_receipt,
+                                    receipt_bytes_pdf.getvalue(), email, trans.price_paid)
                     email_reciept.send_email([email], generated)
-                    printimage(generated)
+                    printimage(generated)  # one job, so the printer doesn't cut between chunks
                     while messagebox.askyesno("Print receipt",
                                               "Print another?"):  # FIXME: this is like hitting a nail with a wrench
                         try:
@@ -2049,34 +2328,49 @@ class MaintenanceScreen(tk.Frame):
     def restore_inflation_popup(self):
         pop = tk.Toplevel()
         pop.title("Restore Inflations Menu")
-        pop.geometry('300x100+800+480')
+        pop.geometry('300x260+800+400')
         pop.transient(self.root)
 
         tk.Label(pop, text="You may be able to restore a prior inflation after a crash").pack()
 
-        latest_bak_datestr = None
-        pc_backups = os.listdir("pcbackups")
-        for backup in pc_backups:
-            # only check log.pc files
-            if not backup.endswith("-log.pc"):
-                continue
-
-            # see if the date is the latest so far
-            datestr = backup[:-7]
-            if latest_bak_datestr is None or datestr > latest_bak_datestr:  # can be done using string comparison since date strings are the same length
-                latest_bak_datestr = datestr
-
-        # construct what the two files should look like
-        latest_log_backup = f"pcbackups/{latest_bak_datestr}-log.pc"
-        latest_pc_backup = f"pcbackups/{latest_bak_datestr}-latest.pc"
-
-        def restore_last_inflation():
-            shutil.copyfile(latest_log_backup, "log.pc")
-            shutil.copyfile(latest_pc_backup, "latest.pc")
+        backups = []  # newest first
+        backup_list = tk.Listbox(pop, height=10, exportselection=False)
+        backup_list.pack(fill=tk.BOTH, expand=1, padx=5)
+        status = tk.Label(pop)
+        status.pack()
+
+        def show_backups(refreshing=False):
+            if not pop.winfo_exists():
+                return
+            backups[:] = backup_catalog.latest(RESTORE_LIST_SIZE)
+            backup_list.delete(0, tk.END)
+            for datestr in backups:
+                backup_list.insert(tk.END, datestr)
+            backup_list.selection_set(0)  # default to the last inflation
+            if refreshing:
+                status.config(text="Checking for newer backups...")
+            else:
+                status.config(text="" if backups else "Sorry, not available")
+
+        # backups written since the catalog was last updated are found in the background, the list updates when done
+        refresh = backup_catalog.refresh_if_changed()
+        show_backups(refresh is not None)
+        if refresh is not None:
+            refresh.future.add_done_callback(lambda f: run_main_thread(show_backups))
+
+        def restore_inflation():
+            selected = backup_list.curselection()
+            if not selected:
+                return
+            datestr = backups[selected[0]]
+            try:
+                shutil.copyfile(backup_catalog.log_path(datestr), "log.pc")
+                shutil.copyfile(backup_catalog.latest_path(datestr), "latest.pc")
+            except OSError as e:
+                logger.error(f"could not restore backup {datestr}", exc_info=e)
+                messagebox.showerror("Restore", "That backup could not be restored.")
+                return
             messagebox.showinfo("Restart", "Program will now exit. Start the program again to restore the inflation.")
             main_window.close_window()
 
-        if os.path.exists(latest_log_backup) and os.path.exists(latest_pc_backup):
-            tk.Button(pop, text="Restore last inflation", command=restore_last_inflation).pack()
-        else:
-            tk.Label(pop, text="Sorry, not available").pack()
+        tk.Button(pop, text="Restore selected inflation", command=restore_inflation).pack(pady=5)
@@ -0,0 +1,178 @@
+"""
+Valve pulses and state sequences run as one unit, next to the valves.
+
+A macro is a list of steps, plain dicts so they pass through Pyro unchanged:
+
+	steps = pimacro.pulse("barrel_inflate", 4) + [pimacro.steady("barrel", max_wait=5, max_deviation=0.35)]
+	result = pimacro.run(Pi.main, steps)
+	result["durations"][0]  # how long the barrel was actually inflating
+	result["reads"][0]  # steady barrel pressure afterwards
+
+run() sends the whole macro to the Pi's run_macro when it has one, so the timing doesn't cross the network at all.
+Until the Pi has one, each pulse is sent as the Pi's own timed state, state_barrel_inflate(4), one call timed on the
+Pi the same as before macros. Only steps the Pi has no timed call for, like opening and closing single valves, are
+timed from here. The Pi side only needs to expose execute():
+
+	def run_macro(self, steps):
+		return pimacro.execute(self, steps, stop=self.stop_event)
+"""
+import time
+from typing import List
+
+SPIN = 0.002  # seconds before the end of a hold to stop sleeping and spin on the clock
+
+
+def state(name: str) -> dict:
+	"""
+	:param name: state method without the prefix, like "barrel_inflate" for state_barrel_inflate
+	"""
+	return {"op": "state", "name": name}
+
+
+def valve(v: int, open_: bool) -> dict:
+	return {"op": "open" if open_ else "close", "valve": v}
+
+
+def hold(seconds: float) -> dict:
+	"""
+	Keep the current state. The result's durations has the measured time between the steps either side of it
+	"""
+	return {"op": "hold", "seconds": seconds}
+
+
+def read(channel: str, smoothing=0.0) -> dict:
+	"""
+	:param channel: reading method without the prefix, like "barrel" for get_pressure_barrel
+	"""
+	return {"op": "read", "channel": channel, "smoothing": smoothing}
+
+
+def steady(channel: str, max_wait=30.0, max_deviation=0.2, smoothing=0.0) -> dict:
+	return {"op": "steady", "channel": channel, "max_wait": max_wait, "max_deviation": max_deviation,
+			"smoothing": smoothing}
+
+
+def pulse(state_name: str, seconds: float) -> List[dict]:
+	"""
+	Enter a state for exactly seconds, then close everything
+	"""
+	return [state(state_name), hold(seconds), state("no_flow")]
+
+
+def timed(state_name: str, seconds: float) -> dict:
+	"""
+	A pulse as a single call to the Pi's timed state, state_<name>(seconds), which returns to no flow on its own.
+	Its duration is the seconds asked for, the Pi does the timing
+	"""
+	return {"op": "timed", "name": state_name, "seconds": seconds}
+
+
+def collapse(steps: List[dict]) -> List[dict]:
+	"""
+	:return: steps with every pulse() replaced by the equivalent timed() call
+	"""
+	out = []
+	i = 0
+	while i < len(steps):
+		window = steps[i:i + 3]
+		if (len(window) == 3 and window[0]["op"] == "state" and window[1]["op"] == "hold"
+				and window[2] == state("no_flow") and window[0]["name"] != "no_flow"):
+			out.append(timed(window[0]["name"], window[1]["seconds"]))
+			i += 3
+		else:
+			out.append(steps[i])
+			i += 1
+	return out
+
+
+def total_time(steps: List[dict]) -> float:
+	"""
+	:return: longest the macro can take, not counting the time each command takes
+	"""
+	return sum(s.get("seconds", 0) + s.get("max_wait", 0) for s in steps)
+
+
+def execute(main, steps: List[dict], stop=None, speed=1.0) -> dict:
+	"""
+	Run a macro against main, which is Pi.main or the object behind it on the Pi.
+
+	:param stop: anything with wait(timeout) -> bool, like a threading.Event. a hold it interrupts ends the macro,
+				 after closing any valve the macro opened and setting the state to no flow
+	:param speed: how many times faster than real time main runs, for simulations. holds and durations are in main's time
+	:return: dict of marks (seconds from the start when each step finished), durations (measured length of each hold,
+			 or the asked for length of each timed step), reads (value of each read and steady step) and stopped
+	"""
+	start = time.perf_counter()
+	marks = []
+	reads = []
+	opened = set()
+	stopped = False
+	for step in steps:
+		op = step["op"]
+		if op == "state":
+			getattr(main, "state_" + step["name"])()
+		elif op == "timed":
+			getattr(main, "state_" + step["name"])(step["seconds"])
+			if stop is not None and stop.wait(0):  # cut short by main.stop()
+				stopped = True
+				marks.append(time.perf_counter() - start)
+				break
+		elif op in ("open", "close"):
+			getattr(main, op)(step["valve"])
+			(opened.add if op == "open" else opened.discard)(step["valve"])
+		elif op == "hold":
+			if not _hold(marks[-1] + start if marks else start, step["seconds"] / speed, stop):
+				for v in opened:
+					main.close(v)
+				main.state_no_flow()
+				stopped = True
+				marks.append(time.perf_counter() - start)
+				break
+		elif op == "read":
+			reads.append(getattr(main, "get_pressure_" + step["channel"])(smoothing=step["smoothing"]).value)
+		elif op == "steady":
+			reads.append(main.wait_for_steady_pressure(getattr(main, "get_pressure_" + step["channel"]),
+													   max_wait=step["max_wait"], max_deviation=step["max_deviation"],
+													   smoothing=step["smoothing"]).value)
+		else:
+			raise ValueError(f"unknown macro step {op}")
+		marks.append(time.perf_counter() - start)
+
+	durations = []
+	for i, step in enumerate(steps[:len(marks)]):
+		before = marks[i - 1] if i > 0 else 0.0
+		if step["op"] == "timed":
+			# the Pi held it for exactly the time asked, unless stop() cut it short
+			durations.append((marks[i] - before) * speed if stopped and i == len(marks) - 1 else step["seconds"])
+		elif step["op"] == "hold":
+			after = marks[i + 1] if i + 1 < len(marks) else marks[i]
+			durations.append((after - before) * speed)
+	return {"marks": [m * speed for m in marks], "durations": durations, "reads": reads, "stopped": stopped}
+
+
+def run(main, steps: List[dict], stop=None) -> dict:
+	"""
+	Run a macro on the Pi if it can, otherwise from here with each pulse timed on the Pi. Same result as execute(),
+	except that marks are per step sent
+	"""
+	run_macro = getattr(main, "run_macro", None)
+	if run_macro is not None:
+		return run_macro(steps)
+	return execute(main, collapse(steps), stop)
+
+
+def _hold(since, seconds, stop):
+	# sleep most of the way, then spin for the last few ms. sleeping alone can overshoot by a scheduler tick
+	end = since + seconds
+	while True:
+		remaining = end - time.perf_counter() - SPIN
+		if remaining <= 0:
+			break
+		if stop is not None:
+			if stop.wait(min(remaining, 0.05)):
+				return False
+		else:
+			time.sleep(remaining)
+	while time.perf_counter() < end:
+		pass
+	return True
@@ -0,0 +1,334 @@
+"""
+Deadlines, retries and latency tracing for calls to the Pi.
+
+	Pi = pirpc.DeadlinePi(pimagic.Pi)
+	Pi.main.get_pressure_barrel()  # raises RPCTimeout instead of hanging if the Pi doesn't answer in time
+
+Each call runs on a small worker pool and the caller waits at most the call's deadline. Reads (get_*) are idempotent,
+so they are retried on timeouts and connection errors; anything that changes valves is sent once, and a call still
+waiting for a worker when its caller gives up is never sent. A call that misses its deadline keeps its Pyro proxy and
+its worker until it ends. Later calls go through a fresh copy of the proxy on a fresh pool, so one hung call doesn't hold
+up the rest for up to BACKSTOP. Latency of every call is kept in a histogram per method, see summary().
+"""
+import atexit
+import copy
+import threading
+import time
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Dict
+
+import pimacro
+from logger import logger
+
+DEFAULT_DEADLINE = 3.0  # seconds
+READ_DEADLINE = 2.0
+DEADLINES = {"diagnose": 5.0, "stop": 2.0}  # overrides by method name
+TIMED_MARGIN = 3.0  # added to the duration of timed states and steady pressure waits
+READ_RETRIES = 2
+BACKSTOP = 120.0  # Pyro timeout on the proxies themselves, so a call abandoned by its caller still ends eventually
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+WORKERS = 8
+MAX_HUNG = 8  # abandoned calls still running before timed out calls stop getting a fresh pool
+
+
+class RPCTimeout(TimeoutError):
+	pass
+
+
+class MethodStats:
+	__slots__ = ("calls", "total", "max", "timeouts", "errors", "retries", "histogram")
+
+	def __init__(self):
+		self.calls = 0
+		self.total = 0.0
+		self.max = 0.0
+		self.timeouts = 0
+		self.errors = 0
+		self.retries = 0
+		self.histogram = [0] * (len(BUCKETS_MS) + 1)
+
+	def add(self, seconds):
+		self.calls += 1
+		self.total += seconds
+		self.max = max(self.max, seconds)
+		self.histogram[bisect_left(BUCKETS_MS, seconds * 1000)] += 1
+
+	def percentile(self, p):
+		# upper bound of the bucket the percentile falls in, in ms
+		target = self.calls * p
+		seen = 0
+		for bound, count in zip(BUCKETS_MS + (float("inf"),), self.histogram):
+			seen += count
+			if seen >= target:
+				return bound
+		return float("inf")
+
+
+_stats = {}  # type: Dict[str, MethodStats]
+_stats_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="pirpc")
+_executor_lock = threading.Lock()
+_hung = 0  # abandoned calls that are still running, each holding a worker of an old pool
+
+
+def deadline_for(method: str, args, kwargs) -> float:
+	if method in DEADLINES:
+		return DEADLINES[method]
+	if method == "wait_for_steady_pressure":
+		return kwargs.get("max_wait", 30.0) + TIMED_MARGIN
+	if method == "run_macro":
+		return pimacro.total_time(args[0]) + TIMED_MARGIN
+	if method.startswith("state_"):
+		t = args[0] if args else kwargs.get("t")
+		if isinstance(t, (int, float)) and kwargs.get("block", True):
+			return t + TIMED_MARGIN
+	if method.startswith("get_"):
+		return READ_DEADLINE
+	return DEFAULT_DEADLINE
+
+
+def stats() -> Dict[str, MethodStats]:
+	with _stats_lock:
+		return dict(_stats)
+
+
+def summary() -> str:
+	lines = ["Pi RPC latency (ms)            calls    mean     p50     p95     p99     max  timeouts errors retries"]
+	for name, s in sorted(stats().items(), key=lambda kv: kv[1].total, reverse=True):
+		if s.calls:
+			lines.append(f"{name:<30}{s.calls:6} {s.total / s.calls * 1000:7.1f} {s.percentile(0.5):7} "
+						 f"{s.percentile(0.95):7} {s.percentile(0.99):7} {s.max * 1000:7.1f} {s.timeouts:9} "
+						 f"{s.errors:6} {s.retries:7}")
+	return "\n".join(lines)
+
+
+def _record(name) -> MethodStats:
+	with _stats_lock:
+		s = _stats.get(name)
+		if s is None:
+			s = _stats[name] = MethodStats()
+		return s
+
+
+class _Attempt:
+	# one try of one call. the caller and the worker agree under the lock on whether it was sent before the caller gave up
+	QUEUED, RUNNING, DONE = "queued", "running", "done"
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.state = self.QUEUED
+		self.abandoned = False
+
+	def start(self) -> bool:
+		with self.lock:
+			if self.abandoned:
+				return False
+			self.state = self.RUNNING
+			return True
+
+	def finish(self) -> bool:
+		# returns True if the caller had given up on it
+		with self.lock:
+			self.state = self.DONE
+			return self.abandoned
+
+	def abandon(self) -> str:
+		with self.lock:
+			self.abandoned = True
+			return self.state
+
+
+def _submit(*args):
+	with _executor_lock:
+		return _executor.submit(*args)
+
+
+def _hung_call():
+	# a worker is stuck on a call nobody waits for. later calls get a new pool, up to MAX_HUNG stuck workers
+	global _executor, _hung
+	with _executor_lock:
+		_hung += 1
+		if _hung > MAX_HUNG:
+			logger.error(f"{_hung} calls to the Pi are hung, new calls wait for the remaining workers")
+			return
+		old, _executor = _executor, ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="pirpc")
+	old.shutdown(wait=False)  # its idle workers exit, the hung one when its call ends
+
+
+def _hung_call_ended():
+	global _hung
+	with _executor_lock:
+		_hung -= 1
+
+
+def _call(attempt: _Attempt, owner: 'DeadlineProxy', proxy, lock, name, args, kwargs):
+	if not attempt.start():
+		return None  # the caller gave up while this waited for a worker. it must not reach the Pi now
+	try:
+		if owner.claim is None:
+			return getattr(proxy, name)(*args, **kwargs)
+		# Pyro5 proxies belong to the thread that made them, a worker has to take it over and keep it for the whole call
+		with lock:
+			owner.claim(proxy)
+			try:
+				return getattr(proxy, name)(*args, **kwargs)
+			finally:
+				if proxy is not owner.proxy:  # abandoned while this call was running, nothing else will use it
+					owner.release(proxy)
+	finally:
+		if attempt.finish():
+			_hung_call_ended()
+
+
+def _communication_error(e: Exception):
+	# Pyro's CommunicationError, and its TimeoutError, aren't OSErrors. match by name so Pyro isn't needed here
+	return isinstance(e, OSError) or any(c.__name__ == "CommunicationError" for c in type(e).__mro__)
+
+
+class _Method:
+	def __init__(self, owner: 'DeadlineProxy', name: str):
+		self.owner = owner
+		self.name = name
+
+	@property
+	def raw(self):
+		# the proxy's own method, for passing to other remote calls
+		return getattr(self.owner.proxy, self.name)
+
+	def __call__(self, *args, **kwargs):
+		key = f"{self.owner.label}.{self.name}"
+		s = _record(key)
+		args = tuple(a.raw if isinstance(a, _Method) else a for a in args)
+		deadline = deadline_for(self.name, args, kwargs)
+		attempts = 1 + (READ_RETRIES if self.name.startswith("get_") else 0)
+		for attempt in range(attempts):
+			start = time.perf_counter()
+			proxy, lock = self.owner.current()
+			call = _Attempt()
+			future = _submit(_call, call, self.owner, proxy, lock, self.name, args, kwargs)
+			try:
+				result = future.result(deadline)
+			except FutureTimeout:
+				s.timeouts += 1
+				future.cancel()
+				state = call.abandon()
+				if state == _Attempt.QUEUED:
+					error = RPCTimeout(f"{key} waited {deadline:.1f}s for a free worker and was not sent")
+				else:
+					if state == _Attempt.RUNNING:
+						self.owner.abandon(proxy)
+						_hung_call()
+					error = RPCTimeout(f"{key} took longer than {deadline:.1f}s")
+			except Exception as e:
+				s.errors += 1
+				if not _communication_error(e):
+					s.add(time.perf_counter() - start)
+					raise  # the Pi answered with an error, trying again won't help
+				error = e
+			else:
+				s.add(time.perf_counter() - start)
+				return result
+			if attempt + 1 < attempts:
+				s.retries += 1
+				logger.warning(f"{error}, retrying")
+		raise error
+
+
+class DeadlineProxy:
+	"""
+	Wraps one Pyro proxy. Falsy when there is no proxy, like the proxies are when the Pi isn't connected
+	"""
+
+	def __init__(self, proxy, label: str):
+		self.source = proxy  # the proxy this was made for, proxy is a copy of it once a call has been abandoned
+		self.proxy = proxy
+		self.label = label
+		self.lock = threading.Lock()
+		self._swap_lock = threading.Lock()
+		# looked up on the class, asking a Pyro4 proxy for an attribute it doesn't have goes to the Pi
+		self.claim = getattr(type(proxy), "_pyroClaimOwnership", None)
+		self._release = getattr(type(proxy), "_pyroRelease", None)
+		self._backstop(proxy)
+
+	@staticmethod
+	def _backstop(proxy):
+		if getattr(proxy, "_pyroTimeout", 1) in (None, 0):  # a Pyro proxy without a timeout of its own
+			proxy._pyroTimeout = BACKSTOP
+
+	def current(self):
+		"""
+		:return: the proxy for the next call and the lock that goes with it
+		"""
+		with self._swap_lock:
+			return self.proxy, self.lock
+
+	def abandon(self, proxy):
+		"""
+		Stop using a proxy whose call missed its deadline. The call keeps it, and its lock, until the Pi answers or
+		BACKSTOP runs out, and later calls get a fresh connection instead of queueing behind it
+		"""
+		if self.claim is None or not hasattr(type(proxy), "__copy__"):
+			return  # not a Pyro proxy, nothing is locked
+		with self._swap_lock:
+			if self.proxy is not proxy:
+				return  # already swapped by another call that timed out on it
+			fresh = copy.copy(proxy)
+			self._backstop(fresh)
+			self.proxy, self.lock = fresh, threading.Lock()
+		logger.warning(f"abandoned a hung call to the Pi's {self.label}, using a new connection")
+
+	def release(self, proxy):
+		if self._release:
+			try:
+				self._release(proxy)
+			except Exception as e:
+				logger.debug(f"releasing an abandoned {self.label} proxy: {e}")
+
+	def __bool__(self):
+		return bool(self.proxy)
+
+	def __getattr__(self, name):
+		value = getattr(self.proxy, name)
+		if callable(value):
+			method = _Method(self, name)
+			self.__dict__[name] = method
+			return method
+		return value
+
+
+class DeadlinePi:
+	"""
+	Same interface as pimagic.Pi, with main and safety wrapped. Follows the underlying object, so reconnects that
+	replace its proxies are picked up
+	"""
+
+	def __init__(self, pi):
+		self._pi = pi
+		self._wrapped = {}  # type: Dict[str, DeadlineProxy]
+
+	def _wrap(self, label):
+		proxy = getattr(self._pi, label)
+		wrapped = self._wrapped.get(label)
+		if wrapped is None or wrapped.source is not proxy:
+			wrapped = self._wrapped[label] = DeadlineProxy(proxy, label)
+		return wrapped
+
+	@property
+	def main(self) -> DeadlineProxy:
+		return self._wrap("main")
+
+	@property
+	def safety(self) -> DeadlineProxy:
+		return self._wrap("safety")
+
+	def __getattr__(self, name):
+		return getattr(self._pi, name)
+
+
+def _log_summary():
+	if any(s.calls for s in stats().values()):
+		logger.info("\n" + summary())
+
+
+atexit.register(_log_summary)
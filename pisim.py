@@ -0,0 +1,287 @@
+import math
+import random
+import threading
+import time
+from collections import deque
+from typing import Callable, List, Optional
+
+import pimacro
+
+ATMOSPHERE = 14.7  # PSI absolute
+SAFETY_VALVE = 5
+FILL, BARREL_HOSE, VENT = 1, 2, 3  # valve numbers as seen by open()/close()
+
+
+class SimParams:
+	"""
+	Physical parameters of the simulated kiosk. Pressures are gauge PSI, volumes are liters, flow coefficients are
+	liters of gas at 1 PSI (absolute) per second per PSI of effective pressure difference.
+	"""
+	regulator = 140.0
+	hp_tank = 2200.0  # high pressure source behind the regulator
+	hp_tank_liters = 50.0
+	barrel_liters = 2.0
+	hose_liters = 0.35
+	tire_liters = 0.0  # a tire on the end of the hose, 0 for none
+	tire_pressure = 32.0
+	cv = {FILL: 3.0, BARREL_HOSE: 4.0, VENT: 2.5, 4: 2.5}  # valve 4 vents the barrel
+	barrel_leak = 0.0004  # fraction of gauge pressure lost per second
+	hose_leak = 0.0008
+	temperature = 72.0  # F
+	pressure_noise = 0.02  # PSI standard deviation
+	temp_noise = 0.05
+	latency = 0.02  # seconds between the sensor reading and the value being returned
+	dt = 0.005  # integration step, seconds
+
+	def __init__(self, **kw):
+		for key, value in kw.items():
+			if not hasattr(SimParams, key):
+				raise TypeError(f"unknown simulation parameter {key}")
+			setattr(self, key, value)
+
+
+class SimClock:
+	"""
+	Simulated time running speed times faster than real time
+	"""
+
+	def __init__(self, speed=1.0):
+		self.speed = speed
+		self._start = time.perf_counter()
+
+	def now(self):
+		return (time.perf_counter() - self._start) * self.speed
+
+	def sleep(self, seconds):
+		time.sleep(max(seconds, 0) / self.speed)
+
+
+class Reading:
+	"""
+	Same shape as the readings the Pi returns
+	"""
+	__slots__ = ("value", "time")
+
+	def __init__(self, value, t=None):
+		self.value = value
+		self.time = t
+
+	def __repr__(self):
+		return f"Reading({self.value:.3f})"
+
+
+def wait_for_steady(read: Callable[[], Reading], clock: SimClock, max_wait=30.0, max_deviation=0.2, window=1.0,
+					interval=0.1) -> Reading:
+	"""
+	Poll until the reading varies by no more than max_deviation over window seconds, or max_wait runs out.
+	A copy of the steady pressure check the Pi runs, against simulated time. Close to the Pi's, but not its code.
+	"""
+	start = clock.now()
+	samples = deque()
+	while True:
+		reading = read()
+		now = clock.now()
+		samples.append((now, reading.value))
+		while samples[0][0] < now - window:
+			samples.popleft()
+		values = [v for _, v in samples]
+		if now - samples[0][0] >= window * 0.9 and max(values) - min(values) <= max_deviation:
+			return Reading(sum(values) / len(values), now)
+		if now - start >= max_wait:
+			return reading
+		clock.sleep(interval)
+
+
+class SimMain:
+	"""
+	Stand-in for Pi.main. Integrates the gas in the barrel, hose and tire whenever it is looked at.
+	"""
+
+	def __init__(self, params: SimParams, clock: SimClock, safety: 'SimSafety'):
+		self.params = params
+		self.clock = clock
+		self.safety = safety
+		self.valves = {v: False for v in (FILL, BARREL_HOSE, VENT, 4)}
+		self._lock = threading.RLock()
+		self._t = clock.now()
+		# gas amounts as absolute PSI * liters, which is proportional to moles at constant temperature
+		self._barrel = ATMOSPHERE * params.barrel_liters
+		self._hose = ATMOSPHERE * params.hose_liters
+		self._tire = (params.tire_pressure + ATMOSPHERE) * params.tire_liters
+		self._hp = params.hp_tank
+		self._history = deque(maxlen=20000)  # (t, barrel, barrelhose sensor) gauge pressures
+		self._history.append((self._t, 0.0, 0.0))
+		self._hold = threading.Event()  # set by stop() to cut timed states short
+
+	# ---- physics ----
+
+	def _pressures(self):
+		p = self.params
+		barrel = self._barrel / p.barrel_liters - ATMOSPHERE
+		hose_volume = p.hose_liters + p.tire_liters
+		hose = (self._hose + self._tire) / hose_volume - ATMOSPHERE
+		return barrel, hose
+
+	def _sensors(self):
+		# the barrelhose transducer sits on the fill line, so while the barrel is filling it sees the regulator side
+		# of the barrel rather than the isolated hose. that is what the regulator test reads
+		barrel, hose = self._pressures()
+		if self.valves[FILL] and self.safety.is_open and not self.valves[BARREL_HOSE]:
+			return barrel, max(barrel, hose)
+		return barrel, hose
+
+	def _flow(self, cv, high, low):
+		# compressible flow, roughly proportional to sqrt(p1^2 - p2^2) in absolute pressure
+		a, b = high + ATMOSPHERE, low + ATMOSPHERE
+		sign = 1 if a >= b else -1
+		return sign * cv * math.sqrt(abs(a * a - b * b)) / 10
+
+	def _advance(self):
+		with self._lock:
+			p = self.params
+			now = self.clock.now()
+			steps = int((now - self._t) / p.dt)
+			for _ in range(steps):
+				barrel, hose = self._pressures()
+				supply = min(p.regulator, self._hp) if self.safety.is_open else -ATMOSPHERE
+				q = {}
+				q[FILL] = self._flow(p.cv[FILL], supply, barrel) if self.valves[FILL] and supply > barrel else 0
+				q[BARREL_HOSE] = self._flow(p.cv[BARREL_HOSE], barrel, hose) if self.valves[BARREL_HOSE] else 0
+				q[VENT] = self._flow(p.cv[VENT], hose, 0) if self.valves[VENT] else 0
+				q[4] = self._flow(p.cv[4], barrel, 0) if self.valves[4] else 0
+				d_barrel = q[FILL] - q[BARREL_HOSE] - q[4] - p.barrel_leak * barrel * p.barrel_liters
+				d_hose = q[BARREL_HOSE] - q[VENT] - p.hose_leak * hose * p.hose_liters
+				self._barrel = max(self._barrel + d_barrel * p.dt, 0)
+				total_hose = max(self._hose + self._tire + d_hose * p.dt, 0)
+				# hose and tire share one pressure
+				hose_volume = p.hose_liters + p.tire_liters
+				self._hose = total_hose * p.hose_liters / hose_volume
+				self._tire = total_hose * p.tire_liters / hose_volume
+				self._hp -= q[FILL] * p.dt / p.hp_tank_liters
+				self._t += p.dt
+				self._history.append((self._t, *self._sensors()))
+
+	def _sample(self, index, smoothing=0.0):
+		# reading as of latency seconds ago, averaged over smoothing seconds
+		self._advance()
+		with self._lock:
+			end = self._t - self.params.latency
+			start = end - (smoothing or 0)
+			values = []
+			for h in reversed(self._history):  # newest first, stop once past the window
+				if h[0] < start:
+					break
+				if h[0] <= end:
+					values.append(h[index])
+			values = values or [self._history[-1][index]]
+		value = sum(values) / len(values) + random.gauss(0, self.params.pressure_noise)
+		return Reading(value, end)
+
+	# ---- readings ----
+
+	def get_pressure_barrel(self, smoothing=0.0):
+		return self._sample(1, smoothing)
+
+	def get_pressure_barrelhose(self, smoothing=0.0):
+		return self._sample(2, smoothing)
+
+	def get_raw_pressures(self, smoothing=0.0) -> List[Reading]:
+		self._advance()
+		return [self.get_pressure_barrel(smoothing), self.get_pressure_barrelhose(smoothing),
+				Reading(self.params.regulator), Reading(self._hp), Reading(0.0), Reading(0.0)]
+
+	def get_temp_barrelhose(self, smoothing=0.0):
+		return Reading(self.params.temperature + random.gauss(0, self.params.temp_noise), self.clock.now())
+
+	def get_temps(self, smoothing=0.0) -> List[Reading]:
+		return [self.get_temp_barrelhose(smoothing) for _ in range(8)]
+
+	def get_hp(self, adjusted=True):
+		self._advance()
+		return Reading(self._hp)
+
+	def wait_for_steady_pressure(self, func, max_wait=30.0, max_deviation=0.2, smoothing=0.0):
+		return wait_for_steady(lambda: func(smoothing=smoothing), self.clock, max_wait, max_deviation)
+
+	# ---- valves ----
+
+	def open(self, v):
+		self._set(v, True)
+
+	def close(self, v):
+		self._set(v, False)
+
+	def _set(self, v, state):
+		self._advance()
+		with self._lock:
+			if v == SAFETY_VALVE:
+				self.safety.is_open = state
+			else:
+				self.valves[v] = state
+
+	def _state(self, opened, t=None, block=True):
+		self._advance()
+		with self._lock:
+			for v in self.valves:
+				self.valves[v] = v in opened
+		if t is None:
+			return
+		self._hold.clear()
+		if block:
+			self._end_state(t)
+		else:
+			threading.Thread(target=self._end_state, args=(t,), daemon=True, name="sim-state").start()
+
+	def _end_state(self, t):
+		self._hold.wait(t / self.clock.speed)
+		self.state_no_flow()
+
+	def state_no_flow(self):
+		self._state(())
+
+	def state_barrel_inflate(self, t=None, block=True):
+		self._state((FILL,), t, block)
+
+	def state_barrel_hose_flow(self):
+		self._state((BARREL_HOSE,))
+
+	def state_barrel_hose_inflate(self, t=None, block=True):
+		self._state((FILL, BARREL_HOSE), t, block)
+
+	def state_barrel_hose_deflate(self, t=None, block=True):
+		self._state((BARREL_HOSE, VENT), t, block)
+
+	def stop(self):
+		self._hold.set()
+
+	def run_macro(self, steps):
+		self._hold.clear()
+		return pimacro.execute(self, steps, stop=self._hold, speed=self.clock.speed)
+
+
+class SimSafety:
+	def __init__(self):
+		self.is_open = False
+
+	def open(self):
+		self.is_open = True
+
+	def close(self):
+		self.is_open = False
+
+	def diagnose(self):
+		return f"Simulated safety valve {'open' if self.is_open else 'closed'}"
+
+
+class SimPi:
+	"""
+	Drop-in for pimagic.Pi backed by a simulation, for testing and benchmarking without hardware.
+	speed is how many times faster than real time the simulation runs. Anything that waits should use pi.speed.
+	"""
+
+	def __init__(self, speed=1.0, params: Optional[SimParams] = None, **kw):
+		self.speed = speed
+		self.clock = SimClock(speed)
+		self.params = params or SimParams(**kw)
+		self.safety = SimSafety()
+		self.main = SimMain(self.params, self.clock, self.safety)
@@ -0,0 +1,252 @@
+"""
+Plots embedded in Tk windows. Long series are decimated to what the canvas can show before drawing, and redrawn for
+the visible range when zooming, so hour long recordings draw and pan as fast as short ones. Data can be appended from
+any thread, redraws happen on the Tk thread at most every redraw_interval ms.
+"""
+import threading
+import tkinter as tk
+from typing import Dict
+
+import numpy as np
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+from matplotlib.figure import Figure
+
+MAX_POINTS = 2000  # points drawn per series, about the canvas width in pixels times two
+REDRAW_INTERVAL = 200  # ms
+
+
+def minmax(x: np.ndarray, y: np.ndarray, n_out: int):
+	"""
+	Keep the min and max of each of n_out / 2 equal buckets, in order. Keeps every spike, which LTTB can miss
+	"""
+	buckets = n_out // 2
+	if len(x) <= n_out or buckets < 1:
+		return x, y
+	size = len(x) // buckets
+	end = buckets * size
+	yb = y[:end].reshape(buckets, size)
+	lo = yb.argmin(axis=1)
+	hi = yb.argmax(axis=1)
+	base = np.arange(buckets) * size
+	idx = np.sort(np.stack((base + lo, base + hi), axis=1), axis=1).ravel()
+	if end < len(x):
+		idx = np.append(idx, len(x) - 1)
+	return x[idx], y[idx]
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int):
+	"""
+	Largest Triangle Three Buckets: keep the first and last points and, from each bucket in between, the point making
+	the largest triangle with the point kept before it and the average of the next bucket. Best for smooth curves
+	"""
+	n = len(x)
+	if n <= n_out or n_out < 3:
+		return x, y
+	edges = (np.arange(n_out - 1) * (n - 2) / (n_out - 2)).astype(int) + 1
+	edges[-1] = n - 1
+	keep = np.empty(n_out, dtype=int)
+	keep[0], keep[-1] = 0, n - 1
+	a = 0
+	for i in range(n_out - 2):
+		start, end = edges[i], edges[i + 1]
+		next_end = edges[i + 2] if i + 2 < len(edges) else n
+		avg_x = x[end:next_end].mean()
+		avg_y = y[end:next_end].mean()
+		area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+		a = start + int(area.argmax())
+		keep[i + 1] = a
+	return x[keep], y[keep]
+
+
+DECIMATORS = {"minmax": minmax, "lttb": lttb}
+
+
+class Series:
+	"""
+	Growable x/y buffers for one line or scatter
+	"""
+
+	def __init__(self, artist, decimate: str):
+		self.artist = artist
+		self.decimate = DECIMATORS[decimate]
+		self.x = np.empty(256)
+		self.y = np.empty(256)
+		self.n = 0
+		self.sorted = True  # x only increases, so the visible range can be found by bisection
+
+	def set(self, x, y):
+		# no copy, so memory mapped data stays mapped. extend() only ever writes into buffers it allocated
+		x = np.asarray(x, dtype=float)
+		self.x, self.y, self.n = x, np.asarray(y, dtype=float), len(x)
+		self.sorted = bool(np.all(x[1:] >= x[:-1]))
+
+	def extend(self, x, y):
+		x = np.atleast_1d(np.asarray(x, dtype=float))
+		y = np.atleast_1d(np.asarray(y, dtype=float))
+		need = self.n + len(x)
+		if need > len(self.x):
+			size = max(need, len(self.x) * 2)
+			self.x = np.resize(self.x, size)
+			self.y = np.resize(self.y, size)
+		if self.n and len(x) and x[0] < self.x[self.n - 1]:
+			self.sorted = False
+		self.x[self.n:need] = x
+		self.y[self.n:need] = y
+		self.n = need
+
+	def visible(self, xlim, max_points):
+		x, y = self.x[:self.n], self.y[:self.n]
+		if xlim is not None and self.sorted and self.n:
+			# one point either side so lines run off the edge instead of stopping short
+			lo = max(np.searchsorted(x, xlim[0]) - 1, 0)
+			hi = min(np.searchsorted(x, xlim[1], side="right") + 1, self.n)
+			x, y = x[lo:hi], y[lo:hi]
+		if not self.sorted:
+			if len(x) > max_points:  # scatter: order doesn't matter, an even stride keeps the shape
+				step = -(-len(x) // max_points)
+				return x[::step], y[::step]
+			return x, y
+		return self.decimate(x, y, max_points)
+
+
+class _Toolbar(NavigationToolbar2Tk):
+	def __init__(self, canvas, widget: 'PlotWidget'):
+		super().__init__(canvas, widget, pack_toolbar=False)
+		self.widget = widget
+
+	def home(self, *args):
+		super().home(*args)
+		self.widget.follow()
+
+
+class PlotWidget(tk.Frame):
+	"""
+	A matplotlib figure in a Tk frame. ax is available for anything static, like reference lines.
+	The view follows the data until the user zooms or pans with the toolbar, home goes back to following
+	"""
+
+	def __init__(self, master, title="", xlabel="", ylabel="", max_points=MAX_POINTS, redraw_interval=REDRAW_INTERVAL,
+				 toolbar=True, figsize=(6, 4), **kw):
+		super().__init__(master, **kw)
+		self.max_points = max_points
+		self.redraw_interval = redraw_interval
+		self.figure = Figure(figsize=figsize, dpi=100)
+		self.ax = self.figure.add_subplot()
+		self.ax.set_title(title)
+		self.ax.set_xlabel(xlabel)
+		self.ax.set_ylabel(ylabel)
+		self.canvas = FigureCanvasTkAgg(self.figure, master=self)
+		if toolbar:
+			_Toolbar(self.canvas, self).pack(side=tk.BOTTOM, fill=tk.X)
+		self.canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+		self.series = {}  # type: Dict[str, Series]
+		self._lock = threading.Lock()
+		self._dirty = False
+		self._follow = True
+		self._drawing = False
+		self._job = None
+		self.ax.callbacks.connect("xlim_changed", self._on_xlim)
+		self.bind("<Destroy>", self._on_destroy, add="+")
+		self._schedule()
+
+	def add_line(self, name, *fmt, decimate="minmax", **kw) -> Series:
+		"""
+		:param fmt: matplotlib format string, like 'r-'
+		:param decimate: minmax keeps spikes, lttb keeps the shape of smooth curves
+		:param kw: passed to Axes.plot, label defaults to name
+		"""
+		kw.setdefault("label", name)
+		(artist,) = self.ax.plot([], [], *fmt, **kw)
+		return self._add(name, artist, decimate)
+
+	def add_scatter(self, name, **kw) -> Series:
+		kw.setdefault("label", name)
+		(artist,) = self.ax.plot([], [], linestyle="none", marker=kw.pop("marker", "o"), **kw)
+		series = self._add(name, artist, "minmax")
+		series.sorted = False
+		return series
+
+	def set_data(self, name, x, y):
+		"""
+		Replace a series' data. Safe from any thread
+		"""
+		with self._lock:
+			self.series[name].set(x, y)
+		self._mark_dirty()
+
+	def append(self, name, x, y):
+		"""
+		Add one point or arrays of points to a series. Safe from any thread
+		"""
+		with self._lock:
+			self.series[name].extend(x, y)
+		self._mark_dirty()
+
+	def follow(self):
+		"""
+		Go back to autoscaling to fit all the data
+		"""
+		self._follow = True
+		self._mark_dirty()
+
+	def legend(self):
+		self.ax.legend(loc="best")
+		self._mark_dirty()
+
+	def redraw(self):
+		"""
+		Decimate every series for the current view and draw. Tk thread only
+		"""
+		self._dirty = False
+		xlim = None if self._follow else self.ax.get_xlim()
+		with self._lock:
+			visible = [(s.artist, s.visible(xlim, self.max_points)) for s in self.series.values()]
+		self._drawing = True
+		try:
+			for artist, (x, y) in visible:
+				artist.set_data(x, y)
+			if self._follow:
+				self.ax.relim()
+				self.ax.autoscale_view()
+		finally:
+			self._drawing = False
+		self.canvas.draw_idle()
+
+	def _add(self, name, artist, decimate):
+		series = self.series[name] = Series(artist, decimate)
+		return series
+
+	def _mark_dirty(self):
+		self._dirty = True
+
+	def _on_xlim(self, _ax):
+		# the user zoomed or panned, stop following and redraw the visible range in more detail
+		if self._drawing:
+			return
+		self._follow = False
+		self._dirty = True
+
+	def _schedule(self):
+		self._job = self.after(self.redraw_interval, self._tick)
+
+	def _tick(self):
+		if self._dirty:
+			self.redraw()
+		self._schedule()
+
+	def _on_destroy(self, event):
+		if event.widget is self and self._job:
+			self.after_cancel(self._job)
+			self._job = None
+
+
+def plot_window(master, title, **kw) -> PlotWidget:
+	"""
+	Open a plot in its own window, the embedded replacement for plt.show()
+	"""
+	top = tk.Toplevel(master)
+	top.title(title)
+	top.attributes('-topmost', True)
+	widget = PlotWidget(top, title=title, **kw)
+	widget.pack(fill=tk.BOTH, expand=True)
+	return widget
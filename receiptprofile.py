@@ -0,0 +1,112 @@
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from functools import wraps
+
+from logger import logger
+
+RING_SIZE = 5000  # most recent timings kept
+PRIMITIVES = ("addline", "addlineadv", "addtable", "addtableadv", "insertimage", "insertbarcode")
+
+enabled = bool(os.environ.get("FTS_RECEIPT_PROFILE"))  # opt-in, normally off
+_records = deque(maxlen=RING_SIZE)  # (time, kind, name, wall ms, net allocated blocks)
+_lock = threading.Lock()
+_active = threading.local()  # kinds being timed on this thread, so nested calls aren't counted twice
+
+
+def enable(on=True):
+	global enabled
+	enabled = on
+
+
+def section(func):
+	"""
+	Decorator for PDFBuilder sections. Costs one flag check while profiling is off.
+	A section called from inside another is part of the outer one's time and isn't recorded separately.
+	"""
+	name = func.__name__
+
+	@wraps(func)
+	def wrapper(*args, **kwargs):
+		if not enabled:
+			return func(*args, **kwargs)
+		return _timed("section", name, func, args, kwargs)
+	return wrapper
+
+
+def instrument(pdf):
+	"""
+	Times the drawing primitives of one PDFGen. Does nothing while profiling is off or if pdf is already instrumented.
+	"""
+	if not enabled or getattr(pdf, "_profiled", False):
+		return
+	pdf._profiled = True
+	for name in PRIMITIVES:
+		method = getattr(pdf, name, None)
+		if method is None:
+			continue
+
+		def wrapper(*args, _name=name, _method=method, **kwargs):
+			return _timed("primitive", _name, _method, args, kwargs)
+		setattr(pdf, name, wrapper)  # instance attribute shadows the class method
+
+
+def _timed(kind, name, func, args, kwargs):
+	active = _active.__dict__.setdefault("kinds", set())
+	if kind in active:  # only the outermost call of each kind is timed, so totals add up to wall time
+		return func(*args, **kwargs)
+	active.add(kind)
+	# net change in live allocated blocks, what the call left behind. not a count of its allocations
+	blocks = sys.getallocatedblocks()
+	start = time.perf_counter()
+	try:
+		return func(*args, **kwargs)
+	finally:
+		wall = (time.perf_counter() - start) * 1000
+		blocks = sys.getallocatedblocks() - blocks
+		active.discard(kind)
+		with _lock:
+			_records.append((time.time(), kind, name, wall, blocks))
+
+
+def records():
+	with _lock:
+		return list(_records)
+
+
+def clear():
+	with _lock:
+		_records.clear()
+
+
+def summary():
+	"""
+	:return: {kind/name: {count, total_ms, mean_ms, max_ms, net_blocks}} for everything in the ring buffer
+	"""
+	result = {}
+	for _, kind, name, wall, blocks in records():
+		s = result.setdefault(f"{kind}/{name}", {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "net_blocks": 0})
+		s["count"] += 1
+		s["total_ms"] += wall
+		s["max_ms"] = max(s["max_ms"], wall)
+		s["net_blocks"] += blocks
+	for s in result.values():
+		s["mean_ms"] = s["total_ms"] / s["count"]
+	return result
+
+
+@atexit.register
+def dump_log():
+	# logged at exit whenever profiling recorded anything, so a profiled kiosk run leaves its numbers in the log
+	for key, s in sorted(summary().items(), key=lambda x: -x[1]["total_ms"]):
+		logger.info(f"receipt profile {key}: {s['count']} calls, {s['total_ms']:.1f}ms total, "
+					f"{s['mean_ms']:.2f}ms mean, {s['max_ms']:.2f}ms max, {s['net_blocks']:+d} net blocks")
+
+
+def dump_json(path):
+	with open(path, "w") as f:
+		json.dump({"summary": summary(), "records": records()}, f)
@@ -0,0 +1,286 @@
+"""
+Sensor session recordings and replay.
+
+A recording is a short header followed by fixed size rows of little endian float64: the time in seconds since the
+start of the session, then one value per channel. Rows are appended as they are read, so a session cut short by a
+crash still loads, and the rows can be memory mapped straight into a NumPy array.
+
+Replay feeds a recording back through the same interface as Pi.main, faster than real time, so a routine can be
+tuned against field data without a kiosk. The steady pressure check during replay is pisim's copy of the one the Pi
+runs, not the Pi's own code, so steady points found in replay are an approximation of what the kiosk would settle on:
+	python sensorlog.py info sensorlogs/graph-20240518-101500.ftslog
+	python sensorlog.py steady sensorlogs/graph-20240518-101500.ftslog --speed 100 --max-deviation 0.15
+"""
+import argparse
+import json
+import os
+import struct
+import threading
+import time
+from bisect import bisect_right
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+import pimacro
+from pisim import Reading, SimClock, SimSafety, wait_for_steady
+
+MAGIC = b"FTSLOG1\n"
+LOG_DIR = "sensorlogs"
+EXTENSION = ".ftslog"
+# channel names that replay serves through Pi.main
+BARREL, BARRELHOSE, TEMP_BARRELHOSE = "barrel", "barrelhose", "temp_barrelhose"
+RAW_PRESSURES = (BARREL, BARRELHOSE, "regulator", "hp", None, None)  # channel of each get_raw_pressures slot
+TEMP_COUNT = 8  # get_temps slots
+
+
+def new_path(prefix: str) -> str:
+	"""
+	:return: a new file name in LOG_DIR for a recording started now
+	"""
+	os.makedirs(LOG_DIR, exist_ok=True)
+	return os.path.join(LOG_DIR, f"{prefix}-{datetime.now():%Y%m%d-%H%M%S}{EXTENSION}")
+
+
+class SensorRecorder:
+	"""
+	Appends rows to a recording. Not thread safe, keep one recorder per sampling thread
+	"""
+
+	def __init__(self, path: str, channels: Sequence[str], start: Optional[float] = None, **meta):
+		"""
+		:param path: file to create
+		:param channels: names of the values passed to record(), in order
+		:param start: time.time() the session started, defaults to now
+		:param meta: anything else worth keeping with the recording, must be JSON serializable
+		"""
+		self.path = path
+		self.channels = list(channels)
+		self._row = struct.Struct(f"<{len(self.channels) + 1}d")
+		self._start = time.time() if start is None else start
+		header = json.dumps({"channels": self.channels, "start": self._start, "meta": meta}).encode()
+		header += b" " * (-(len(MAGIC) + 4 + len(header)) % 8)  # rows start 8 byte aligned
+		self._file = open(path, "wb")
+		self._file.write(MAGIC + struct.pack("<I", len(header)) + header)
+		self.rows = 0
+
+	def record(self, *values, t: Optional[float] = None):
+		"""
+		:param values: one per channel
+		:param t: time.time() the values were read, defaults to now
+		"""
+		t = time.time() if t is None else t
+		self._file.write(self._row.pack(t - self._start, *values))
+		self.rows += 1
+
+	def close(self):
+		if not self._file.closed:
+			self._file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+
+class StreamRecorder:
+	"""
+	Records what a hwsession.SensorStream subscription receives, for routines that only read at the points they care
+	about. Samples arrive on the stream's thread, close() can be called from any other
+	"""
+
+	def __init__(self, path: str, channels: Dict[str, str], **meta):
+		"""
+		:param channels: channel name -> the Pi.main reading method subscribed to, like "get_pressure_barrel"
+		"""
+		self.channels = channels
+		self.recorder = SensorRecorder(path, list(channels), **meta)
+		self._lock = threading.Lock()
+		self._closed = False
+
+	def on_sample(self, sample):
+		with self._lock:
+			if not self._closed:
+				self.recorder.record(*(sample.readings[method] for method in self.channels.values()), t=sample.time)
+
+	def close(self):
+		with self._lock:
+			self._closed = True
+			self.recorder.close()
+
+
+class SensorLog:
+	"""
+	A loaded recording. data is a read-only memory mapped array of shape (rows, 1 + channels), column 0 is the time
+	"""
+
+	def __init__(self, path: str):
+		self.path = path
+		with open(path, "rb") as f:
+			if f.read(len(MAGIC)) != MAGIC:
+				raise ValueError(f"{path} is not a sensor recording")
+			(size,) = struct.unpack("<I", f.read(4))
+			header = json.loads(f.read(size))
+		self.channels = header["channels"]  # type: List[str]
+		self.start = header["start"]
+		self.meta = header["meta"]  # type: Dict
+		offset = len(MAGIC) + 4 + size
+		cols = len(self.channels) + 1
+		rows = (os.path.getsize(path) - offset) // (cols * 8)  # a row torn by a crash is ignored
+		if rows:
+			self.data = np.memmap(path, dtype="<f8", mode="r", offset=offset, shape=(rows, cols))
+		else:
+			self.data = np.empty((0, cols))
+
+	def __len__(self):
+		return len(self.data)
+
+	@property
+	def times(self) -> np.ndarray:
+		return self.data[:, 0]
+
+	@property
+	def duration(self) -> float:
+		return float(self.data[-1, 0]) if len(self.data) else 0.0
+
+	def column(self, channel: str) -> np.ndarray:
+		return self.data[:, self.channels.index(channel) + 1]
+
+
+class ReplayMain:
+	"""
+	Stand-in for Pi.main that serves readings from a recording instead of the sensors. Readings are taken from the
+	recording at the current replay time, valve and state commands do nothing but are kept in commands so a routine's
+	decisions can be checked. Once the recording runs out the last values are returned and finished is set.
+	get_raw_pressures and get_temps return NaN for anything the recording doesn't have.
+	"""
+
+	def __init__(self, log: SensorLog, clock: SimClock):
+		self.log = log
+		self.clock = clock
+		self.commands = []  # (replay time, method name, args)
+		self.finished = threading.Event()
+		self._times = log.times.tolist()
+		self._columns = {name: log.column(name) for name in log.channels}
+		self._hold = threading.Event()
+
+	def _sample(self, channel, smoothing=0.0):
+		if channel not in self._columns:
+			raise ValueError(f"{self.log.path} has no {channel} channel")
+		now = self.clock.now()
+		if now >= self.log.duration:
+			self.finished.set()
+		column = self._columns[channel]
+		end = max(bisect_right(self._times, now), 1)
+		start = min(bisect_right(self._times, now - (smoothing or 0)), end - 1)
+		return Reading(float(column[start:end].mean()), now)
+
+	def get_pressure_barrel(self, smoothing=0.0):
+		return self._sample(BARREL, smoothing)
+
+	def get_pressure_barrelhose(self, smoothing=0.0):
+		return self._sample(BARRELHOSE, smoothing)
+
+	def get_temp_barrelhose(self, smoothing=0.0):
+		return self._sample(TEMP_BARRELHOSE, smoothing)
+
+	def get_raw_pressures(self, smoothing=0.0) -> List[Reading]:
+		return [self._sample_or_nan(channel, smoothing) for channel in RAW_PRESSURES]
+
+	def get_temps(self, smoothing=0.0) -> List[Reading]:
+		# the recording has the one temperature, same as pisim every slot reads it
+		return [self._sample_or_nan(TEMP_BARRELHOSE, smoothing)] * TEMP_COUNT
+
+	def _sample_or_nan(self, channel, smoothing):
+		if channel not in self._columns:
+			return Reading(float("nan"), self.clock.now())
+		return self._sample(channel, smoothing)
+
+	def wait_for_steady_pressure(self, func, max_wait=30.0, max_deviation=0.2, smoothing=0.0):
+		return wait_for_steady(lambda: func(smoothing=smoothing), self.clock, max_wait, max_deviation)
+
+	def stop(self):
+		self._hold.set()
+
+	def run_macro(self, steps):
+		self._hold.clear()
+		return pimacro.execute(self, steps, stop=self._hold, speed=self.clock.speed)
+
+	def __getattr__(self, name):
+		# open, close and the state_* methods. timed states, state_x(4) or state_x(t=4), still take their time
+		if not (name in ("open", "close") or name.startswith("state_")):
+			raise AttributeError(f"{type(self).__name__} has no {name}, replay only serves readings and valve commands")
+
+		def command(*args, t=None, block=True):
+			self.commands.append((self.clock.now(), name, args if t is None else args + (t,)))
+			if t is None and args and isinstance(args[0], (int, float)) and name.startswith("state_"):
+				t = args[0]
+			if t is not None and block:
+				self._hold.clear()
+				self._hold.wait(t / self.clock.speed)
+
+		return command
+
+
+class ReplayPi:
+	"""
+	Drop-in for pimagic.Pi that replays a recording, speed times faster than it was recorded
+	"""
+
+	def __init__(self, path: str, speed=1.0):
+		self.speed = speed
+		self.clock = SimClock(speed)
+		self.log = SensorLog(path)
+		if not len(self.log):
+			raise ValueError(f"{path} has no rows to replay")
+		self.safety = SimSafety()
+		self.main = ReplayMain(self.log, self.clock)
+
+
+def steady_points(path: str, speed: float, max_wait: float, max_deviation: float, channel=BARRELHOSE):
+	"""
+	Run the steady pressure check back to back over a whole recording. The check is pisim.wait_for_steady, which
+	follows the Pi's algorithm but isn't the Pi's code, so treat the points as approximate
+	:return: (replay time, steady value) for every point the check settled on
+	"""
+	pi = ReplayPi(path, speed)
+	read = getattr(pi.main, f"get_pressure_{channel}")
+	points = []
+	while not pi.main.finished.is_set():
+		reading = pi.main.wait_for_steady_pressure(read, max_wait=max_wait, max_deviation=max_deviation)
+		points.append((pi.clock.now(), reading.value))
+	return points
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Inspect and replay sensor recordings")
+	sub = parser.add_subparsers(dest="command", required=True)
+	info = sub.add_parser("info", help="show what a recording holds")
+	info.add_argument("path")
+	steady = sub.add_parser("steady", help="run the steady pressure check over a recording")
+	steady.add_argument("path")
+	steady.add_argument("--speed", type=float, default=50.0, help="how many times faster than real time to replay")
+	steady.add_argument("--max-wait", type=float, default=30.0)
+	steady.add_argument("--max-deviation", type=float, default=0.2)
+	steady.add_argument("--channel", default=BARRELHOSE, choices=[BARREL, BARRELHOSE])
+	args = parser.parse_args()
+
+	if args.command == "info":
+		log = SensorLog(args.path)
+		print(f"{args.path}: {len(log)} rows over {log.duration:.1f}s, started {datetime.fromtimestamp(log.start)}")
+		for name in log.channels:
+			column = log.column(name)
+			if len(column):
+				print(f"  {name:<16} min {column.min():8.2f}  max {column.max():8.2f}  mean {column.mean():8.2f}")
+		if log.meta:
+			print(f"  meta: {log.meta}")
+	else:
+		print("approximate: steady points from the simulator's copy of the Pi's steady pressure check")
+		for t, value in steady_points(args.path, args.speed, args.max_wait, args.max_deviation, args.channel):
+			print(f"{t:8.2f}s  {value:8.2f} PSI")
+
+
+if __name__ == '__main__':
+	main()
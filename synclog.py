@@ -0,0 +1,134 @@
+import json
+import sqlite3
+import threading
+import zlib
+from contextlib import closing
+from typing import Callable, List, Optional, Tuple
+
+from logger import logger
+
+LOG_FILE = "synclog.db"  # rows written since the last sync, one entry per row, and the sync checkpoint
+BATCH_SIZE = 500  # rows per request
+
+_lock = threading.Lock()
+
+
+class TrackedDatabase:
+	"""
+	Same interface as sqlmanager.Database, but every insert, update and delete is also logged with a sequence number,
+	so push() can send what changed since the last sync instead of every table. Everything else is passed through.
+	"""
+
+	def __init__(self, database):
+		self._db = database
+
+	def insert_into(self, table: str, values: dict, *args, **kwargs):
+		result = self._db.insert_into(table, values, *args, **kwargs)
+		record(table, {"uid": values["uid"]} if "uid" in values else values, values)
+		return result
+
+	def insert_update(self, table: str, values: dict, *args, **where):
+		result = self._db.insert_update(table, values, *args, **where)
+		if result is not None:  # None is a failed write
+			record(table, where or values, values)
+		return result
+
+	def delete(self, table: str, *args, **where):
+		result = self._db.delete(table, *args, **where)
+		record(table, where, None)
+		return result
+
+	def __getattr__(self, name):
+		return getattr(self._db, name)
+
+
+def record(table: str, key: dict, row: Optional[dict]):
+	"""
+	Log a row as changed. A row written again before it is synced moves to the end of the log with a new sequence
+	number and its latest values, so it is sent once
+
+	:param key: columns that identify the row, such as {"uid": uid}
+	:param row: the row's values, None if it was deleted
+	"""
+	key_json = json.dumps(key, sort_keys=True, default=str)
+	row_json = None if row is None else json.dumps(row, sort_keys=True, default=str)
+	with _lock, closing(_connect()) as db, db:
+		db.execute("DELETE FROM changes WHERE tbl = ? AND key = ?", (table, key_json))
+		db.execute("INSERT INTO changes (tbl, key, row) VALUES (?, ?, ?)", (table, key_json, row_json))
+
+
+def pending(limit=BATCH_SIZE) -> List[Tuple[int, str, dict, Optional[dict]]]:
+	"""
+	:return: (sequence number, table, key, row) of the oldest dirty rows, row is None for deletes
+	"""
+	with _lock, closing(_connect()) as db, db:
+		rows = db.execute("SELECT seq, tbl, key, row FROM changes ORDER BY seq LIMIT ?", (limit,)).fetchall()
+	return [(seq, table, json.loads(key), None if row is None else json.loads(row)) for seq, table, key, row in rows]
+
+
+def checkpoint() -> int:
+	"""
+	:return: sequence number of the last change the server has accepted
+	"""
+	with _lock, closing(_connect()) as db, db:
+		return db.execute("SELECT seq FROM checkpoint").fetchone()[0]
+
+
+def last_seq() -> int:
+	"""
+	:return: sequence number of the newest change, or the checkpoint if nothing is dirty
+	"""
+	with _lock, closing(_connect()) as db, db:
+		newest = db.execute("SELECT MAX(seq) FROM changes").fetchone()[0]
+		return newest if newest is not None else db.execute("SELECT seq FROM checkpoint").fetchone()[0]
+
+
+def acknowledge(seq: int):
+	"""
+	Mark everything up to seq as synced, for a batch that was accepted or a full sync that covered it
+	"""
+	with _lock, closing(_connect()) as db, db:
+		db.execute("DELETE FROM changes WHERE seq <= ?", (seq,))
+		db.execute("UPDATE checkpoint SET seq = MAX(seq, ?)", (seq,))
+
+
+def encode(batch: List[Tuple[int, str, dict, Optional[dict]]], after: int) -> bytes:
+	"""
+	:param after: checkpoint the batch follows, so the server can tell a resent batch from a gap
+	:return: zlib compressed JSON, {"after": ..., "through": ..., "changes": [{"seq", "table", "key", "row"}, ...]}
+	"""
+	body = {"after": after, "through": batch[-1][0],
+			"changes": [{"seq": seq, "table": table, "key": key, "row": row} for seq, table, key, row in batch]}
+	return zlib.compress(json.dumps(body, default=str).encode())
+
+
+def push(send: Callable[[bytes], None], batch_size=BATCH_SIZE) -> int:
+	"""
+	Send every dirty row, oldest first, in zlib compressed batches. Each accepted batch is dropped from the log and
+	moves the checkpoint in one transaction, so a sync cut short carries on from the first batch that wasn't accepted.
+	send() raising stops the push, and the exception is raised
+
+	:param send: delivers one encoded batch, and raises unless the server accepted all of it
+	:return: rows sent
+	"""
+	sent = 0
+	while True:
+		batch = pending(batch_size)
+		if not batch:
+			return sent
+		send(encode(batch, checkpoint()))
+		acknowledge(batch[-1][0])
+		sent += len(batch)
+		logger.debug(f"synced {len(batch)} change(s) through {batch[-1][0]}")
+
+
+def _connect() -> sqlite3.Connection:
+	# a connection per call, callers come from any thread. used as a context manager it commits or rolls back
+	db = sqlite3.connect(LOG_FILE, timeout=10)
+	db.executescript("""
+		CREATE TABLE IF NOT EXISTS changes (seq INTEGER PRIMARY KEY AUTOINCREMENT, tbl TEXT NOT NULL, key TEXT NOT NULL,
+											row TEXT, UNIQUE (tbl, key));
+		CREATE TABLE IF NOT EXISTS checkpoint (seq INTEGER NOT NULL);
+		INSERT INTO checkpoint SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM checkpoint);
+	""")
+	return db
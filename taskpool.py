@@ -0,0 +1,277 @@
+"""
+Named, bounded worker pools for background jobs, with cancellation and a registry of what is running.
+
+	task = taskpool.submit("graph", graph_thread, pool=taskpool.HARDWARE)
+	...
+	task.cancel()  # sets the task's token, loops check taskpool.cancelled() or wait on taskpool.current_token()
+	task.wait(15)
+
+Every pool is bounded. A task submitted while all of its pool's workers are busy waits in the queue. Hardware loops run
+until their display closes, so a hardware task that has to wait is logged with what it waits behind, and popups check
+full() first to tell the user.
+
+Workers are daemon threads, so a loop that never checks its token can't hold the program open at exit. At exit every
+task is cancelled, and the hardware and valve tasks get up to EXIT_TIMEOUT to finish, so a routine can put the valves
+back before the interpreter kills its thread.
+"""
+import atexit
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import CancelledError, Future, TimeoutError as FutureTimeout
+from typing import Callable, Dict, List, Optional
+
+from logger import logger
+
+IO = "io"  # database, share, email and printing
+HARDWARE = "hardware"  # loops that talk to the Pi
+VALVES = "valves"  # single quick valve commands
+# hardware loops run for as long as their display is open. the arbiter keeps conflicting popups apart, so only a few
+# ever run at once: the sensor stream and a loop or two
+POOL_SIZES = {IO: 4, HARDWARE: 6, VALVES: 2}
+EXIT_TIMEOUT = 5.0  # seconds at exit to wait for hardware and valve tasks to stop
+IDLE_TIMEOUT = 60.0  # seconds an idle worker waits before exiting
+HISTORY_SIZE = 50
+
+
+class Cancelled(Exception):
+	pass
+
+
+class CancelToken:
+	def __init__(self):
+		self._event = threading.Event()
+
+	def cancel(self):
+		self._event.set()
+
+	@property
+	def cancelled(self):
+		return self._event.is_set()
+
+	def wait(self, timeout: float) -> bool:
+		"""
+		Sleep that wakes up early on cancellation
+
+		:return: True if cancelled
+		"""
+		return self._event.wait(timeout)
+
+	def raise_if_cancelled(self):
+		if self._event.is_set():
+			raise Cancelled()
+
+
+class Task:
+	QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+
+	def __init__(self, name: str, pool: str, func: Callable, args, kwargs):
+		self.name = name
+		self.pool = pool
+		self.func = func
+		self.args = args
+		self.kwargs = kwargs
+		self.token = CancelToken()
+		self.future = Future()
+		self.submitted = time.monotonic()
+		self.started = None  # type: Optional[float]
+		self.finished = None  # type: Optional[float]
+		self.thread = None  # type: Optional[str]
+
+	@property
+	def status(self):
+		if self.finished is None:
+			return self.QUEUED if self.started is None else self.RUNNING
+		if self.future.cancelled() or isinstance(self.future.exception(), Cancelled) or self.token.cancelled:
+			return self.CANCELLED
+		return self.FAILED if self.future.exception() else self.DONE
+
+	@property
+	def queued_time(self):
+		return (self.started or time.monotonic()) - self.submitted
+
+	@property
+	def run_time(self):
+		return 0.0 if self.started is None else (self.finished or time.monotonic()) - self.started
+
+	def cancel(self):
+		"""
+		Ask the task to stop. A queued task never starts, a running one stops when it next checks its token
+		"""
+		self.token.cancel()
+		self.future.cancel()
+
+	def done(self):
+		return self.finished is not None or self.future.done()
+
+	def wait(self, timeout=None) -> bool:
+		"""
+		:return: True if the task finished within the timeout
+		"""
+		try:
+			self.future.exception(timeout)
+		except FutureTimeout:
+			return False
+		except CancelledError:
+			pass
+		return True
+
+	def result(self, timeout=None):
+		return self.future.result(timeout)
+
+	def _run(self):
+		if not self.future.set_running_or_notify_cancel():
+			self.finished = time.monotonic()
+			return
+		self.started = time.monotonic()
+		self.thread = threading.current_thread().name
+		_local.task = self
+		try:
+			result = self.func(*self.args, **self.kwargs)
+		except BaseException as e:
+			self.finished = time.monotonic()
+			if not isinstance(e, Cancelled):
+				logger.error(f"task {self.name} failed", exc_info=e)
+			self.future.set_exception(e)
+		else:
+			self.finished = time.monotonic()
+			self.future.set_result(result)
+		finally:
+			_local.task = None
+
+
+class _Pool:
+	# up to size daemon workers, started as needed and retired after IDLE_TIMEOUT with nothing to do
+	def __init__(self, name, size):
+		self.name = name
+		self.size = size
+		self._queue = queue.SimpleQueue()
+		self._lock = threading.Lock()
+		self._workers = 0
+		self._idle = 0
+
+	def put(self, task: Task) -> bool:
+		# returns False if the task has to wait for a busy worker
+		with self._lock:
+			self._queue.put(task)
+			if self._queue.qsize() <= self._idle:
+				return True
+			if self._workers < self.size:
+				self._workers += 1
+				threading.Thread(target=self._work, daemon=True, name=f"{self.name}-{self._workers}").start()
+				return True
+			return False
+
+	def full(self):
+		with self._lock:
+			return self._queue.qsize() >= self._idle and self._workers >= self.size
+
+	def _work(self):
+		while True:
+			with self._lock:
+				self._idle += 1
+			try:
+				task = self._queue.get(timeout=IDLE_TIMEOUT)
+			except queue.Empty:
+				with self._lock:
+					self._idle -= 1
+					if self._queue.empty():
+						self._workers -= 1
+						return
+					continue
+			with self._lock:
+				self._idle -= 1
+			task._run()
+			_finished(task)
+
+
+_local = threading.local()
+_lock = threading.Lock()
+_pools = {name: _Pool(name, size) for name, size in POOL_SIZES.items()}  # type: Dict[str, _Pool]
+_active = []  # type: List[Task]
+_history = deque(maxlen=HISTORY_SIZE)  # finished tasks, newest last
+_stats = {}  # type: Dict[str, List[float]]  # name -> [runs, failures, total seconds, max seconds]
+
+
+def submit(name: str, func: Callable, *args, pool=IO, **kwargs) -> Task:
+	"""
+	Run func(*args, **kwargs) on a worker of the named pool. Waits in the pool's queue while all its workers are busy
+	"""
+	task = Task(name, pool, func, args, kwargs)
+	with _lock:
+		_active.append(task)
+	if not _pools[pool].put(task) and pool == HARDWARE:
+		running = ", ".join(t.name for t in tasks() if t.pool == pool and t.status == Task.RUNNING)
+		logger.warning(f"all {POOL_SIZES[pool]} {pool} workers are busy, {name} waits for one of: {running}")
+	return task
+
+
+def full(pool: str) -> bool:
+	"""
+	:return: True if a task submitted to pool now would have to wait for a running one to finish
+	"""
+	return _pools[pool].full()
+
+
+def current_token() -> CancelToken:
+	"""
+	Token of the task running on this thread. Outside of a task this is a token that is never cancelled
+	"""
+	task = getattr(_local, "task", None)
+	return task.token if task else CancelToken()
+
+
+def cancelled() -> bool:
+	task = getattr(_local, "task", None)
+	return bool(task and task.token.cancelled)
+
+
+def tasks() -> List[Task]:
+	"""
+	:return: queued and running tasks, then recently finished ones, oldest first within each
+	"""
+	with _lock:
+		return list(_active) + list(_history)
+
+
+def stats() -> Dict[str, dict]:
+	"""
+	:return: task name -> runs, failures, total and max run seconds
+	"""
+	with _lock:
+		return {name: {"runs": s[0], "failures": s[1], "total": s[2], "max": s[3]} for name, s in _stats.items()}
+
+
+def cancel_all(timeout=0.0, pools=(HARDWARE, VALVES)):
+	"""
+	Cancel every queued and running task
+
+	:param timeout: seconds to wait, in total, for the running tasks of pools to finish
+	"""
+	with _lock:
+		active = list(_active)
+	for task in active:
+		task.cancel()
+	deadline = time.monotonic() + timeout
+	for task in active if timeout else ():
+		if task.pool in pools and task.started is not None:
+			if not task.wait(max(deadline - time.monotonic(), 0)):
+				logger.warning(f"task {task.name} didn't stop within {timeout}s")
+
+
+def _finished(task: Task):
+	with _lock:
+		try:
+			_active.remove(task)
+		except ValueError:
+			pass
+		_history.append(task)
+		s = _stats.setdefault(task.name, [0, 0, 0.0, 0.0])
+		s[0] += 1
+		s[1] += task.status == Task.FAILED
+		s[2] += task.run_time
+		s[3] = max(s[3], task.run_time)
+
+
+atexit.register(cancel_all, EXIT_TIMEOUT)
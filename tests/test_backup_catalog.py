@@ -0,0 +1,77 @@
+import os
+import time
+
+import pytest
+
+import backup_catalog
+
+
+@pytest.fixture
+def catalog(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	os.mkdir(backup_catalog.BACKUP_DIR)
+	monkeypatch.setattr(backup_catalog, "_entries", None)
+	monkeypatch.setattr(backup_catalog, "_dir_mtime", None)
+	monkeypatch.setattr(backup_catalog, "_refresh_task", None)
+	monkeypatch.setattr(backup_catalog, "prune_async", backup_catalog.prune)  # keep the tests on one thread
+	return backup_catalog
+
+
+def write_backup(datestr, latest=True, age=0.0):
+	paths = [backup_catalog.log_path(datestr)] + ([backup_catalog.latest_path(datestr)] if latest else [])
+	for path in paths:
+		with open(path, "w") as f:
+			f.write("x" * 10)
+		if age:
+			t = time.time() - age
+			os.utime(path, (t, t))
+
+
+def test_record_lists_newest_first(catalog):
+	for datestr in ("2024-01-01_10-00-00", "2024-01-03_10-00-00", "2024-01-02_10-00-00"):
+		write_backup(datestr)
+		catalog.record(datestr)
+	assert catalog.latest(2) == ["2024-01-03_10-00-00", "2024-01-02_10-00-00"]
+
+
+def test_record_survives_reload(catalog, monkeypatch):
+	write_backup("2024-01-01_10-00-00")
+	catalog.record("2024-01-01_10-00-00")
+	monkeypatch.setattr(backup_catalog, "_entries", None)
+	assert catalog.latest() == ["2024-01-01_10-00-00"]
+	assert catalog.refresh_if_changed() is None
+
+
+def test_refresh_finds_complete_unrecorded_backups(catalog):
+	write_backup("2024-01-01_10-00-00")
+	write_backup("2024-01-02_10-00-00", latest=False)  # half written, can't be restored
+	assert catalog.latest() == []
+	task = catalog.refresh_if_changed()
+	assert task is not None and task.wait(5)
+	assert catalog.latest(5) == ["2024-01-01_10-00-00"]
+
+
+def test_refresh_drops_deleted_backups(catalog):
+	for datestr in ("2024-01-01_10-00-00", "2024-01-02_10-00-00"):
+		write_backup(datestr)
+		catalog.record(datestr)
+	os.remove(catalog.latest_path("2024-01-02_10-00-00"))
+	os.utime(catalog.BACKUP_DIR, (time.time() + 5, time.time() + 5))
+	assert catalog.refresh_if_changed().wait(5)
+	assert catalog.latest(5) == ["2024-01-01_10-00-00"]
+
+
+def test_prune_keeps_count_and_deletes_files(catalog, monkeypatch):
+	monkeypatch.setattr(backup_catalog, "KEEP_COUNT", 2)
+	for day in range(1, 5):
+		write_backup(f"2024-01-0{day}_10-00-00")
+		catalog.record(f"2024-01-0{day}_10-00-00")
+	assert catalog.latest(5) == ["2024-01-04_10-00-00", "2024-01-03_10-00-00"]
+	assert not os.path.exists(catalog.log_path("2024-01-01_10-00-00"))
+	assert os.path.exists(catalog.log_path("2024-01-03_10-00-00"))
+
+
+def test_prune_by_age_keeps_the_newest(catalog):
+	write_backup("2024-01-01_10-00-00", age=365 * 86400)
+	catalog.record("2024-01-01_10-00-00")
+	assert catalog.latest() == ["2024-01-01_10-00-00"]
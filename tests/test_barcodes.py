@@ -0,0 +1,59 @@
+import pytest
+
+import barcodes
+from barcodes import _PATTERNS, bars, layout
+
+
+def decode(code):
+	# turn (x, width) bars back into symbol values
+	widths = []
+	end = 0
+	for x, w in code:
+		if widths:
+			widths.append(x - end)  # space before this bar
+		widths.append(w)
+		end = x + w
+	symbols = []
+	while len(widths) > 7:
+		symbols.append(_PATTERNS.index("".join(map(str, widths[:6]))))
+		widths = widths[6:]
+	assert "".join(map(str, widths)) == _PATTERNS[106]
+	return symbols
+
+
+def check(symbols):
+	*symbols, checksum = symbols
+	assert checksum == (symbols[0] + sum(i * s for i, s in enumerate(symbols[1:], 1))) % 103
+	return symbols
+
+
+def test_even_digits_use_code_c():
+	assert check(decode(bars("0000123456"))) == [105, 0, 0, 12, 34, 56]
+
+
+@pytest.mark.parametrize("value", ["1HGCM82633A004352", "123", "A"])
+def test_other_values_use_code_b(value):
+	assert check(decode(bars(value))) == [104] + [ord(c) - 32 for c in value]
+
+
+def test_every_symbol_is_eleven_modules():
+	assert all(sum(map(int, p)) == 11 for p in _PATTERNS[:106])
+	code = bars("0123456789")
+	assert code[-1][0] + code[-1][1] == 11 * 7 + 13  # start, 5 pairs, checksum, stop
+
+
+def test_rejects_non_ascii():
+	with pytest.raises(ValueError):
+		bars("caf\xe9")
+
+
+def test_layout_is_centered_on_whole_dots():
+	width = 198.0
+	rects, height = layout("0000123456", width)
+	dot = width / barcodes.PRINTER_DOTS
+	left = rects[0][0]
+	right = rects[-1][0] + rects[-1][1]
+	assert left == pytest.approx(width - right)
+	for x, w in rects:
+		assert (w / dot) == pytest.approx(round(w / dot))
+	assert height == pytest.approx(barcodes.BAR_HEIGHT * dot)
@@ -0,0 +1,84 @@
+import json
+
+import configsaver
+
+
+class FakeWidget:
+	# after() that only runs when told to, in place of a Tk event loop
+	def __init__(self):
+		self.pending = {}
+		self._next = 0
+
+	def after(self, ms, func):
+		self._next += 1
+		self.pending[self._next] = func
+		return self._next
+
+	def after_cancel(self, after_id):
+		self.pending.pop(after_id, None)
+
+	def run(self):
+		pending, self.pending = self.pending, {}
+		for func in pending.values():
+			func()
+
+
+def json_writer(values):
+	def write(path):
+		with open(path, "w") as f:
+			json.dump(values, f)
+	return write
+
+
+def test_requests_coalesce_into_one_write(tmp_path):
+	widget = FakeWidget()
+	values = {"a": 1}
+	writes = []
+
+	def write(path):
+		writes.append(path)
+		json_writer(values)(path)
+
+	saver = configsaver.DebouncedSaver(widget, str(tmp_path / "config.json"), write, "test values")
+	saver.request()
+	values["a"] = 2
+	saver.request()
+	assert len(widget.pending) == 1
+	widget.run()
+	assert len(writes) == 1
+	assert json.loads((tmp_path / "config.json").read_text()) == {"a": 2}
+	assert not (tmp_path / "config.json.tmp").exists()
+
+
+def test_flush_without_request_does_nothing(tmp_path):
+	saver = configsaver.DebouncedSaver(FakeWidget(), str(tmp_path / "config.json"), json_writer({}), "test values")
+	assert saver.flush()
+	assert not (tmp_path / "config.json").exists()
+
+
+def test_failed_save_is_reported_and_keeps_the_old_file(tmp_path):
+	path = tmp_path / "config.json"
+	path.write_text('{"a": 1}')
+	errors = []
+
+	def write(_path):
+		raise TypeError("Decimal is not JSON serializable")
+
+	widget = FakeWidget()
+	saver = configsaver.DebouncedSaver(widget, str(path), write, "test values", on_error=errors.append)
+	saver.request()
+	assert not saver.flush()
+	assert isinstance(errors[0], TypeError)
+	assert path.read_text() == '{"a": 1}'
+
+
+def test_unchanged_contents_are_not_replaced(tmp_path):
+	values = {"a": 1}
+	path = tmp_path / "config.json"
+	json_writer(values)(str(path))
+	before = path.stat().st_mtime_ns
+	widget = FakeWidget()
+	saver = configsaver.DebouncedSaver(widget, str(path), json_writer(values), "test values")
+	saver.request()
+	assert saver.flush()
+	assert path.stat().st_mtime_ns == before
@@ -0,0 +1,69 @@
+import random
+from collections import Counter
+
+import pytest
+
+import couponcache
+from couponcache import CouponCache, CouponRotation, _alias_table
+
+
+def draw(prob, alias, rng):
+	i = rng.randrange(len(prob))
+	return i if rng.random() < prob[i] else alias[i]
+
+
+@pytest.mark.parametrize("weights", [[1.0], [1.0, 1.0, 1.0], [1.0, 2.0, 7.0], [0.5, 3.0, 0.25, 1.25]])
+def test_alias_table_matches_weights(weights):
+	prob, alias = _alias_table(weights)
+	assert len(prob) == len(alias) == len(weights)
+	# the exact chance of each slot: its own share of the slots that keep themselves plus what is aliased to it
+	n = len(weights)
+	chance = [0.0] * n
+	for i in range(n):
+		chance[i] += prob[i] / n
+		chance[alias[i]] += (1.0 - prob[i]) / n
+	total = sum(weights)
+	assert chance == pytest.approx([w / total for w in weights])
+
+
+def test_alias_table_samples():
+	weights = [1.0, 3.0]
+	prob, alias = _alias_table(weights)
+	rng = random.Random(1)
+	counts = Counter(draw(prob, alias, rng) for _ in range(20000))
+	assert counts[1] / 20000 == pytest.approx(0.75, abs=0.02)
+
+
+def test_alias_table_empty():
+	assert _alias_table([]) == ([], [])
+
+
+@pytest.fixture
+def rotation(tmp_path, monkeypatch):
+	monkeypatch.setattr(couponcache, "IMPRESSIONS_FILE", str(tmp_path / "impressions.json"))
+	monkeypatch.setattr(CouponRotation, "_impressions", None)
+	monkeypatch.setattr(CouponRotation, "_version", -1)
+	paths = {}
+	for code in ("A", "B"):
+		path = tmp_path / f"{code}.png"
+		path.write_bytes(code.encode())
+		paths[code] = str(path)
+	monkeypatch.setattr(CouponCache, "codes", classmethod(lambda cls: dict(paths)))
+	monkeypatch.setattr(CouponCache, "weights", classmethod(lambda cls, codes=None: {"A": 1.0, "B": 0.0}))
+	monkeypatch.setattr(CouponCache, "receipt_image", classmethod(lambda cls, path: (path, 10, 5)))
+	return CouponRotation
+
+
+def test_choose_skips_zero_weights_and_counts(rotation):
+	for _ in range(5):
+		image, width, height = rotation.choose()
+		assert image.read() == b"A"
+		assert (width, height) == (10, 5)
+	assert rotation.impressions() == {"A": 5}
+
+
+def test_impressions_survive_restart(rotation, monkeypatch):
+	rotation.choose()
+	rotation.save_impressions()
+	monkeypatch.setattr(CouponRotation, "_impressions", None)
+	assert rotation.impressions() == {"A": 1}
@@ -0,0 +1,60 @@
+import os
+from datetime import datetime
+
+import numpy as np
+
+import graphstore
+from graphstore import GraphStore
+
+
+def write_csv(path, rows):
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	with open(path, "w") as f:
+		f.write("time,pressure\n")
+		for row in rows:
+			f.write(",".join(str(x) for x in row) + "\n")
+
+
+def test_add_and_load_round_trip(tmp_path):
+	store = GraphStore(str(tmp_path / "store"))
+	data = np.array([[0.0, 0.1, 0.2], [30.0, 31.5, 33.0]])
+	store.add(2134, "LFO", ["time", "pressure"], data, 110, day=datetime(2024, 5, 18))
+	assert sorted(os.listdir(store.root)) == ["20240518.f64", "20240518.idx"]
+	graph = store.load(2134, "LFO")
+	assert graph.columns == ["time", "pressure"]
+	assert graph.setpressure == 110
+	np.testing.assert_array_equal(graph.data, data)
+	np.testing.assert_array_equal(graph.column("pressure"), data[1])
+	assert store.load(2134, "RFO") is None
+
+
+def test_another_reader_sees_appends_across_segments(tmp_path):
+	root = str(tmp_path / "store")
+	writer, reader = GraphStore(root), GraphStore(root)
+	writer.add(1, "LF", ["t"], np.array([[1.0, 2.0]]), day=datetime(2024, 5, 18))
+	assert set(reader.lookup(1)) == {"LF"}
+	writer.add(1, "RF", ["t"], np.array([[3.0]]), day=datetime(2024, 5, 19))
+	writer.add(1, "LF", ["t"], np.array([[4.0, 5.0, 6.0]]), day=datetime(2024, 5, 19))  # stored again, replaces
+	assert set(reader.lookup(1)) == {"LF", "RF"}
+	np.testing.assert_array_equal(reader.load(1, "LF").data, [[4.0, 5.0, 6.0]])
+
+
+def test_torn_index_line_is_skipped(tmp_path):
+	store = GraphStore(str(tmp_path / "store"))
+	store.add(1, "LF", ["t"], np.array([[1.0]]), day=datetime(2024, 5, 18))
+	with open(os.path.join(store.root, "20240518.idx"), "ab") as f:
+		f.write(b'{"ctrlnum": "0000000001", "tire": "RF"')  # crashed mid-line
+	store.add(1, "RR", ["t"], np.array([[2.0]]), day=datetime(2024, 5, 18))
+	assert set(GraphStore(store.root).lookup(1)) == {"LF", "RR"}
+
+
+def test_record_graph_stores_next_to_graphdata(tmp_path, monkeypatch):
+	path = str(tmp_path / "RAWData" / "graphdata" / "0000002134" / "0000002134-LFO-110.csv")
+	write_csv(path, [(0.0, 30.0), (0.5, 32.0)])
+	monkeypatch.setattr(GraphStore, "_stores", {})
+	task = graphstore.record_graph(path)
+	assert task.wait(5) and task.future.result() is True
+	store = GraphStore.open(str(tmp_path / "RAWData" / graphstore.STORE_DIR))
+	graph = store.load(2134, "LFO")
+	assert graph.setpressure == 110
+	np.testing.assert_array_equal(graph.column("pressure"), [30.0, 32.0])
@@ -0,0 +1,76 @@
+import json
+from decimal import Decimal
+
+import pytest
+
+import heartbeatbuffer
+
+
+class FakeStore:
+	def __init__(self):
+		self.values = {}
+		self.fail_on = None
+
+	def increment(self, key, value):
+		if key == self.fail_on:
+			raise OSError("store unavailable")
+		self.values[key] = self.values.get(key, 0) + value
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	fake = FakeStore()
+	monkeypatch.setattr(heartbeatbuffer, "heartbeatstore", fake)
+	monkeypatch.setattr(heartbeatbuffer, "_wal", None)
+	monkeypatch.setattr(heartbeatbuffer, "_flush_thread", object())  # flush by hand
+	yield fake
+	if heartbeatbuffer._wal is not None:
+		heartbeatbuffer._wal.close()
+
+
+def test_flush_adds_up_increments(store):
+	heartbeatbuffer.increment("a", 1)
+	heartbeatbuffer.increment("a", 2)
+	heartbeatbuffer.increment("b", Decimal("1.5"))
+	assert store.values == {}
+	heartbeatbuffer.flush()
+	assert store.values == {"a": 3, "b": 1.5}
+	heartbeatbuffer.flush()
+	assert store.values == {"a": 3, "b": 1.5}
+
+
+def test_increments_are_in_the_log_before_a_flush(store):
+	heartbeatbuffer.increment("a", 1)
+	with open(heartbeatbuffer.WAL_FILE) as f:
+		assert [json.loads(line) for line in f] == [["a", 1]]
+
+
+def test_failed_flush_resumes_after_the_applied_keys(store):
+	heartbeatbuffer.increment("a", 1)
+	heartbeatbuffer.increment("b", 1)
+	heartbeatbuffer.increment("c", 1)
+	store.fail_on = "b"
+	with pytest.raises(OSError):
+		heartbeatbuffer.flush()
+	assert store.values == {"a": 1}
+	heartbeatbuffer.increment("a", 5)  # counted while the journal is pending, goes to a new log
+	store.fail_on = None
+	heartbeatbuffer.flush()
+	assert store.values == {"a": 6, "b": 1, "c": 1}
+
+
+def test_start_applies_a_journal_left_by_a_crash(store, monkeypatch):
+	with open(heartbeatbuffer.JOURNAL_FILE, "w") as f:
+		f.write('["a", 1]\n["b", 2]\n["a"]\n["b", 1')  # a was applied, the last line was torn
+	store.values["a"] = 1
+	started = []
+	monkeypatch.setattr(heartbeatbuffer, "_flush_thread", None)
+	monkeypatch.setattr(heartbeatbuffer.threading, "Thread", lambda **kwargs: type("T", (), {
+		"start": lambda self: started.append(kwargs["name"])})())
+	monkeypatch.setattr(heartbeatbuffer.atexit, "register", lambda func: None)
+	heartbeatbuffer.increment("c", 1)
+	assert started == ["heartbeatflush"]
+	assert store.values == {"a": 1, "b": 2}
+	heartbeatbuffer.flush()
+	assert store.values == {"a": 1, "b": 2, "c": 1}
@@ -0,0 +1,98 @@
+import threading
+
+import pytest
+
+from hwsession import EXCLUSIVE, SHARED, HardwareArbiter, Sample, SensorStream
+from pisim import Reading
+
+
+def test_shared_leases_share():
+	arbiter = HardwareArbiter()
+	a = arbiter.request("a", sensors=SHARED)
+	b = arbiter.request("b", sensors=SHARED)
+	assert a.granted.is_set() and b.granted.is_set()
+
+
+def test_exclusive_waits_and_is_granted_on_release():
+	arbiter = HardwareArbiter()
+	granted = []
+	first = arbiter.request("first", valves=EXCLUSIVE)
+	second = arbiter.request("second", on_grant=granted.append, valves=EXCLUSIVE)
+	assert not second.granted.is_set()
+	assert arbiter.blocking(second) == [first]
+	first.release()
+	assert granted == [second]
+	assert arbiter.holders() == [second]
+
+
+def test_queue_is_first_come_first_served():
+	arbiter = HardwareArbiter()
+	reader = arbiter.request("reader", valves=SHARED)
+	writer = arbiter.request("writer", valves=EXCLUSIVE)
+	late_reader = arbiter.request("late reader", valves=SHARED)
+	assert not late_reader.granted.is_set()  # would starve the writer otherwise
+	reader.release()
+	assert writer.granted.is_set() and not late_reader.granted.is_set()
+	writer.release()
+	assert late_reader.granted.is_set()
+
+
+def test_unrelated_resources_dont_conflict():
+	arbiter = HardwareArbiter()
+	arbiter.request("valves", valves=EXCLUSIVE)
+	assert arbiter.request("sensors", sensors=EXCLUSIVE).granted.is_set()
+
+
+def test_giving_up_leaves_the_queue():
+	arbiter = HardwareArbiter()
+	holder = arbiter.request("holder", valves=EXCLUSIVE)
+	waiting = arbiter.request("waiting", valves=EXCLUSIVE)
+	waiting.release()
+	waiting.release()  # twice is fine
+	assert arbiter.waiting() == []
+	holder.release()
+	assert not waiting.granted.is_set()
+
+
+def test_failed_start_gives_the_lease_back():
+	arbiter = HardwareArbiter()
+	lease = arbiter.request("broken", on_grant=lambda l: 1 / 0, valves=EXCLUSIVE)
+	assert lease.released
+	assert arbiter.request("next", valves=EXCLUSIVE).granted.is_set()
+
+
+def test_bad_mode():
+	with pytest.raises(ValueError):
+		HardwareArbiter().request("x", valves="sometimes")
+
+
+class FakeMain:
+	def get_raw_pressures(self, smoothing=0):
+		return [Reading(1.0), Reading(1.0)]
+
+	def get_temps(self, smoothing=0):
+		return [Reading(70.0)]
+
+	def get_pressure_barrel(self, smoothing=0):
+		return Reading(smoothing)  # tells the test which smoothing was asked for
+
+
+def test_stream_gives_each_subscriber_its_channels_and_smoothing():
+	stream = SensorStream(type("Pi", (), {"main": FakeMain()})(), interval=0.01)
+	got = {"a": threading.Event(), "b": threading.Event()}
+	samples = {}
+
+	def subscriber(name):
+		def callback(sample: Sample):
+			samples[name] = sample
+			got[name].set()
+		return callback
+
+	stop_a = stream.subscribe(subscriber("a"), ["get_pressure_barrel"])
+	stop_b = stream.subscribe(subscriber("b"), ["get_pressure_barrel"], smoothing=0.5)
+	assert got["a"].wait(5) and got["b"].wait(5)
+	stop_a()
+	stop_b()
+	assert samples["a"].readings == {"get_pressure_barrel": 0.01}
+	assert samples["b"].readings == {"get_pressure_barrel": 0.5}
+	assert samples["a"].pressures == [1.0, 1.0] and samples["a"].temps == [70.0]
@@ -0,0 +1,52 @@
+import threading
+from types import SimpleNamespace
+
+import leaktest
+
+
+class FakeMain:
+	def __init__(self):
+		self.calls = []
+		self.fail = None
+
+	def __getattr__(self, name):
+		def command(*args, **kwargs):
+			self.calls.append(name)
+			if name == self.fail:
+				raise OSError(f"{name} failed")
+			return SimpleNamespace(value=100.0)
+		return command
+
+
+def make_engine():
+	main = FakeMain()
+	safety = SimpleNamespace(closed=0, open=lambda: None)
+	safety.close = lambda: setattr(safety, "closed", safety.closed + 1)
+	events = []
+	engine = leaktest.LeakTestEngine(SimpleNamespace(main=main, safety=safety, speed=1000.0),
+									 on_event=lambda kind, value: events.append((kind, value)), poll_interval=0.01)
+	return engine, main, safety, events
+
+
+def test_failed_step_closes_off_and_reports_once():
+	engine, main, safety, events = make_engine()
+	main.fail = "state_barrel_inflate"
+	engine.start()
+	engine.proceed()
+	engine.wait(5)
+	failed = [value for kind, value in events if kind == "failed"]
+	assert len(failed) == 1 and isinstance(failed[0], OSError)
+	assert engine.error is failed[0]
+	assert main.calls[-2:] == ["stop", "state_no_flow"]
+	assert safety.closed == 1
+
+
+def test_lost_pressure_reading_fails_the_test():
+	engine, main, safety, events = make_engine()
+	main.fail = "get_pressure_barrel"
+	done = threading.Event()
+	engine.on_event = lambda kind, value: done.set() if kind == "failed" else None
+	engine.start()
+	assert done.wait(5)
+	assert isinstance(engine.error, OSError)
+	assert "stop" in main.calls and safety.closed == 1
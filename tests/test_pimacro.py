@@ -0,0 +1,31 @@
+import pimacro
+from pimacro import collapse, hold, pulse, read, state, steady, timed, valve
+
+
+def test_pulse_becomes_one_timed_call():
+	assert collapse(pulse("barrel_inflate", 4)) == [timed("barrel_inflate", 4)]
+
+
+def test_other_steps_are_kept_in_order():
+	steps = [valve(1, True), hold(0.5), valve(1, False)] + pulse("barrel_hose_deflate", 2) + [steady("barrel")]
+	assert collapse(steps) == [valve(1, True), hold(0.5), valve(1, False), timed("barrel_hose_deflate", 2),
+							   steady("barrel")]
+
+
+def test_back_to_back_pulses():
+	steps = pulse("barrel_inflate", 1) + pulse("barrel_hose_inflate", 2)
+	assert collapse(steps) == [timed("barrel_inflate", 1), timed("barrel_hose_inflate", 2)]
+
+
+def test_only_complete_pulses_collapse():
+	not_closed = [state("barrel_inflate"), hold(1), read("barrel")]
+	no_flow_hold = [state("no_flow"), hold(1), state("no_flow")]
+	truncated = [state("barrel_inflate"), hold(1)]
+	for steps in (not_closed, no_flow_hold, truncated):
+		assert collapse(steps) == steps
+
+
+def test_total_time_counts_holds_and_waits():
+	steps = pulse("barrel_inflate", 4) + [steady("barrel", max_wait=5)]
+	assert pimacro.total_time(steps) == 9
+	assert pimacro.total_time(collapse(steps)) == 9
@@ -0,0 +1,56 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import pirpc
+
+
+class FakeProxy:
+	def __init__(self):
+		self.release = threading.Event()
+		self.calls = []
+
+	def hang(self):
+		self.calls.append("hang")
+		self.release.wait(5)
+
+	def open(self, valve):
+		self.calls.append(("open", valve))
+
+
+@pytest.fixture
+def proxy(monkeypatch):
+	monkeypatch.setattr(pirpc, "_executor", ThreadPoolExecutor(max_workers=1))
+	monkeypatch.setattr(pirpc, "_hung", 0)
+	monkeypatch.setitem(pirpc.DEADLINES, "hang", 0.2)
+	monkeypatch.setitem(pirpc.DEADLINES, "open", 0.2)
+	fake = FakeProxy()
+	yield fake
+	fake.release.set()
+
+
+def test_command_queued_past_its_deadline_is_never_sent(proxy, monkeypatch):
+	monkeypatch.setattr(pirpc, "MAX_HUNG", 0)  # keep the one stuck worker
+	wrapped = pirpc.DeadlineProxy(proxy, "main")
+	with pytest.raises(pirpc.RPCTimeout):
+		wrapped.hang()
+	with pytest.raises(pirpc.RPCTimeout, match="not sent"):
+		wrapped.open(1)
+	proxy.release.set()
+	pirpc._executor.shutdown(wait=True)
+	assert proxy.calls == ["hang"]
+
+
+def test_hung_call_gets_later_calls_a_fresh_pool(proxy):
+	wrapped = pirpc.DeadlineProxy(proxy, "main")
+	old = pirpc._executor
+	with pytest.raises(pirpc.RPCTimeout, match="took longer"):
+		wrapped.hang()
+	assert pirpc._executor is not old
+	assert pirpc._hung == 1
+	wrapped.open(2)
+	assert proxy.calls == ["hang", ("open", 2)]
+	proxy.release.set()
+	old.shutdown(wait=True)
+	assert pirpc._hung == 0
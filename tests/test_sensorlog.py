@@ -0,0 +1,38 @@
+import math
+
+import pytest
+
+import pimacro
+import sensorlog
+
+
+def replay(tmp_path, speed=1000.0):
+	path = str(tmp_path / "session.ftslog")
+	with sensorlog.SensorRecorder(path, (sensorlog.BARRELHOSE, sensorlog.TEMP_BARRELHOSE), start=0.0) as recorder:
+		for i in range(100):
+			recorder.record(100.0 + i * 0.01, 70.0, t=i * 0.1)
+	return sensorlog.ReplayPi(path, speed)
+
+
+def test_raw_pressures_and_temps_have_the_pi_shape(tmp_path):
+	main = replay(tmp_path).main
+	pressures = main.get_raw_pressures(smoothing=0)
+	assert len(pressures) == len(sensorlog.RAW_PRESSURES)
+	assert math.isnan(pressures[0].value)  # barrel wasn't recorded
+	assert 100.0 <= pressures[1].value <= 101.0
+	temps = main.get_temps(smoothing=0)
+	assert [r.value for r in temps] == [70.0] * sensorlog.TEMP_COUNT
+
+
+def test_timed_states_accept_t(tmp_path):
+	main = replay(tmp_path).main
+	main.state_barrel_inflate(t=0.5)
+	main.state_barrel_inflate(0.5, block=False)
+	assert [(name, args) for _, name, args in main.commands] == [("state_barrel_inflate", (0.5,))] * 2
+
+
+def test_run_macro(tmp_path):
+	main = replay(tmp_path).main
+	result = main.run_macro(pimacro.pulse("barrel_inflate", 2) + [pimacro.steady("barrelhose", max_wait=1)])
+	assert result["durations"] == [pytest.approx(2, abs=0.5)]
+	assert 100.0 <= result["reads"][0] <= 101.0
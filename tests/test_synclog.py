@@ -0,0 +1,91 @@
+import json
+import zlib
+
+import pytest
+
+import synclog
+
+
+class FakeDatabase:
+	def __init__(self):
+		self.calls = []
+
+	def insert_into(self, table, values):
+		self.calls.append(("insert_into", table))
+
+	def insert_update(self, table, values, **where):
+		self.calls.append(("insert_update", table))
+		return None if values.get("fail") else 1
+
+	def delete(self, table, **where):
+		self.calls.append(("delete", table))
+
+	def select(self, table, columns):
+		return [("1", "one")]
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	return synclog.TrackedDatabase(FakeDatabase())
+
+
+def decode(batch):
+	return json.loads(zlib.decompress(batch))
+
+
+def test_writes_are_logged_once_per_row(database):
+	database.insert_into("__bulk__", {"uid": "a", "pan": "1"})
+	database.insert_update("contracts", {"code": "c", "email": "x"}, code="c")
+	database.insert_into("__bulk__", {"uid": "a", "pan": "2"})
+	database.insert_update("contracts", {"code": "d", "fail": True}, code="d")
+	database.delete("revenue", uid="r")
+	assert database.select("minions", ()) == [("1", "one")]
+	changes = synclog.pending()
+	assert [(table, key, row) for _, table, key, row in changes] == [
+		("contracts", {"code": "c"}, {"code": "c", "email": "x"}),
+		("__bulk__", {"uid": "a"}, {"uid": "a", "pan": "2"}),
+		("revenue", {"uid": "r"}, None),
+	]
+	seqs = [seq for seq, *_ in changes]
+	assert seqs == sorted(seqs)
+
+
+def test_push_sends_batches_and_moves_the_checkpoint(database):
+	for i in range(5):
+		database.insert_into("__fix__", {"uid": str(i)})
+	sent = []
+	assert synclog.push(lambda batch: sent.append(decode(batch)), batch_size=2) == 5
+	assert [len(batch["changes"]) for batch in sent] == [2, 2, 1]
+	assert [batch["after"] for batch in sent] == [0, sent[0]["through"], sent[1]["through"]]
+	assert synclog.checkpoint() == sent[-1]["through"]
+	assert synclog.pending() == []
+	assert synclog.push(sent.append) == 0
+
+
+def test_push_resumes_from_the_first_rejected_batch(database):
+	for i in range(4):
+		database.insert_into("__fix__", {"uid": str(i)})
+	sent = []
+
+	def flaky(batch):
+		if len(sent) == 1:
+			raise OSError("connection lost")
+		sent.append(decode(batch))
+
+	with pytest.raises(OSError):
+		synclog.push(flaky, batch_size=2)
+	assert synclog.checkpoint() == sent[0]["through"]
+	synclog.push(lambda batch: sent.append(decode(batch)), batch_size=2)
+	assert [change["key"]["uid"] for batch in sent for change in batch["changes"]] == ["0", "1", "2", "3"]
+
+
+def test_acknowledge_keeps_rows_written_after_the_sync_started(database):
+	database.insert_into("__fix__", {"uid": "a"})
+	seq = synclog.last_seq()
+	database.insert_into("__fix__", {"uid": "b"})
+	synclog.acknowledge(seq)
+	assert [key for _, _, key, _ in synclog.pending()] == [{"uid": "b"}]
+	assert synclog.checkpoint() == seq
+	synclog.acknowledge(synclog.last_seq())
+	assert synclog.last_seq() == synclog.checkpoint()
@@ -0,0 +1,23 @@
+import threading
+
+import taskpool
+
+
+def test_full_pool_queues_until_a_worker_is_free():
+	pool = taskpool._Pool("test", 1)
+	started, release = threading.Event(), threading.Event()
+
+	def hold():
+		started.set()
+		release.wait(5)
+
+	first = taskpool.Task("first", "test", hold, (), {})
+	second = taskpool.Task("second", "test", lambda: "ran", (), {})
+	assert pool.put(first)
+	assert started.wait(5)
+	assert pool.full()
+	assert not pool.put(second)
+	assert not second.wait(0.1)
+	release.set()
+	assert second.wait(5) and second.result() == "ran"
+	assert not pool.full()
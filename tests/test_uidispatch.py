@@ -0,0 +1,61 @@
+import uidispatch
+from uidispatch import UIDispatcher
+
+
+class FakeRoot:
+	def __init__(self):
+		self.scheduled = []
+
+	def after(self, ms, func):
+		self.scheduled.append(func)
+
+
+def test_latest_post_per_key_wins():
+	ui = UIDispatcher(FakeRoot())
+	shown = []
+	for i in range(5):
+		ui.post("pressure", shown.append, i)
+	ui.post("temp", shown.append, "t")
+	assert ui.depth == 2
+	ui._flush()
+	assert shown == [4, "t"]
+	assert (ui.posted, ui.dropped, ui.applied) == (6, 4, 2)
+
+
+def test_reposted_key_moves_to_the_back():
+	ui = UIDispatcher(FakeRoot())
+	shown = []
+	ui.post("a", shown.append, "a1")
+	ui.post("b", shown.append, "b")
+	ui.post("a", shown.append, "a2")
+	ui._flush()
+	assert shown == ["b", "a2"]
+
+
+def test_budget_leaves_the_rest_for_the_next_frame(monkeypatch):
+	ui = UIDispatcher(FakeRoot(), budget=1.0)
+	clock = iter(range(100))
+	monkeypatch.setattr(uidispatch.time, "perf_counter", lambda: next(clock) * 0.6)
+	shown = []
+	for key in "abc":
+		ui.post(key, shown.append, key)
+	ui._flush()
+	assert shown == ["a"]
+	assert ui.over_budget == 1 and ui.depth == 2
+
+
+def test_failed_update_does_not_stop_the_frame():
+	ui = UIDispatcher(FakeRoot())
+	shown = []
+	ui.post("bad", lambda: 1 / 0)
+	ui.post("good", shown.append, "ok")
+	ui._flush()
+	assert shown == ["ok"]
+	assert ui.failed == 1
+
+
+def test_frame_reschedules_itself():
+	root = FakeRoot()
+	ui = UIDispatcher(root)
+	ui._frame()
+	assert root.scheduled == [ui._frame]
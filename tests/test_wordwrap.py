@@ -0,0 +1,40 @@
+import wordwrap
+
+
+def mono(s):
+	return float(len(s))
+
+
+def test_greedy_fill():
+	assert wordwrap.wrap("the quick brown fox jumps", 10, mono, "mono") == ["the quick ", "brown fox ", "jumps "]
+
+
+def test_newlines_force_a_break():
+	assert wordwrap.wrap("one\ntwo three\r\nfour", 20, mono, "mono") == ["one ", "two three ", "four "]
+
+
+def test_long_word_gets_its_own_line():
+	assert wordwrap.wrap("a abcdefghijkl b", 5, mono, "mono") == ["a ", "abcdefghijkl ", "b "]
+
+
+def test_repeated_spaces_collapse():
+	assert wordwrap.wrap("a   b", 10, mono, "mono") == ["a b "]
+
+
+def test_each_character_is_measured_once_per_font():
+	calls = []
+
+	def measure(s):
+		calls.append(s)
+		return 1.0
+	wordwrap.wrap("aaa bbb aaa", 100, measure, "counted")
+	wordwrap.wrap("aaa bbb", 100, measure, "counted")
+	assert sorted(calls) == [" ", "a", "b"]
+	wordwrap.wrap("a", 100, measure, "other font")
+	assert calls.count("a") == 2
+
+
+def test_proportional_widths():
+	widths = {"i": 1.0, "m": 3.0, " ": 1.0}
+	lines = wordwrap.wrap("iii mm iii", 10, lambda s: sum(widths[c] for c in s), "prop")
+	assert lines == ["iii mm ", "iii "]
@@ -0,0 +1,140 @@
+"""
+Watchdog for the Tk event loop. A callback scheduled with after() marks the loop alive every BEAT_INTERVAL seconds,
+and a monitor thread checks the marks. When the loop has been blocked longer than STALL_THRESHOLD, the monitor samples
+the Tk thread's stack until the loop comes back, then logs how long it was stuck and the function it was stuck in.
+Stalls go to a rotating log with a histogram of durations and the worst offenders, written every SUMMARY_INTERVAL and
+at exit.
+"""
+import atexit
+import logging
+import os
+import sys
+import threading
+import time
+import tkinter as tk
+import traceback
+from collections import Counter, defaultdict
+from logging.handlers import RotatingFileHandler
+from typing import Optional
+
+BEAT_INTERVAL = 0.1  # seconds
+STALL_THRESHOLD = 0.5  # seconds the loop can go without a beat before it counts as a stall
+SAMPLE_INTERVAL = 0.05  # seconds between stack samples while stalled
+SUMMARY_INTERVAL = 3600.0
+LOG_FILE = "tkstalls.log"
+BUCKETS = (0.5, 1, 2, 5, 10, 30)  # histogram upper bounds in seconds, anything longer goes in the last bucket
+
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+stall_log = logging.getLogger("tkstalls")
+stall_log.propagate = False
+
+
+class TkWatchdog:
+	"""
+	Use start() rather than making one, there should only ever be one watching the loop
+	"""
+	instance = None  # type: Optional[TkWatchdog]
+
+	def __init__(self, root, threshold=STALL_THRESHOLD, log_file=LOG_FILE):
+		self.root = root
+		self.threshold = threshold
+		self.tk_thread = threading.current_thread().ident  # created from the Tk thread, so this is the one to watch
+		self.histogram = [0] * (len(BUCKETS) + 1)
+		self.by_culprit = defaultdict(lambda: [0, 0.0])  # culprit -> [stalls, total seconds]
+		self._last_beat = time.monotonic()
+		self._stop = threading.Event()
+		if not stall_log.handlers:
+			handler = RotatingFileHandler(log_file, maxBytes=2 * 1024 * 1024, backupCount=3)
+			handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+			stall_log.addHandler(handler)
+			stall_log.setLevel(logging.INFO)
+
+	@classmethod
+	def start(cls, root, **kw) -> 'TkWatchdog':
+		"""
+		Start watching root's event loop. Call from the Tk thread. Later calls return the running watchdog
+		"""
+		if cls.instance is None:
+			cls.instance = cls(root, **kw)
+			cls.instance._beat()
+			threading.Thread(target=cls.instance._monitor, daemon=True, name="tkwatchdog").start()
+			atexit.register(cls.instance.stop)
+		return cls.instance
+
+	def stop(self):
+		if not self._stop.is_set():
+			self._stop.set()
+			self.write_summary()
+
+	def summary(self) -> str:
+		lines = [f"Tk stalls over {self.threshold}s: {sum(self.histogram)}"]
+		bounds = [f"<{b}s" for b in BUCKETS] + [f">={BUCKETS[-1]}s"]
+		lines += [f"  {bound:>7} {count:6}" for bound, count in zip(bounds, self.histogram)]
+		worst = sorted(self.by_culprit.items(), key=lambda kv: kv[1][1], reverse=True)[:10]
+		if worst:
+			lines.append("  worst by total time:")
+			lines += [f"  {total:8.2f}s {count:5}x  {culprit}" for culprit, (count, total) in worst]
+		return "\n".join(lines)
+
+	def write_summary(self):
+		stall_log.info("summary\n" + self.summary())
+
+	def _beat(self):
+		self._last_beat = time.monotonic()
+		if not self._stop.is_set():
+			try:
+				self.root.after(int(BEAT_INTERVAL * 1000), self._beat)
+			except tk.TclError:  # root destroyed
+				pass
+
+	def _monitor(self):
+		next_summary = time.monotonic() + SUMMARY_INTERVAL
+		while not self._stop.wait(SAMPLE_INTERVAL):
+			now = time.monotonic()
+			if now >= next_summary:
+				self.write_summary()
+				next_summary = now + SUMMARY_INTERVAL
+			if now - self._last_beat > BEAT_INTERVAL + self.threshold:
+				self._watch_stall(self._last_beat)
+
+	def _watch_stall(self, beat):
+		# sample until the loop beats again. the function seen most is where the time went
+		samples = Counter()
+		first_stack = None
+		while self._last_beat == beat and not self._stop.is_set():
+			frame = sys._current_frames().get(self.tk_thread)
+			if frame is None:
+				return
+			stack = traceback.extract_stack(frame)
+			del frame
+			first_stack = first_stack or stack
+			samples[_culprit(stack)] += 1
+			time.sleep(SAMPLE_INTERVAL)
+		if not samples:
+			return
+		duration = self._last_beat - beat - BEAT_INTERVAL
+		culprit = samples.most_common(1)[0][0]
+		self.histogram[_bucket(duration)] += 1
+		stats = self.by_culprit[culprit]
+		stats[0] += 1
+		stats[1] += duration
+		stall_log.warning(f"Tk loop blocked {duration:.2f}s in {culprit} ({sum(samples.values())} samples)\n"
+						  + "".join(traceback.format_list(first_stack)))
+
+
+def _culprit(stack):
+	# innermost function in this program's own code, library frames just say what it was waiting on.
+	# grouped by function rather than line so a slow handler ranks as one culprit, the logged stack has the line
+	for entry in reversed(stack):
+		if entry.filename.startswith(_APP_DIR) and not entry.filename.endswith("tkwatchdog.py"):
+			return f"{os.path.basename(entry.filename)} {entry.name}()"
+	entry = stack[-1]
+	return f"{os.path.basename(entry.filename)} {entry.name}()"
+
+
+def _bucket(duration):
+	for i, bound in enumerate(BUCKETS):
+		if duration < bound:
+			return i
+	return len(BUCKETS)
@@ -0,0 +1,112 @@
+"""
+Coalesced display updates from background threads.
+
+A sensor loop that calls run_main_thread for every sample queues one Tk callback per sample, so when the loop is faster
+than the screen the queue only grows and the display shows older and older readings. Posting through the dispatcher
+instead keeps just the latest update per key, and the Tk thread applies whatever is pending once per frame:
+
+	ui = UIDispatcher.start(root)
+	ui.set(pressure_var, f"{p:6.2f}")  # from any thread, replaces an update of pressure_var not yet shown
+	ui.post(("graph", "readout"), show_data, t, p)
+
+A frame stops applying updates once it has used FRAME_BUDGET, the rest wait for the next frame so one busy display
+can't freeze the others.
+"""
+import threading
+import time
+import tkinter as tk
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional
+
+from logger import logger
+
+FRAME_INTERVAL = 0.033  # seconds between flushes, about 30 a second
+FRAME_BUDGET = 0.008  # seconds of updates a single flush may run
+
+
+class UIDispatcher:
+	"""
+	Use start() rather than making one, every display should share the same frame
+	"""
+	instance = None  # type: Optional[UIDispatcher]
+
+	def __init__(self, root, interval=FRAME_INTERVAL, budget=FRAME_BUDGET):
+		self.root = root
+		self.interval = interval
+		self.budget = budget
+		self.posted = 0  # updates handed to post()
+		self.dropped = 0  # updates replaced by a newer one for the same key before they were shown
+		self.applied = 0
+		self.failed = 0
+		self.max_depth = 0
+		self.frames = 0
+		self.over_budget = 0  # frames that left updates for the next one
+		self._pending = OrderedDict()  # key -> (func, args), oldest first
+		self._lock = threading.Lock()
+
+	@classmethod
+	def start(cls, root, **kw) -> 'UIDispatcher':
+		"""
+		Start flushing on root's event loop. Call from the Tk thread. Later calls return the running dispatcher
+		"""
+		if cls.instance is None:
+			cls.instance = cls(root, **kw)
+			cls.instance._frame()
+		return cls.instance
+
+	def post(self, key: Hashable, func: Callable, *args):
+		"""
+		Run func(*args) on the Tk thread at the next frame, unless something else is posted with the same key first
+		"""
+		with self._lock:
+			self.posted += 1
+			if key in self._pending:
+				self.dropped += 1
+				del self._pending[key]  # goes to the back, it is the newest now
+			self._pending[key] = (func, args)
+			self.max_depth = max(self.max_depth, len(self._pending))
+
+	def set(self, var: tk.Variable, value):
+		"""
+		var.set(value) at the next frame. Keyed by the variable, so only its latest value is shown
+		"""
+		self.post(str(var), var.set, value)
+
+	@property
+	def depth(self):
+		"""
+		:return: updates waiting for a frame
+		"""
+		return len(self._pending)
+
+	def summary(self) -> str:
+		return (f"UI updates: {self.posted} posted, {self.dropped} dropped, {self.applied} shown, depth {self.depth} "
+				f"(max {self.max_depth}), {self.over_budget}/{self.frames} frames over budget")
+
+	def _frame(self):
+		if self._pending:
+			self._flush()
+		try:
+			self.root.after(int(self.interval * 1000), self._frame)
+		except tk.TclError:  # root destroyed
+			pass
+
+	def _flush(self):
+		self.frames += 1
+		end = time.perf_counter() + self.budget
+		while time.perf_counter() < end:
+			with self._lock:
+				if not self._pending:
+					return
+				func, args = self._pending.popitem(last=False)[1]
+			try:
+				func(*args)
+			except tk.TclError:  # the display was closed after the update was posted
+				self.failed += 1
+			except Exception as e:
+				self.failed += 1
+				logger.error("UI update failed", exc_info=e)
+			else:
+				self.applied += 1
+		if self._pending:
+			self.over_budget += 1
@@ -0,0 +1,51 @@
+import re
+from typing import Callable, Dict, Hashable, List
+
+_spaces = re.compile(" +")
+_advances = {}  # type: Dict[Hashable, Dict[str, float]]  # font -> width of each character measured so far
+
+
+def wrap(text: str, line_length: float, measure: Callable[[str], float], font: Hashable) -> List[str]:
+	"""
+	Greedy word wrap. Each character is measured once per font and words are measured from those widths,
+	which is exact for the receipt fonts since they have no kerning.
+	Newlines in the text always start a new line, and words longer than a line get a line to themselves.
+
+	:param text: text to wrap
+	:param line_length: max width of a line, in the same units as measure
+	:param measure: measures the width of a string in the font
+	:param font: anything identifying the font, size and style that measure uses
+	:return: lines, each with a trailing space
+	"""
+	advances = _advances.setdefault(font, {})
+
+	def width(s):
+		total = 0.0
+		for c in s:
+			advance = advances.get(c)
+			if advance is None:
+				advance = advances[c] = measure(c)
+			total += advance
+		return total
+
+	space = width(" ")
+	lines = []
+	words = []
+	line_width = 0.0
+	text = text.replace('\r', '').replace('\n', ' \n ')  # if a \r\n was placed, normalize all to \n
+	for word in _spaces.split(text):
+		if word == '\n':  # forced newline
+			lines.append("".join(w + " " for w in words))
+			words.clear()
+			line_width = 0.0
+			continue
+		word_width = width(word)
+		if words and line_width + word_width > line_length:  # adding this word would be too long
+			lines.append("".join(w + " " for w in words))
+			words.clear()
+			line_width = 0.0
+		words.append(word)
+		line_width += word_width + space
+	if any(words):  # if theres still a bit more after the sentence ends, add it
+		lines.append("".join(w + " " for w in words))
+	return lines